@@ -0,0 +1,136 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import numpy as np
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARKS_DIR)
+
+from run import FixtureServer, read_fixture
+import api
+from poller import FeedPoller
+
+# Concurrent keep-alive clients, and requests each of them sends
+DEFAULT_CLIENTS = 200
+DEFAULT_REQUESTS_PER_CLIENT = 50
+
+# Tables the clients cycle through
+PATHS = (
+    '/nyct/trains_by_station',
+    '/nyct/feed_status',
+    '/mbta/carriages',
+    '/mbta/occupancy_by_line',
+    '/alerts/alerts',
+    '/alerts/alert_summary',
+)
+
+
+# Starts the API's pipelines against local stand-ins for the upstream feeds,
+# serving the benchmark fixtures, and waits for their first snapshots
+def start_poller(server: FixtureServer) -> FeedPoller:
+    poller = api.make_poller(
+        nyct_feed_urls={'1234567S': server.url('/nyct')},
+        mbta_vehicle_positions_url=server.url('/mbta/vehicles'),
+        mbta_alerts_url=server.url('/mbta/alerts'),
+    ).start()
+    for job in poller.jobs:
+        poller.store.get(job.name)
+    return poller
+
+
+async def _read_response(reader: asyncio.StreamReader) -> tuple[int, dict[str, str], bytes]:
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while (line := await reader.readline()) not in (b'\r\n', b''):
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get('content-length', 0)))
+    return status, headers, body
+
+
+# One client on one connection: requests the paths in turn, half of the
+# clients asking for gzip, revalidating with the ETag it last saw of each
+async def _client(port: int, client: int, num_requests: int, latencies: list[float], statuses: dict) -> None:
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    etags = {}
+    encoding = 'Accept-Encoding: gzip\r\n' if client % 2 else ''
+    try:
+        for i in range(num_requests):
+            path = PATHS[(client + i) % len(PATHS)]
+            if_none_match = f"If-None-Match: {etags[path]}\r\n" if path in etags else ''
+            start = time.perf_counter()
+            writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n{encoding}{if_none_match}\r\n".encode())
+            status, headers, _ = await _read_response(reader)
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+            if 'etag' in headers:
+                etags[path] = headers['etag']
+    finally:
+        writer.close()
+
+
+async def load_test(poller: FeedPoller, num_clients: int, requests_per_client: int) -> dict:
+    server = await api.SnapshotServer(poller).start('127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    latencies, statuses = [], {}
+    async with server:
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            _client(port, client, requests_per_client, latencies, statuses) for client in range(num_clients)
+        ))
+        elapsed = time.perf_counter() - start
+    latencies = np.array(latencies) * 1000
+    return {
+        'clients': num_clients,
+        'requests': len(latencies),
+        'statuses': statuses,
+        'requests_per_second': len(latencies) / elapsed,
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'max_ms': float(latencies.max()),
+    }
+
+
+# Time spent building one response, without the network: a full gzipped
+# body, and a 304 for a client that already has it
+def response_generation(poller: FeedPoller, repeat: int = 10_000) -> dict:
+    snapshot_server = api.SnapshotServer(poller)
+    etag = poller.store.get('mbta')['carriages'].gzip_etag
+    results = {}
+    for name, headers in (
+        ('gzip_200', {'accept-encoding': 'gzip'}),
+        ('etag_304', {'accept-encoding': 'gzip', 'if-none-match': etag}),
+    ):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            snapshot_server.respond('GET', '/mbta/carriages', headers, True)
+        results[f"{name}_us"] = (time.perf_counter() - start) / repeat * 1e6
+    return results
+
+
+# `python benchmarks/load_api.py` serves the fixture feeds through the API
+# (see src/api.py) and has many concurrent clients poll it
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test the snapshot API against local stand-in upstreams')
+    parser.add_argument('--clients', type=int, default=DEFAULT_CLIENTS)
+    parser.add_argument('--requests', type=int, default=DEFAULT_REQUESTS_PER_CLIENT, help='per client')
+    args = parser.parse_args()
+
+    with FixtureServer({
+        '/nyct': read_fixture('nyct_1234567.pb'),
+        '/mbta/vehicles': json.dumps(read_fixture('mbta_vehicle_positions.json', 'r')).encode(),
+        '/mbta/alerts?sort=-created_at': json.dumps(read_fixture('mbta_alerts.json', 'r')).encode(),
+    }) as server:
+        poller = start_poller(server)
+        try:
+            for pipeline in api.POLL_INTERVAL_SECONDS:
+                for name, table in poller.store.get(pipeline).items():
+                    print(f"{f'/{pipeline}/{name}':>28}: {len(table.body) / 1024:8.1f} KiB, "
+                          f"gzip {len(table.gzip_body) / 1024:7.1f} KiB")
+            print(json.dumps(response_generation(poller), indent=2))
+            print(json.dumps(asyncio.run(load_test(poller, args.clients, args.requests)), indent=2))
+        finally:
+            poller.stop()
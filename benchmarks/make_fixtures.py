@@ -0,0 +1,234 @@
+import os
+import sys
+import json
+import random
+import datetime
+from zoneinfo import ZoneInfo
+import pandas as pd
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(BENCHMARKS_DIR), 'src')
+sys.path.insert(0, SRC_DIR)
+
+import gtfs_realtime_NYCT_pb2 as nyct
+from gtfs_realtime_NYCT_pb2 import gtfs__realtime__pb2 as gtfs
+import schedule
+
+FIXTURES_DIR = os.path.join(BENCHMARKS_DIR, 'fixtures')
+GTFS_DIR = os.path.join(SRC_DIR, 'gtfs_subway')
+
+# Fixtures are synthetic but shaped like the real feeds, and generated from a
+# fixed seed and a fixed feed time so that every run benchmarks the same bytes
+SEED = 7
+FEED_TIMESTAMP = 1_757_000_000
+
+# Roughly what the live 1234567S feed carries at rush hour
+NYCT_TRAINS_PER_ROUTE = 35
+NYCT_STOP_TIME_UPDATES_PER_TRIP = 15
+NYCT_ROUTES = ('1', '2', '3', '4', '5', '6', '7')
+
+GTFS_TRIPS_PER_DIRECTION = 50
+
+MBTA_ROUTES = ('Orange', 'Red', 'Blue', 'Green-B', 'Green-C', 'Green-D', 'Green-E')
+MBTA_TRAINS_PER_ROUTE = 14
+MBTA_CARRIAGES_PER_TRAIN = 6
+MBTA_NUM_ALERTS = 25
+OCCUPANCY_STATUSES = (
+    'EMPTY', 'MANY_SEATS_AVAILABLE', 'FEW_SEATS_AVAILABLE',
+    'STANDING_ROOM_ONLY', 'CRUSHED_STANDING_ROOM_ONLY', 'FULL',
+)
+
+
+def route_stations(stops: pd.DataFrame, route_id: str) -> pd.DataFrame:
+    # NYCT numbers the stations of each A Division line after the line
+    return stops.loc[
+        (stops['location_type'] == '1') & stops['stop_id'].str.startswith(route_id)
+    ].sort_values(by='stop_id', ascending=False)
+
+
+# Trips of the 7 given stop times in the fixture GTFS: the weekday trips that
+# left their origin in the hour and a half before the feed time, so that the
+# 7 trains of the fixture feed can be matched to the timetable
+def fixture_trips(trips: pd.DataFrame) -> pd.DataFrame:
+    feed_time = datetime.datetime.fromtimestamp(FEED_TIMESTAMP, ZoneInfo(schedule.DEFAULT_TIMEZONE))
+    feed_seconds = feed_time.hour * 3600 + feed_time.minute * 60 + feed_time.second
+    origin_seconds = trips['trip_id'].str.split('_').str[-2].astype(int) * 60 // 100
+    return trips.loc[
+        (trips['route_id'] == '7') & (trips['service_id'] == 'Weekday')
+        & (origin_seconds <= feed_seconds) & (origin_seconds > feed_seconds - 5400)
+    ].groupby('direction_id').head(GTFS_TRIPS_PER_DIRECTION)
+
+
+# A shape for the 7 through its stations (northbound, i.e. 34 St-Hudson Yards
+# to Flushing), with ten points per station-to-station segment, and stop_times
+# for the first trips of the 7 in trips.txt; shapes.txt and stop_times.txt are
+# too large to ship with the static GTFS bundle
+def make_gtfs(stops: pd.DataFrame, trips: pd.DataFrame) -> None:
+    stations = route_stations(stops, '7')
+    lat = stations['stop_lat'].astype(float).to_numpy()
+    lon = stations['stop_lon'].astype(float).to_numpy()
+    shape_rows = []
+    for i in range(len(stations) - 1):
+        for k in range(10):
+            t = k / 10
+            shape_rows.append((lat[i] * (1 - t) + lat[i + 1] * t, lon[i] * (1 - t) + lon[i + 1] * t))
+    shape_rows.append((lat[-1], lon[-1]))
+    pd.DataFrame({
+        'shape_id': '7..N95R',
+        'shape_pt_lat': [round(point[0], 6) for point in shape_rows],
+        'shape_pt_lon': [round(point[1], 6) for point in shape_rows],
+        'shape_pt_sequence': range(len(shape_rows)),
+    }).to_csv(os.path.join(FIXTURES_DIR, 'gtfs', 'shapes.txt'), index=False)
+
+    stop_time_rows = []
+    route_trips = fixture_trips(trips)
+    for trip in route_trips.itertuples(index=False):
+        northbound = trip.direction_id == '0'
+        station_ids = list(stations['stop_id'])
+        if not northbound:
+            station_ids.reverse()
+        # Trip IDs carry the origin departure time in hundredths of a minute
+        start_seconds = int(trip.trip_id.split('_')[-2]) * 60 // 100
+        for sequence, station_id in enumerate(station_ids):
+            seconds = start_seconds + sequence * 120
+            clock = f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+            stop_time_rows.append((trip.trip_id, clock, clock, station_id + ('N' if northbound else 'S'), sequence + 1))
+    pd.DataFrame(
+        stop_time_rows,
+        columns=['trip_id', 'arrival_time', 'departure_time', 'stop_id', 'stop_sequence']
+    ).to_csv(os.path.join(FIXTURES_DIR, 'gtfs', 'stop_times.txt'), index=False)
+
+
+def make_nyct_feed(stops: pd.DataFrame, trips: pd.DataFrame, rnd: random.Random) -> bytes:
+    scheduled_trip_ids = list(schedule.realtime_trip_ids(fixture_trips(trips)['trip_id']))
+    feed_message = gtfs.FeedMessage()
+    feed_message.header.gtfs_realtime_version = '1.0'
+    feed_message.header.timestamp = FEED_TIMESTAMP
+    feed_message.header.Extensions[nyct.nyct_feed_header].nyct_subway_version = '1.0'
+    entity_id = 0
+    for route_id in NYCT_ROUTES:
+        station_ids = list(route_stations(stops, route_id)['stop_id'])
+        for train in range(NYCT_TRAINS_PER_ROUTE):
+            if route_id == '7':
+                trip_id = scheduled_trip_ids[train % len(scheduled_trip_ids)]
+                northbound = '..N' in trip_id
+            else:
+                northbound = rnd.random() < 0.5
+                trip_id = f"{rnd.randrange(0, 144000):06d}_{route_id}..{'N' if northbound else 'S'}{rnd.randrange(1, 99):02d}R"
+            suffix = 'N' if northbound else 'S'
+            position = rnd.randrange(len(station_ids))
+            upcoming = (station_ids[position:] if not northbound else station_ids[:position + 1][::-1])
+            upcoming = upcoming[:NYCT_STOP_TIME_UPDATES_PER_TRIP]
+
+            entity_id += 1
+            entity = feed_message.entity.add()
+            entity.id = f"{entity_id:06d}"
+            trip_update = entity.trip_update
+            trip_update.trip.trip_id = trip_id
+            trip_update.trip.route_id = route_id
+            trip_update.trip.start_date = '20250904'
+            for i, station_id in enumerate(upcoming):
+                stop_time_update = trip_update.stop_time_update.add()
+                stop_time_update.stop_id = station_id + suffix
+                stop_time_update.arrival.time = FEED_TIMESTAMP + 90 * (i + 1)
+                stop_time_update.departure.time = FEED_TIMESTAMP + 90 * (i + 1) + 30
+
+            entity_id += 1
+            entity = feed_message.entity.add()
+            entity.id = f"{entity_id:06d}"
+            vehicle = entity.vehicle
+            vehicle.trip.CopyFrom(trip_update.trip)
+            nyct_trip = vehicle.trip.Extensions[nyct.nyct_trip_descriptor]
+            nyct_trip.train_id = f"0{route_id} {rnd.randrange(0, 2400):04d}+ 242/SFT"
+            nyct_trip.is_assigned = True
+            nyct_trip.direction = nyct.NyctTripDescriptor.NORTH if northbound else nyct.NyctTripDescriptor.SOUTH
+            vehicle.current_status = rnd.choice((
+                gtfs.VehiclePosition.INCOMING_AT,
+                gtfs.VehiclePosition.STOPPED_AT,
+                gtfs.VehiclePosition.IN_TRANSIT_TO,
+            ))
+            vehicle.stop_id = upcoming[0] + suffix
+            vehicle.current_stop_sequence = position + 1
+            vehicle.timestamp = FEED_TIMESTAMP - rnd.randrange(0, 90)
+    return feed_message.SerializeToString()
+
+
+def make_mbta_vehicle_positions(rnd: random.Random) -> dict:
+    entity = []
+    for route_id in MBTA_ROUTES:
+        for train in range(MBTA_TRAINS_PER_ROUTE):
+            label = rnd.randrange(1400, 1550)
+            carriages = []
+            for sequence in range(1, MBTA_CARRIAGES_PER_TRAIN + 1):
+                carriage = {
+                    'label': str(label + sequence - 1),
+                    'carriage_sequence': sequence,
+                    'occupancy_status': rnd.choice(OCCUPANCY_STATUSES),
+                }
+                # The feed omits occupancy_percentage for cars without sensors
+                if rnd.random() < 0.9:
+                    carriage['occupancy_percentage'] = rnd.randrange(0, 101)
+                carriages.append(carriage)
+            trip_id = f"{rnd.randrange(68000000, 69000000)}" if rnd.random() < 0.95 else f"NONREV-{rnd.randrange(1000, 9999)}"
+            entity.append({
+                'id': f"{FEED_TIMESTAMP}_{route_id}_{train}",
+                'vehicle': {
+                    'current_status': rnd.choice(('STOPPED_AT', 'INCOMING_AT', 'IN_TRANSIT_TO')),
+                    'current_stop_sequence': rnd.randrange(1, 200),
+                    'multi_carriage_details': carriages,
+                    'occupancy_status': rnd.choice(OCCUPANCY_STATUSES),
+                    'position': {
+                        'bearing': rnd.randrange(0, 360),
+                        'latitude': round(42.30 + rnd.random() * 0.1, 5),
+                        'longitude': round(-71.12 + rnd.random() * 0.1, 5),
+                    },
+                    'stop_id': str(rnd.randrange(70001, 70280)),
+                    'timestamp': FEED_TIMESTAMP - rnd.randrange(0, 60),
+                    'trip': {
+                        'direction_id': rnd.randrange(0, 2),
+                        'route_id': route_id,
+                        'schedule_relationship': 'SCHEDULED',
+                        'start_date': '20250904',
+                        'trip_id': trip_id,
+                    },
+                    'vehicle': {'id': f"O-{label:05d}", 'label': str(label)},
+                },
+            })
+    return {
+        'header': {'gtfs_realtime_version': '2.0', 'incrementality': 'FULL_DATASET', 'timestamp': FEED_TIMESTAMP},
+        'entity': entity,
+    }
+
+
+def make_mbta_alerts(rnd: random.Random) -> dict:
+    return {
+        'data': [
+            {
+                'id': str(600000 + i),
+                'type': 'alert',
+                'attributes': {
+                    'created_at': f"2025-09-04T{8 + i // 60:02d}:{i % 60:02d}:00-04:00",
+                    'service_effect': rnd.choice(('Orange Line delay', 'Red Line shuttle', 'Elevator closure')),
+                    'severity': rnd.randrange(0, 11),
+                    'short_header': 'Delays of about 10 minutes due to a disabled train',
+                    'url': 'https://www.mbta.com/alerts/subway',
+                },
+            }
+            for i in range(MBTA_NUM_ALERTS)
+        ]
+    }
+
+
+# `python benchmarks/make_fixtures.py` regenerates every fixture
+if __name__ == '__main__':
+    rnd = random.Random(SEED)
+    stops = pd.read_csv(os.path.join(GTFS_DIR, 'stops.txt'), dtype=str)
+    trips = pd.read_csv(os.path.join(GTFS_DIR, 'trips.txt'), dtype=str)
+    os.makedirs(os.path.join(FIXTURES_DIR, 'gtfs'), exist_ok=True)
+    make_gtfs(stops, trips)
+    with open(os.path.join(FIXTURES_DIR, 'nyct_1234567.pb'), 'wb') as f:
+        f.write(make_nyct_feed(stops, trips, rnd))
+    with open(os.path.join(FIXTURES_DIR, 'mbta_vehicle_positions.json'), 'w') as f:
+        json.dump(make_mbta_vehicle_positions(rnd), f)
+    with open(os.path.join(FIXTURES_DIR, 'mbta_alerts.json'), 'w') as f:
+        json.dump(make_mbta_alerts(rnd), f)
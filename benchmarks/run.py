@@ -0,0 +1,342 @@
+import os
+import sys
+import copy
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import pandas as pd
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(BENCHMARKS_DIR), 'src')
+sys.path.insert(0, SRC_DIR)
+
+import http_client
+import nyct_decoder
+import gtfs_cache
+import geometry
+import train_positions
+import schedule
+import journey
+import snapshot_diff
+from mbta_vehicles import VehicleSnapshot, carriage_details, flatten_feed
+import mbta_occupancy
+from mbta_alerts import parse_alerts
+
+FIXTURES_DIR = os.path.join(BENCHMARKS_DIR, 'fixtures')
+
+# Route the NYCT stages aggregate and place trains for (the fixture GTFS has its shape)
+ROUTE_ID = '7'
+
+# Origin-destination pairs planned by the journey_queries stage
+NUM_JOURNEY_QUERIES = 100
+
+# Share of trains the snapshot_diff stage moves between two snapshots
+SNAPSHOT_CHURN = 0.05
+
+DEFAULT_REPEAT = 20
+DEFAULT_SCALES = (1, 10, 100)
+
+
+####################################
+# Fixtures
+####################################
+
+def read_fixture(name: str, mode: str = 'rb'):
+    with open(os.path.join(FIXTURES_DIR, name), mode) as f:
+        return f.read() if mode == 'rb' else json.load(f)
+
+
+# Multiplies the vehicles and trip updates of a NYCT feed, giving every copy
+# its own trip_id so the copies aren't collapsed into one train downstream
+def scale_nyct_feed(content: bytes, scale: int) -> bytes:
+    feed_message = nyct_decoder.parse_feed_message(content)
+    entities = list(feed_message.entity)
+    for copy_number in range(1, scale):
+        for entity in entities:
+            scaled = feed_message.entity.add()
+            scaled.CopyFrom(entity)
+            scaled.id = f"{entity.id}.{copy_number}"
+            trip = scaled.vehicle.trip if scaled.HasField('vehicle') else scaled.trip_update.trip
+            trip.trip_id = f"{trip.trip_id}.{copy_number}"
+    return feed_message.SerializeToString()
+
+
+def scale_entities(entities: list, scale: int, trip_path: tuple[str, ...]) -> list:
+    scaled_entities = list(entities)
+    for copy_number in range(1, scale):
+        for entity in entities:
+            scaled = copy.deepcopy(entity)
+            scaled['id'] = f"{entity['id']}.{copy_number}"
+            if trip_path:
+                trip = scaled
+                for key in trip_path:
+                    trip = trip[key]
+                trip['trip_id'] = f"{trip['trip_id']}.{copy_number}"
+            scaled_entities.append(scaled)
+    return scaled_entities
+
+
+# A GTFS directory holding the static GTFS of the repo, with the fixture
+# shapes.txt and stop_times.txt (not shipped with the repo) in place of any
+# local ones so that every run builds the same geometry
+def make_gtfs_dir() -> str:
+    gtfs_dir = tempfile.mkdtemp(prefix='transit-benchmark-gtfs-')
+    for file_name in os.listdir(gtfs_cache.GTFS_DIR):
+        if file_name.endswith('.txt'):
+            shutil.copy(os.path.join(gtfs_cache.GTFS_DIR, file_name), gtfs_dir)
+    for file_name in os.listdir(os.path.join(FIXTURES_DIR, 'gtfs')):
+        shutil.copy(os.path.join(FIXTURES_DIR, 'gtfs', file_name), gtfs_dir)
+    return gtfs_dir
+
+
+# Serves fixture bodies from memory on localhost, standing in for the feed
+# endpoints so that the fetch stage measures the client, not the network
+class FixtureServer:
+
+    def __init__(self, bodies: dict[str, bytes]):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = bodies.get(self.path)
+                if body is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def url(self, path: str) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}{path}"
+
+    def __enter__(self) -> 'FixtureServer':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+####################################
+# Measurement
+####################################
+
+# Runs fn repeat times and returns latency statistics (in milliseconds) and
+# the peak memory allocated by one extra, traced run. The traced run is kept
+# out of the timings since tracemalloc slows allocation-heavy code down.
+def measure(fn, repeat: int) -> dict:
+    fn()  # warm-up
+    timings = np.empty(repeat)
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings[i] = time.perf_counter() - start
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    timings *= 1000
+    return {
+        'repeat': repeat,
+        'mean_ms': float(timings.mean()),
+        'p50_ms': float(np.percentile(timings, 50)),
+        'p95_ms': float(np.percentile(timings, 95)),
+        'min_ms': float(timings.min()),
+        'max_ms': float(timings.max()),
+        'peak_bytes': int(peak_bytes),
+    }
+
+
+####################################
+# Stages
+####################################
+
+# Stages that don't depend on feed size: loading and preprocessing static GTFS
+def static_stages(gtfs_dir: str) -> dict:
+    gtfs_cache.compile_all(gtfs_dir)
+    tables = {
+        table: gtfs_cache.load_table(table, gtfs_dir=gtfs_dir)
+        for table in ('shapes', 'trips', 'stop_times', 'stops', 'routes', 'calendar', 'calendar_dates', 'transfers')
+    }
+    planner = make_journey_planner(tables)
+    # Journeys between random pairs of stations, leaving at the fixture feed time
+    rng = np.random.default_rng(0)
+    journey_pairs = rng.choice(np.array(planner.stations), size=(NUM_JOURNEY_QUERIES, 2))
+    when = nyct_decoder.parse_feed_message(read_fixture('nyct_1234567.pb')).header.timestamp
+    return {
+        'gtfs_load_csv': lambda: [
+            pd.read_csv(os.path.join(gtfs_dir, f"{table}.txt"), dtype=str)
+            for table in ('shapes', 'trips', 'stop_times', 'stops', 'routes')
+        ],
+        'gtfs_load_cache': lambda: [
+            gtfs_cache.load_table(table, gtfs_dir=gtfs_dir)
+            for table in ('shapes', 'trips', 'stop_times', 'stops', 'routes')
+        ],
+        'route_geometry': lambda: geometry.build_route_geometries(
+            geometry.sorted_shape_points(tables['shapes']),
+            tables['trips'][['route_id', 'trip_id', 'shape_id', 'direction_id']],
+            tables['stop_times'][['trip_id', 'stop_id']],
+            tables['stops'],
+            tables['routes'],
+        ),
+        'schedule_index': lambda: make_schedule_index(tables),
+        'journey_planner': lambda: make_journey_planner(tables),
+        'journey_queries': lambda: [planner.plan(origin, destination, when) for origin, destination in journey_pairs],
+    }
+
+
+def make_schedule_index(tables: dict[str, pd.DataFrame]) -> schedule.ScheduleIndex:
+    return schedule.ScheduleIndex(
+        tables['stop_times'], tables['trips'], tables['calendar'], tables['calendar_dates']
+    )
+
+
+def make_journey_planner(tables: dict[str, pd.DataFrame]) -> journey.JourneyPlanner:
+    return journey.JourneyPlanner(
+        make_schedule_index(tables), tables['stop_times'], tables['stops'], tables['transfers']
+    )
+
+
+# Stages run on every poll or render, over a feed scale times the fixture's size
+def feed_stages(scale: int, gtfs_dir: str, server: FixtureServer) -> tuple[dict, dict]:
+    nyct_content = scale_nyct_feed(read_fixture('nyct_1234567.pb'), scale)
+    mbta_feed = read_fixture('mbta_vehicle_positions.json', 'r')
+    mbta_feed['entity'] = scale_entities(mbta_feed['entity'], scale, ('vehicle', 'trip'))
+    alerts = read_fixture('mbta_alerts.json', 'r')
+    alerts['data'] = scale_entities(alerts['data'], scale, ())
+
+    stops = gtfs_cache.load_table('stops', ['stop_id', 'parent_station'], gtfs_dir=gtfs_dir)
+    route = geometry.build_route_geometries(
+        geometry.sorted_shape_points(gtfs_cache.load_table('shapes', gtfs_dir=gtfs_dir)),
+        gtfs_cache.load_table('trips', ['route_id', 'trip_id', 'shape_id', 'direction_id'], gtfs_dir=gtfs_dir),
+        gtfs_cache.load_table('stop_times', ['trip_id', 'stop_id'], gtfs_dir=gtfs_dir),
+        gtfs_cache.load_table('stops', gtfs_dir=gtfs_dir),
+        gtfs_cache.load_table('routes', gtfs_dir=gtfs_dir),
+    )[ROUTE_ID]
+    positions = nyct_decoder.to_dataframe(nyct_decoder.decode_vehicle_positions(nyct_content))
+    route_positions = positions.loc[positions['route_id'] == ROUTE_ID]
+    latest = train_positions.latest_positions(route_positions)
+    train_counts = train_positions.count_trains_by_station(latest, stops, route).reset_index()
+    # The next snapshot, with SNAPSHOT_CHURN of the trains one stop further
+    all_latest = train_positions.latest_positions(positions)
+    churned = all_latest.copy()
+    churned_rows = np.arange(0, len(churned), round(1 / SNAPSHOT_CHURN))
+    churned.iloc[churned_rows, churned.columns.get_loc('stop_id')] = np.roll(
+        churned['stop_id'].to_numpy(dtype=object)[churned_rows], 1
+    )
+    schedule_index = make_schedule_index({
+        table: gtfs_cache.load_table(table, gtfs_dir=gtfs_dir)
+        for table in ('stop_times', 'trips', 'calendar', 'calendar_dates')
+    })
+    snapshot = VehicleSnapshot(None)
+    snapshot.load(mbta_feed)
+    vehicles = snapshot.get_vehicles()
+
+    server_bodies = {
+        f"/nyct/{scale}": nyct_content,
+        f"/mbta/vehicles/{scale}": json.dumps(mbta_feed).encode(),
+    }
+    sizes = {
+        'nyct_entities': len(nyct_decoder.parse_feed_message(nyct_content).entity),
+        'nyct_bytes': len(nyct_content),
+        'mbta_vehicles': len(vehicles),
+        'mbta_bytes': len(server_bodies[f"/mbta/vehicles/{scale}"]),
+        'alerts': len(alerts['data']),
+    }
+    return {
+        'fetch': lambda: http_client.fetch_many([
+            server.url(f"/nyct/{scale}"), server.url(f"/mbta/vehicles/{scale}")
+        ]),
+        'nyct_decode': lambda: nyct_decoder.to_dataframe(nyct_decoder.decode_vehicle_positions(nyct_content)),
+        'train_aggregation': lambda: train_positions.count_trains_by_station(
+            train_positions.latest_positions(route_positions), stops, route
+        ),
+        'train_placement': lambda: route.place_trains(
+            train_counts['parent_station'].to_numpy(),
+            train_counts['current_status'].to_numpy(),
+            train_counts['direction'].to_numpy(),
+        ),
+        'train_display': lambda: train_positions.display_positions(
+            train_positions.count_trains_by_station(latest, stops, route), route
+        ),
+        'snapshot_diff': lambda: snapshot_diff.diff_positions(all_latest, churned),
+        'schedule_delays': lambda: schedule_index.delays(route_positions),
+        'mbta_snapshot_index': lambda: VehicleSnapshot(None).load(mbta_feed),
+        'carriage_details': lambda: [carriage_details(vehicle) for vehicle in vehicles],
+        'fleet_occupancy': lambda: mbta_occupancy.occupancy_by_line(
+            mbta_occupancy.fleet_carriages(flatten_feed(mbta_feed))
+        ),
+        'alert_parsing': lambda: parse_alerts(alerts),
+    }, {'sizes': sizes, 'server_bodies': server_bodies}
+
+
+def environment() -> dict:
+    import google.protobuf
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'protobuf': google.protobuf.__version__,
+    }
+
+
+# `python benchmarks/run.py` times each stage of the dashboards' pipelines on
+# the fixture feeds (see make_fixtures.py), at 1x, 10x and 100x their size, and
+# writes the results to a JSON file for comparison across changes
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the stages of the transit dashboards')
+    parser.add_argument('--output', default=os.path.join(BENCHMARKS_DIR, 'results.json'))
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    parser.add_argument('--scales', default=','.join(map(str, DEFAULT_SCALES)),
+                        help='comma-separated multiples of the fixture feed sizes')
+    parser.add_argument('--stages', default=None, help='comma-separated stages to run (default: all)')
+    args = parser.parse_args()
+    scales = [int(scale) for scale in args.scales.split(',')]
+    selected = set(args.stages.split(',')) if args.stages else None
+
+    results = []
+    def record(stage: str, scale: int | None, fn, sizes: dict | None = None) -> None:
+        if selected is not None and stage not in selected:
+            return
+        result = {'stage': stage, 'scale': scale, **(sizes or {}), **measure(fn, args.repeat)}
+        results.append(result)
+        print(f"{stage:>20} {'' if scale is None else f'x{scale}':>5}: "
+              f"mean {result['mean_ms']:9.3f} ms  p50 {result['p50_ms']:9.3f} ms  "
+              f"p95 {result['p95_ms']:9.3f} ms  peak {result['peak_bytes'] / 1024:10.1f} KiB")
+
+    gtfs_dir = make_gtfs_dir()
+    try:
+        for stage, fn in static_stages(gtfs_dir).items():
+            record(stage, None, fn)
+
+        server_bodies = {}
+        with FixtureServer(server_bodies) as server:
+            for scale in scales:
+                stages, info = feed_stages(scale, gtfs_dir, server)
+                server_bodies.update(info['server_bodies'])
+                for stage, fn in stages.items():
+                    record(stage, scale, fn, info['sizes'])
+    finally:
+        shutil.rmtree(gtfs_dir, ignore_errors=True)
+
+    with open(args.output, 'w') as f:
+        json.dump({'environment': environment(), 'results': results}, f, indent=2)
+    print(f"wrote {args.output}")
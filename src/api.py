@@ -0,0 +1,229 @@
+import os
+import gzip
+import time
+import asyncio
+import hashlib
+from dataclasses import dataclass
+from email.utils import formatdate
+from typing import Callable
+import metrics
+import cli
+from poller import FeedPoller, PollJob
+
+# Address the API listens on
+HOST = os.environ.get('TRANSIT_API_HOST', '127.0.0.1')
+PORT = int(os.environ.get('TRANSIT_API_PORT', '8080'))
+
+# How often (in seconds) each pipeline is run, as in the dashboards
+POLL_INTERVAL_SECONDS = {
+    'nyct': 15,
+    'mbta': 10,
+    'alerts': 60,
+}
+
+# Bodies are compressed once per poll, so the highest level costs nothing per request
+GZIP_LEVEL = 9
+
+# Longest request line or header line accepted, in bytes
+MAX_LINE_BYTES = 8192
+
+# Most header lines accepted per request
+MAX_HEADERS = 100
+
+_REASONS = {
+    200: 'OK',
+    304: 'Not Modified',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    503: 'Service Unavailable',
+}
+
+
+# One table of a poll, encoded once for every client: its JSON body and the
+# gzipped body, the ETag of each, and the time it was computed (as an HTTP
+# date). Responses only add a status line and a few headers to these bytes.
+@dataclass(frozen=True)
+class EncodedTable:
+    body: bytes
+    gzip_body: bytes
+    etag: str
+    gzip_etag: str
+    last_modified: str
+
+
+def encode_table(frame, published_at: float) -> EncodedTable:
+    body = frame.to_json(orient='records', date_format='iso').encode()
+    digest = hashlib.blake2b(body, digest_size=16).hexdigest()
+    return EncodedTable(
+        body=body,
+        gzip_body=gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0),
+        etag=f'"{digest}"',
+        gzip_etag=f'"{digest}-gzip"',
+        last_modified=formatdate(published_at, usegmt=True),
+    )
+
+
+# Runs a pipeline's step and encodes every table it produces, by table name
+def encoded_step(step: Callable[[], dict]) -> Callable[[], dict[str, EncodedTable]]:
+    def run() -> dict[str, EncodedTable]:
+        tables = step()
+        published_at = time.time()
+        return {table: encode_table(frame, published_at) for table, frame in tables.items()}
+    return run
+
+
+# Sets up the pipelines (see cli) and polls each of them in the background.
+# The URLs replace the upstream feeds, e.g. with local stand-ins for load tests.
+def make_poller(pipelines: tuple[str, ...] = tuple(POLL_INTERVAL_SECONDS),
+                nyct_feed_urls: dict[str, str] | None = None,
+                mbta_vehicle_positions_url: str = cli.MBTA_VEHICLE_POSITIONS_URL,
+                mbta_alerts_url: str = cli.MBTA_ALERTS_URL) -> FeedPoller:
+    setups = {
+        'nyct': lambda: cli.setup_nyct(once=False, feed_urls=nyct_feed_urls),
+        'mbta': lambda: cli.setup_mbta(once=False, vehicle_positions_url=mbta_vehicle_positions_url),
+        'alerts': lambda: cli.setup_alerts(once=False, alerts_url=mbta_alerts_url),
+    }
+    return FeedPoller([
+        PollJob(pipeline, encoded_step(setups[pipeline]()), POLL_INTERVAL_SECONDS[pipeline])
+        for pipeline in pipelines
+    ])
+
+
+def _accepts_gzip(accept_encoding: str) -> bool:
+    for coding in accept_encoding.split(','):
+        name, _, params = coding.partition(';')
+        if name.strip().lower() in ('gzip', '*'):
+            return params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000')
+    return False
+
+
+def _response(status: int, headers: list[tuple[str, str]], body: bytes = b'', head: bool = False) -> bytes:
+    lines = [f"HTTP/1.1 {status} {_REASONS[status]}"]
+    lines += [f"{name}: {value}" for name, value in headers]
+    if status != 304:
+        lines.append(f"Content-Length: {len(body)}")
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + (b'' if head else body)
+
+
+def _error(status: int, message: str, keep_alive: bool) -> bytes:
+    return _response(status, [
+        ('Content-Type', 'text/plain; charset=utf-8'),
+        ('Connection', 'keep-alive' if keep_alive else 'close'),
+    ], message.encode())
+
+
+# Serves the latest encoded tables of every pipeline polled into store, at
+# /<pipeline>/<table> (e.g. /nyct/trains_by_station). Clients that send the
+# table's ETag in If-None-Match get a 304, and those that accept gzip get the
+# pre-compressed body. Connections are kept alive (HTTP/1.1), so a client
+# polling the API pays for one connection, not one per request.
+class SnapshotServer:
+
+    def __init__(self, poller: FeedPoller):
+        self.poller = poller
+        self.pipelines = [job.name for job in poller.jobs]
+        self.cache_seconds = {job.name: int(job.interval_seconds) for job in poller.jobs}
+
+    # Returns the whole response to one request
+    def respond(self, method: str, target: str, headers: dict[str, str], keep_alive: bool) -> bytes:
+        if method not in ('GET', 'HEAD'):
+            return _error(405, 'Only GET and HEAD are supported', keep_alive)
+        path = target.split('?', 1)[0].strip('/')
+        pipeline, _, table = path.partition('/')
+        if pipeline not in self.pipelines:
+            return _error(404, f"Unknown pipeline: {pipeline}", keep_alive)
+        try:
+            tables = self.poller.store.get(pipeline, timeout=0)
+        except LookupError as e:
+            cause = f": {e.__cause__!r}" if e.__cause__ is not None else ''
+            return _error(503, f"No snapshot of {pipeline} yet{cause}", keep_alive)
+        if table not in tables:
+            return _error(404, f"Unknown table: {path} (tables: {', '.join(tables)})", keep_alive)
+
+        encoded = tables[table]
+        use_gzip = _accepts_gzip(headers.get('accept-encoding', ''))
+        etag = encoded.gzip_etag if use_gzip else encoded.etag
+        response_headers = [
+            ('ETag', etag),
+            ('Last-Modified', encoded.last_modified),
+            ('Cache-Control', f"max-age={self.cache_seconds[pipeline]}"),
+            ('Vary', 'Accept-Encoding'),
+            ('Connection', 'keep-alive' if keep_alive else 'close'),
+        ]
+        if_none_match = headers.get('if-none-match')
+        if if_none_match is not None and (
+            if_none_match.strip() == '*' or etag in (tag.strip() for tag in if_none_match.split(','))
+        ):
+            return _response(304, response_headers)
+        response_headers.insert(0, ('Content-Type', 'application/json'))
+        if use_gzip:
+            response_headers.append(('Content-Encoding', 'gzip'))
+            return _response(200, response_headers, encoded.gzip_body, head=method == 'HEAD')
+        return _response(200, response_headers, encoded.body, head=method == 'HEAD')
+
+    # Reads requests off one connection until the client closes it or asks to
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                    if len(headers) > MAX_HEADERS:
+                        break
+                start = time.perf_counter()
+                parts = request_line.decode('latin-1').split()
+                if len(parts) != 3 or len(headers) > MAX_HEADERS:
+                    writer.write(_error(400, 'Malformed request', keep_alive=False))
+                    await writer.drain()
+                    break
+                method, target, version = parts
+                connection = headers.get('connection', '').lower()
+                keep_alive = connection == 'keep-alive' if version == 'HTTP/1.0' else connection != 'close'
+                writer.write(self.respond(method, target, headers, keep_alive))
+                if metrics.ENABLED:
+                    metrics.record('api_response', time.perf_counter() - start)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, ValueError, asyncio.LimitOverrunError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host: str = HOST, port: int = PORT) -> asyncio.Server:
+        return await asyncio.start_server(self.handle, host, port, limit=MAX_LINE_BYTES)
+
+
+async def serve(poller: FeedPoller, host: str = HOST, port: int = PORT) -> None:
+    server = await SnapshotServer(poller).start(host, port)
+    async with server:
+        await server.serve_forever()
+
+
+# `python src/api.py` serves the pipelines' snapshots as JSON on HOST:PORT
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Serve the transit pipelines\' snapshots as a JSON API')
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--pipeline', action='append', choices=list(POLL_INTERVAL_SECONDS),
+                        help='serve this pipeline (repeatable; default: all)')
+    args = parser.parse_args()
+
+    if metrics.ENABLED:
+        metrics.serve()
+    poller = make_poller(tuple(args.pipeline or POLL_INTERVAL_SECONDS)).start()
+    print(f"serving {', '.join(job.name for job in poller.jobs)} on http://{args.host}:{args.port}/")
+    try:
+        asyncio.run(serve(poller, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,224 @@
+import os
+import gzip
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+import numpy as np
+import pandas as pd
+import nyct_decoder
+from mbta_vehicles import flatten_feed
+
+# Archived feeds are recognized by extension (optionally gzipped, e.g. .pb.gz):
+# NYCT GTFS-realtime protobuf dumps, and MBTA VehiclePositions.json files
+NYCT_EXTENSIONS = ('.pb',)
+MBTA_EXTENSIONS = ('.json',)
+
+# Files decoded per task. Each task writes its own part files, so a shard
+# should hold enough rows to make reasonably sized Parquet files.
+DEFAULT_FILES_PER_SHARD = 64
+
+
+# Files, rows (by table) and failures of one or more shards
+@dataclass
+class DecodeReport:
+    files: int = 0
+    bytes: int = 0
+    rows: dict[str, int] = field(default_factory=dict)
+    failed: list[tuple[str, str]] = field(default_factory=list)  # (path, error)
+    seconds: float = 0.0
+
+    def add(self, other: 'DecodeReport') -> None:
+        self.files += other.files
+        self.bytes += other.bytes
+        for table, rows in other.rows.items():
+            self.rows[table] = self.rows.get(table, 0) + rows
+        self.failed += other.failed
+
+    @property
+    def files_per_second(self) -> float:
+        return self.files / self.seconds if self.seconds else 0.0
+
+
+def _feed_kind(path: str) -> str | None:
+    name = path[:-len('.gz')] if path.endswith('.gz') else path
+    if name.endswith(NYCT_EXTENSIONS):
+        return 'nyct'
+    if name.endswith(MBTA_EXTENSIONS):
+        return 'mbta'
+    return None
+
+
+# Every archived feed file under the given files and directories, sorted by
+# path (so that each shard covers a contiguous stretch of the archive), with
+# its source: its path relative to the directory it was found under (e.g.
+# '2024-05-01/nyct.pb'), or its file name if it was given itself
+def find_archive_files(paths: list[str]) -> list[tuple[str, str]]:
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dir_path, _, file_names in os.walk(path):
+                found += [
+                    (os.path.join(dir_path, file_name), os.path.relpath(os.path.join(dir_path, file_name), path))
+                    for file_name in file_names
+                ]
+        else:
+            found.append((path, os.path.basename(path)))
+    return sorted(file for file in found if _feed_kind(file[0]) is not None)
+
+
+def _read(path: str) -> bytes:
+    with open(path, 'rb') as f:
+        content = f.read()
+    return gzip.decompress(content) if path.endswith('.gz') else content
+
+
+# The columns of each file's tables also hold, on every row, the feed's
+# header timestamp ('feed_timestamp') and the file's path within the archive ('source').
+def _add_file_columns(columns: dict[str, np.ndarray], num_rows: int,
+                      feed_timestamp: int, source: str) -> dict[str, np.ndarray]:
+    columns['feed_timestamp'] = np.full(num_rows, feed_timestamp, dtype=np.int64)
+    columns['source'] = np.full(num_rows, source, dtype=object)
+    return columns
+
+
+# Vehicle positions of one NYCT dump, decoded as the live feeds are (see
+# nyct_decoder), plus the train ID of each trip and whether a train is assigned to it
+def decode_nyct_file(content: bytes, source: str) -> dict[str, dict[str, np.ndarray]]:
+    feed_message = nyct_decoder.parse_feed_message(content)
+    positions = nyct_decoder.decode_vehicle_positions(feed_message, train_columns=True)
+    return {'nyct_vehicle_positions': _add_file_columns(
+        positions, len(positions['trip_id']), feed_message.header.timestamp, source
+    )}
+
+
+# Vehicles and carriages of one MBTA VehiclePositions file, flattened as when
+# recording them (see mbta_vehicles.flatten_feed). Carriages carry their
+# vehicle's trip, route and vehicle IDs in place of its row number.
+def decode_mbta_file(content: bytes, source: str) -> dict[str, dict[str, np.ndarray]]:
+    columns = flatten_feed(json.loads(content))
+    feed_timestamp = int(columns.pop('header_timestamp')[0])
+    carriages = {
+        name.removeprefix('carriage.'): columns.pop(name)
+        for name in list(columns) if name.startswith('carriage.')
+    }
+    vehicle = carriages.pop('vehicle')
+    carriages = {
+        'trip_id': columns['trip_id'][vehicle],
+        'route_id': columns['route_id'][vehicle],
+        'vehicle_id': columns['vehicle_id'][vehicle],
+        **carriages,
+    }
+    return {
+        'mbta_vehicles': _add_file_columns(columns, len(columns['trip_id']), feed_timestamp, source),
+        'mbta_carriages': _add_file_columns(carriages, len(vehicle), feed_timestamp, source),
+    }
+
+
+DECODERS = {
+    'nyct': decode_nyct_file,
+    'mbta': decode_mbta_file,
+}
+
+# Columns stored as dictionary-encoded categories (few distinct values, many rows)
+CATEGORICAL_COLUMNS = ('route_id', 'direction', 'current_status', 'occupancy_status', 'source',
+                       'origin', 'destination')
+
+
+# One shard's rows of a table, from the columns of each of its files,
+# concatenated once (rather than building a DataFrame per file). NYCT trains
+# also get the origin and destination their train IDs name.
+def _shard_frame(table: str, pieces: list[dict[str, np.ndarray]]) -> pd.DataFrame:
+    columns = {name: np.concatenate([piece[name] for piece in pieces]) for name in pieces[0]}
+    if table == 'nyct_vehicle_positions':
+        columns['origin'], columns['destination'] = nyct_decoder.train_origin_destination(columns['train_id'])
+        frame = nyct_decoder.to_dataframe(columns)
+        for name in columns:
+            if name not in frame.columns:
+                frame[name] = columns[name]
+        frame['is_assigned'] = frame['is_assigned'].astype('boolean')
+    else:
+        frame = pd.DataFrame(columns)
+    return frame.astype({column: 'category' for column in CATEGORICAL_COLUMNS if column in frame.columns})
+
+
+# Writes a table to <out_dir>/<table>/date=<UTC date of its feeds>/part-<shard>.parquet
+def _write_partitions(frame: pd.DataFrame, out_dir: str, table: str, shard: int) -> None:
+    days = frame['feed_timestamp'].to_numpy() // 86400
+    for day, rows in frame.groupby(days, sort=True).indices.items():
+        date = pd.Timestamp(int(day) * 86400, unit='s', tz='UTC').strftime('%Y-%m-%d')
+        partition_dir = os.path.join(out_dir, table, f"date={date}")
+        os.makedirs(partition_dir, exist_ok=True)
+        frame.iloc[rows].to_parquet(os.path.join(partition_dir, f"part-{shard:05d}.parquet"), index=False)
+
+
+# Decodes one shard of the archive and writes its partitions. Runs in a worker
+# process, so only the report travels back, never the decoded rows.
+# A file that fails to decode is reported and skipped.
+def decode_shard(shard: int, files: list[tuple[str, str]], out_dir: str) -> DecodeReport:
+    report = DecodeReport()
+    pieces = {}
+    for path, source in files:
+        try:
+            content = _read(path)
+            tables = DECODERS[_feed_kind(path)](content, source)
+        except Exception as e:
+            report.failed.append((path, repr(e)))
+            continue
+        report.files += 1
+        report.bytes += len(content)
+        for table, columns in tables.items():
+            pieces.setdefault(table, []).append(columns)
+    for table, table_pieces in pieces.items():
+        frame = _shard_frame(table, table_pieces)
+        report.rows[table] = len(frame)
+        if len(frame):
+            _write_partitions(frame, out_dir, table, shard)
+    return report
+
+
+# Decodes every archived feed under paths into partitioned Parquet tables in
+# out_dir, sharding the files across a pool of worker processes (or decoding
+# them in this process, with workers=1). Shards are independent, so throughput
+# grows with the number of cores until the disk is the bottleneck.
+def decode_archive(paths: list[str], out_dir: str, workers: int | None = None,
+                   files_per_shard: int = DEFAULT_FILES_PER_SHARD) -> DecodeReport:
+    files = find_archive_files(paths)
+    shards = [files[start:start + files_per_shard] for start in range(0, len(files), files_per_shard)]
+    workers = workers or os.cpu_count() or 1
+    report = DecodeReport()
+    start = time.perf_counter()
+    if workers == 1:
+        for shard, shard_files in enumerate(shards):
+            report.add(decode_shard(shard, shard_files, out_dir))
+    else:
+        with ProcessPoolExecutor(min(workers, max(len(shards), 1))) as pool:
+            futures = [pool.submit(decode_shard, shard, shard_files, out_dir) for shard, shard_files in enumerate(shards)]
+            for future in as_completed(futures):
+                report.add(future.result())
+    report.seconds = time.perf_counter() - start
+    return report
+
+
+# `python src/archive_decode.py ARCHIVE... --out DIR` decodes archived feeds
+# in bulk and reports throughput
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Decode archived NYCT and MBTA feeds into partitioned Parquet')
+    parser.add_argument('paths', nargs='+', help='archive directories or files (.pb, .json, optionally .gz)')
+    parser.add_argument('--out', required=True, help='output directory (must be empty or missing)')
+    parser.add_argument('--workers', type=int, default=None, help='decoding processes (default: one per core)')
+    parser.add_argument('--files-per-shard', type=int, default=DEFAULT_FILES_PER_SHARD)
+    args = parser.parse_args()
+
+    # Part files are named by shard, so leftovers of an earlier run would mix in
+    if os.path.isdir(args.out) and os.listdir(args.out):
+        parser.error(f"{args.out} is not empty")
+    report = decode_archive(args.paths, args.out, args.workers, args.files_per_shard)
+    for table, rows in sorted(report.rows.items()):
+        print(f"{table:>24}: {rows} rows")
+    for path, error in report.failed:
+        print(f"failed: {path}: {error}")
+    print(f"{report.files} files ({report.bytes / 1e6:.1f} MB) in {report.seconds:.2f} s: "
+          f"{report.files_per_second:.1f} files/s, {report.bytes / 1e6 / report.seconds if report.seconds else 0:.1f} MB/s")
@@ -0,0 +1,94 @@
+import math
+from functools import lru_cache
+
+# Height (in px) of a carriage's body text; the wheels are a quarter of it
+CARRIAGE_SIZE_PX = 100
+
+OCCUPANCY_STATUS_COLORS = {
+    'EMPTY': "#00f2ffd5",
+    'MANY_SEATS_AVAILABLE': '#b3ffb3',
+    'FEW_SEATS_AVAILABLE': "#ffff99",
+    'STANDING_ROOM_ONLY': "#ffc800",
+    'CRUSHED_STANDING_ROOM_ONLY': "#f0837d",
+    'FULL': "#ff00d0b4",
+    'NOT_ACCEPTING_PASSENGERS': "#9b9b9b",
+    'NO_DATA_AVAILABLE': '#9b9b9b',
+    'NOT_BOARDABLE': '#9b9b9b'
+}
+
+# Fragments memoized per (label, occupancy_percentage, occupancy_status).
+# A fleet has a few thousand carriages, whose occupancy moves in steps of 1%.
+FRAGMENT_CACHE_SIZE = 8192
+
+
+# Styles shared by every carriage and legend entry, injected once per page
+# instead of being inlined in every block. Each status sets --status-color.
+STYLE = (
+    "<style>"
+    ".trains{display:flex;flex-direction:column;gap:16px;}"
+    ".train-title{font-weight:bold;margin:0;}"
+    ".train-cars{display:flex;flex-direction:row;gap:8px;}"
+    ".train{flex:1;}"
+    ".train-body{"
+    f"font-size:{CARRIAGE_SIZE_PX}px;"
+    "display:flex;flex-direction:column;justify-content:center;align-items:center;"
+    "border-style:solid;border-radius:25px;background-color:var(--status-color);}"
+    ".train-body p{margin:0;}"
+    ".train-body .car-label{font-size:20px;}"
+    ".train-wheels{display:flex;flex-direction:row;justify-content:space-evenly;}"
+    ".train-wheel{"
+    f"height:{CARRIAGE_SIZE_PX // 4}px;width:{CARRIAGE_SIZE_PX // 4}px;"
+    "border-style:solid;border-radius:50px;background-color:var(--status-color);}"
+    ".legend-entry{display:flex;flex-direction:row;align-items:center;}"
+    ".legend-swatch{color:var(--status-color);font-size:40px;-webkit-text-stroke:2px black;}"
+    + ''.join(f".status-{status}{{--status-color:{color};}}" for status, color in OCCUPANCY_STATUS_COLORS.items())
+    + "</style>"
+)
+
+
+def _format_percentage(occupancy_percentage: float) -> str:
+    if occupancy_percentage is None or (isinstance(occupancy_percentage, float) and math.isnan(occupancy_percentage)):
+        return '–'
+    return f"{occupancy_percentage:g}<small>%</small>"
+
+
+# One carriage: its body (occupancy and car number) on two wheels, in the
+# status's color. Percentages may be NaN (not reported).
+@lru_cache(maxsize=FRAGMENT_CACHE_SIZE)
+def _carriage_html(label: str, percentage_text: str, occupancy_status: str) -> str:
+    return (
+        f'<div class="train status-{occupancy_status}">'
+        f'<div class="train-body"><p>{percentage_text}</p><p class="car-label">Car #{label}</p></div>'
+        '<div class="train-wheels"><div class="train-wheel"></div><div class="train-wheel"></div></div>'
+        '</div>'
+    )
+
+def carriage_html(label: str, occupancy_percentage: float, occupancy_status: str) -> str:
+    return _carriage_html(label, _format_percentage(occupancy_percentage), occupancy_status)
+
+
+# A whole train, its carriages (label, occupancy_percentage, occupancy_status)
+# in order, as one block
+def train_html(carriages: list[tuple[str, float, str]], title: str | None = None) -> str:
+    title_html = f'<p class="train-title">{title}</p>' if title is not None else ''
+    return (
+        f'<div>{title_html}<div class="train-cars">'
+        + ''.join(carriage_html(*carriage) for carriage in carriages)
+        + '</div></div>'
+    )
+
+
+# Many trains, each a (title, carriages) pair, stacked in one block
+def trains_html(trains: list[tuple[str, list[tuple[str, float, str]]]]) -> str:
+    return '<div class="trains">' + ''.join(train_html(carriages, title) for title, carriages in trains) + '</div>'
+
+
+# The occupancy status color legend
+@lru_cache(maxsize=1)
+def legend_html() -> str:
+    return ''.join(
+        f'<span class="legend-entry status-{occupancy_status}">'
+        f'<span class="legend-swatch">◼︎</span>{occupancy_status.replace("_", " ").capitalize()}'
+        '</span>'
+        for occupancy_status in OCCUPANCY_STATUS_COLORS
+    )
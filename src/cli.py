@@ -0,0 +1,240 @@
+import os
+import sys
+import time
+import argparse
+import importlib.util
+from typing import Callable
+
+# `python src/cli.py <pipeline>` runs the dashboards' pipelines headlessly and
+# writes their outputs as JSON or Parquet snapshots, once or on a loop (e.g.
+# from cron or for batch consumers). Only the standard library is imported
+# up front: each pipeline imports pandas, protobuf etc. when it is set up,
+# and the time that takes is reported, so `--help` and argument errors are instant.
+STARTED_AT = time.perf_counter()
+
+# Snapshots are written under this directory, one subdirectory per pipeline
+OUTPUT_DIR = os.environ.get('TRANSIT_SNAPSHOT_DIR', 'snapshots')
+
+# Same feeds as mbta.py
+MBTA_VEHICLE_POSITIONS_URL = 'https://cdn.mbta.com/realtime/VehiclePositions.json'
+MBTA_ALERTS_URL = 'https://api-v3.mbta.com/alerts'
+
+# Alerts more severe than this are counted in the alert summary, as in mbta.py
+HIGH_ALERT_SEVERITY = 5
+
+FORMATS = ('json', 'parquet')
+
+# Modules each format needs beyond pandas
+FORMAT_MODULES = {
+    'parquet': 'pyarrow',
+}
+
+
+def _log(message: str) -> None:
+    print(message, file=sys.stderr, flush=True)
+
+
+# Formats whose modules are installed. Checked (without importing them) when
+# the arguments are parsed, so a missing module fails the run before any
+# pipeline is set up rather than after its first run.
+def available_formats() -> tuple[str, ...]:
+    return tuple(
+        format for format in FORMATS
+        if format not in FORMAT_MODULES or importlib.util.find_spec(FORMAT_MODULES[format]) is not None
+    )
+
+
+####################################
+# Pipelines
+####################################
+
+# Each pipeline is set up once (imports and static data) and returns a step
+# that produces its tables, by name, on each run. routes limits it to those
+# routes (default: every route); a single run (once) may wait longer for feeds
+# than a loop would.
+
+# Trains at each station of each NYCT line, from one system-wide snapshot,
+# plus the freshness of each feed
+def setup_nyct(routes: list[str] | None = None, once: bool = True,
+               feed_urls: dict[str, str] | None = None) -> Callable[[], dict]:
+    import pandas as pd
+    import gtfs_cache
+    import geometry
+    import nyct_ingest
+    import train_positions
+
+    route_geometries = geometry.build_route_geometries(
+        geometry.sorted_shape_points(gtfs_cache.load_table('shapes')),
+        gtfs_cache.load_table('trips', ['route_id', 'trip_id', 'shape_id', 'direction_id']),
+        gtfs_cache.load_table('stop_times', ['trip_id', 'stop_id']),
+        gtfs_cache.load_table('stops'),
+        gtfs_cache.load_table('routes'),
+    )
+    stops = gtfs_cache.load_table('stops', ['stop_id', 'parent_station'])
+    unknown = [route_id for route_id in routes or [] if route_id not in route_geometries]
+    if unknown:
+        raise SystemExit(f"Unknown NYCT routes: {', '.join(unknown)}")
+    # Express variants are counted with their line
+    route_ids = routes or [
+        route_id for route_id in route_geometries
+        if not (route_id.endswith(nyct_ingest.EXPRESS_ROUTE_SUFFIX)
+                and route_id[:-len(nyct_ingest.EXPRESS_ROUTE_SUFFIX)] in route_geometries)
+    ]
+    ingestor = nyct_ingest.NyctIngestor(feed_urls or nyct_ingest.NYCT_FEED_URLS)
+
+    def step() -> dict:
+        # A single run waits for every feed; a loop publishes what arrived in time
+        snapshot = ingestor.refresh(timeout=None if once else nyct_ingest.REFRESH_TIMEOUT_SECONDS)
+        tables = []
+        for route_id in route_ids:
+            route = route_geometries[route_id]
+            train_counts = train_positions.count_trains_by_station(
+                train_positions.latest_positions(snapshot.line(route_id)), stops, route
+            ).reset_index()
+            train_counts['lat'], train_counts['lon'] = route.place_trains(
+                train_counts['parent_station'].to_numpy(),
+                train_counts['current_status'].to_numpy(),
+                train_counts['direction'].to_numpy(),
+            )
+            train_counts['stop_name'] = route.stations['stop_name'].reindex(
+                train_counts['parent_station'].astype(str)
+            ).to_numpy()
+            train_counts.insert(0, 'route_id', route_id)
+            tables.append(train_counts.astype({'current_status': str, 'direction': str}))
+        return {
+            'trains_by_station': pd.concat(tables, ignore_index=True),
+            'feed_status': pd.DataFrame([vars(status) for status in snapshot.feed_status.values()]),
+        }
+    return step
+
+
+# Occupancy of every carriage of every MBTA revenue trip, and its rollups by
+# line and by carriage position, from one VehiclePositions snapshot
+def setup_mbta(routes: list[str] | None = None, once: bool = True,
+               vehicle_positions_url: str = MBTA_VEHICLE_POSITIONS_URL) -> Callable[[], dict]:
+    import mbta_occupancy
+    from mbta_vehicles import VehicleSnapshot, flatten_feed
+
+    vehicle_snapshot = VehicleSnapshot(vehicle_positions_url)
+
+    def step() -> dict:
+        vehicle_snapshot.refresh(force=True)
+        carriages = mbta_occupancy.fleet_carriages(flatten_feed({
+            'header': vehicle_snapshot.header,
+            'entity': vehicle_snapshot.entity,
+        }))
+        if routes:
+            carriages = carriages.loc[carriages['route_id'].isin(routes)].assign(
+                route_id=lambda selected: selected['route_id'].cat.remove_unused_categories()
+            )
+        return {
+            'carriages': carriages.astype({'route_id': str, 'occupancy_status': str}),
+            'occupancy_by_line': mbta_occupancy.occupancy_by_line(carriages).reset_index(),
+            'occupancy_by_position': mbta_occupancy.occupancy_by_position(carriages).reset_index(),
+        }
+    return step
+
+
+# Active MBTA alerts, newest first, and the summary the alerts monitor shows
+def setup_alerts(routes: list[str] | None = None, once: bool = True,
+                 alerts_url: str = MBTA_ALERTS_URL) -> Callable[[], dict]:
+    import pandas as pd
+    import http_client
+    from mbta_alerts import parse_alerts
+
+    url = f"{alerts_url}?sort=-created_at"
+    if routes:
+        url += f"&route={','.join(routes)}"
+
+    def step() -> dict:
+        alerts = pd.DataFrame(
+            parse_alerts(http_client.get_json(url)),
+            columns=['created_at', 'service_effect', 'short_header', 'severity', 'url'],
+        ).astype({'severity': 'int64'})
+        severity = alerts['severity']
+        return {
+            'alerts': alerts,
+            'alert_summary': pd.DataFrame([{
+                'active_alerts': len(alerts),
+                'average_severity': severity.mean() if len(alerts) else None,
+                'highest_severity': severity.max() if len(alerts) else None,
+                f"above_severity_{HIGH_ALERT_SEVERITY}": int((severity > HIGH_ALERT_SEVERITY).sum()),
+            }]),
+        }
+    return step
+
+
+PIPELINES = {
+    'nyct': setup_nyct,
+    'mbta': setup_mbta,
+    'alerts': setup_alerts,
+}
+
+
+####################################
+# Output
+####################################
+
+# Writes each table to <out_dir>/<table>.<format> (with the run's UTC time in
+# the name if timestamped), through a temporary file moved into place, so
+# readers never see a partial snapshot
+def write_tables(tables: dict, out_dir: str, format: str, timestamped: bool) -> list[str]:
+    os.makedirs(out_dir, exist_ok=True)
+    suffix = time.strftime('.%Y%m%dT%H%M%SZ', time.gmtime()) if timestamped else ''
+    paths = []
+    for table, frame in tables.items():
+        path = os.path.join(out_dir, f"{table}{suffix}.{format}")
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        if format == 'json':
+            frame.to_json(temp_path, orient='records', date_format='iso')
+        else:
+            frame.to_parquet(temp_path, index=False)
+        os.replace(temp_path, path)
+        paths.append(path)
+    return paths
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description='Write snapshots of the transit pipelines without the dashboards')
+    parser.add_argument('pipeline', choices=list(PIPELINES))
+    parser.add_argument('--route', action='append',
+                        help='only this route (repeatable; default: every route)')
+    parser.add_argument('--out', default=OUTPUT_DIR, help='output directory (a subdirectory per pipeline)')
+    parser.add_argument('--format', choices=available_formats(), default='json',
+                        help='parquet needs pyarrow')
+    parser.add_argument('--interval', type=float, default=None,
+                        help='run every this many seconds instead of once')
+    parser.add_argument('--count', type=int, default=None, help='stop after this many runs (with --interval)')
+    parser.add_argument('--timestamped', action='store_true',
+                        help='keep every snapshot, named by its time, instead of replacing the last one')
+    args = parser.parse_args(argv)
+
+    setup_start = time.perf_counter()
+    step = PIPELINES[args.pipeline](args.route, once=args.interval is None)
+    _log(f"{args.pipeline}: set up in {time.perf_counter() - setup_start:.2f} s "
+         f"({time.perf_counter() - STARTED_AT:.2f} s since start)")
+
+    out_dir = os.path.join(args.out, args.pipeline)
+    runs = 0
+    while True:
+        run_start = time.perf_counter()
+        try:
+            paths = write_tables(step(), out_dir, args.format, args.timestamped)
+        except Exception as e:
+            # A failed run ends a single run, but a loop carries on with the next one
+            if args.interval is None:
+                raise
+            _log(f"{args.pipeline}: run failed: {e!r}")
+        else:
+            _log(f"{args.pipeline}: wrote {', '.join(paths)} in {time.perf_counter() - run_start:.2f} s")
+        runs += 1
+        if args.interval is None or (args.count is not None and runs >= args.count):
+            break
+        time.sleep(max(0.0, args.interval - (time.perf_counter() - run_start)))
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
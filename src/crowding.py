@@ -0,0 +1,312 @@
+import os
+import math
+import time
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Iterator
+import numpy as np
+import cv2
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Network definition shipped with the project (MobileNet-SSD trained on VOC, see README)
+PROTOTXT_PATH = os.path.join(SRC_DIR, 'deploy.prototxt')
+
+# Trained weights for that network. They are not in the repo (see README for
+# where to download them); set TRANSIT_CROWDING_WEIGHTS or pass weights_path.
+WEIGHTS_PATH = os.environ.get('TRANSIT_CROWDING_WEIGHTS', os.path.join(SRC_DIR, 'MobileNetSSD_deploy.caffemodel'))
+
+# Input the network was trained on: 300x300 BGR, scaled to (pixel - 127.5) / 127.5
+INPUT_SIZE = (300, 300)
+INPUT_MEAN = 127.5
+INPUT_SCALE = 1 / 127.5
+
+# Index of 'person' among the 21 VOC classes the network detects (0 is background)
+PERSON_CLASS_ID = 15
+
+# Detections less confident than this are not counted
+DEFAULT_CONFIDENCE = 0.5
+
+# Frames per blob, i.e. per forward pass of the network
+DEFAULT_BATCH_SIZE = 8
+
+# Threads decoding images ahead of inference (OpenCV releases the GIL while decoding)
+DEFAULT_DECODE_THREADS = 4
+
+# With adaptive skipping, at least every MAX_FRAME_STRIDE-th frame is still counted
+MAX_FRAME_STRIDE = 30
+
+# Frame rate assumed for videos that do not report theirs
+DEFAULT_VIDEO_FPS = 30.0
+
+# How often (in seconds) a background reader waiting on a full buffer checks
+# whether its consumer has stopped
+BACKGROUND_POLL_SECONDS = 0.1
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+# Number of people the network found in one frame of a source
+@dataclass(frozen=True)
+class FrameCount:
+    frame: int          # index of the frame in its source (a video's frames, or a directory's sorted images)
+    seconds: float      # position of the frame in the source, at the source's frame rate
+    people: int
+
+
+# Counts people in frames with MobileNet-SSD, on the CPU
+class PersonCounter:
+
+    def __init__(self, weights_path: str = WEIGHTS_PATH, prototxt_path: str = PROTOTXT_PATH,
+                 confidence: float = DEFAULT_CONFIDENCE):
+        self.net = cv2.dnn.readNetFromCaffe(prototxt_path, weights_path)
+        self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        self.confidence = confidence
+
+    # Returns the number of people in each frame of a batch, all passed through
+    # the network as one blob. Frames are best already resized to INPUT_SIZE.
+    def count(self, frames: list[np.ndarray]) -> np.ndarray:
+        self.net.setInput(cv2.dnn.blobFromImages(frames, INPUT_SCALE, INPUT_SIZE, INPUT_MEAN))
+        # One row per detection in the batch: image, class, confidence, box
+        detections = self.net.forward().reshape(-1, 7)
+        people = (detections[:, 1] == PERSON_CLASS_ID) & (detections[:, 2] >= self.confidence)
+        return np.bincount(detections[people, 0].astype(np.int64), minlength=len(frames))[:len(frames)]
+
+
+# Each worker process of a pipeline loads its own copy of the network once
+_worker_counter = None
+
+def _init_worker(weights_path: str, prototxt_path: str, confidence: float, num_threads: int) -> None:
+    global _worker_counter
+    cv2.setNumThreads(num_threads)
+    _worker_counter = PersonCounter(weights_path, prototxt_path, confidence)
+
+def _count_in_worker(frames: list[np.ndarray]) -> np.ndarray:
+    return _worker_counter.count(frames)
+
+
+def _resize(frame: np.ndarray) -> np.ndarray:
+    return cv2.resize(frame, INPUT_SIZE, interpolation=cv2.INTER_AREA)
+
+def _load_image(path: str) -> np.ndarray:
+    frame = cv2.imread(path)
+    if frame is None:
+        raise OSError(f"Cannot decode image {path}")
+    return _resize(frame)
+
+
+# Decodes every stride()-th image of a sorted list, up to depth images ahead
+# of the consumer, on a thread pool. Yields (index, image) in order.
+def _read_images(paths: list[str], stride: Callable[[], int], pool: Executor,
+                 depth: int) -> Iterator[tuple[int, np.ndarray]]:
+    pending = deque()
+    next_index = 0
+    while next_index < len(paths) or pending:
+        while next_index < len(paths) and len(pending) < depth:
+            pending.append((next_index, pool.submit(_load_image, paths[next_index])))
+            next_index += stride()
+        index, image = pending.popleft()
+        yield index, image.result()
+
+
+# Decodes every stride()-th frame of a video. Skipped frames are only
+# grabbed, not converted to images. Yields (index, frame) in order.
+def _read_video(capture: cv2.VideoCapture, stride: Callable[[], int]) -> Iterator[tuple[int, np.ndarray]]:
+    index = 0
+    while True:
+        ok, frame = capture.read()
+        if not ok:
+            return
+        yield index, _resize(frame)
+        skip = stride() - 1
+        for _ in range(skip):
+            if not capture.grab():
+                return
+        index += 1 + skip
+
+
+# Runs an iterator on a background thread, up to depth items ahead of the
+# consumer. Closing the returned iterator (e.g. when the consumer stops
+# early) stops the thread and waits for it, so that whatever it reads from
+# can then be released.
+def _in_background(items: Iterator, depth: int) -> Iterator:
+    done = object()
+    buffer = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    # Waits for room in the buffer, giving up once the consumer has stopped
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=BACKGROUND_POLL_SECONDS)
+                return True
+            except queue.Full:
+                pass
+        return False
+    def produce() -> None:
+        try:
+            for item in items:
+                if not put(item):
+                    return
+        except BaseException as e:
+            put(e)
+            return
+        put(done)
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while (item := buffer.get()) is not done:
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+# Counts people in the frames of a video file or a directory of images, all on
+# the CPU. Frames are decoded (and resized) ahead of inference on background
+# threads, and batched into blobs that are passed through the network by a
+# pool of worker processes, each with its own copy of the network.
+# With adaptive skipping, the pipeline counts every stride-th frame, with the
+# stride adjusted after every batch so counting keeps pace with the source's
+# frame rate (e.g. to watch a live recording). Without it, every frame is counted.
+class CrowdingPipeline:
+
+    def __init__(self, weights_path: str = WEIGHTS_PATH, prototxt_path: str = PROTOTXT_PATH,
+                 confidence: float = DEFAULT_CONFIDENCE, batch_size: int = DEFAULT_BATCH_SIZE,
+                 workers: int = 1, decode_threads: int = DEFAULT_DECODE_THREADS,
+                 adaptive: bool = True, max_stride: int = MAX_FRAME_STRIDE):
+        self.weights_path = weights_path
+        self.prototxt_path = prototxt_path
+        self.confidence = confidence
+        self.batch_size = batch_size
+        self.workers = workers
+        self.decode_threads = decode_threads
+        self.adaptive = adaptive
+        self.max_stride = max_stride
+        self.stride = 1
+        self.frames_counted = 0
+        self.elapsed_seconds = 0.0
+        self._counter = None
+
+    # Frames counted per second of the latest run
+    @property
+    def fps(self) -> float:
+        return self.frames_counted / self.elapsed_seconds if self.elapsed_seconds else 0.0
+
+    def _adapt_stride(self, source_fps: float | None) -> None:
+        if not self.adaptive or not source_fps or not self.frames_counted:
+            return
+        self.stride = min(self.max_stride, max(1, math.ceil(source_fps / self.fps)))
+
+    # Yields the number of people in every counted frame of source (a video
+    # file or a directory of images), in order. source_fps is the rate frames
+    # are to be kept pace with: a video's own by default, none for images.
+    def run(self, source: str, source_fps: float | None = None) -> Iterator[FrameCount]:
+        self.stride = 1
+        self.frames_counted = 0
+        self.elapsed_seconds = 0.0
+        stride = lambda: self.stride
+
+        # Everything set up here is shut down or released in the finally,
+        # including when setting up the rest fails (e.g. on missing weights)
+        decode_pool = capture = frames = infer_pool = None
+        # Batches in flight: (frame indices, counts or a future of them)
+        in_flight = deque()
+        def finish_batch() -> Iterator[FrameCount]:
+            indices, counts = in_flight.popleft()
+            if infer_pool is not None:
+                counts = counts.result()
+            self.frames_counted += len(indices)
+            self.elapsed_seconds = time.perf_counter() - start
+            self._adapt_stride(source_fps)
+            for index, people in zip(indices, counts.tolist()):
+                yield FrameCount(index, index * seconds_per_frame, people)
+
+        try:
+            if os.path.isdir(source):
+                paths = sorted(
+                    os.path.join(source, name) for name in os.listdir(source)
+                    if name.lower().endswith(IMAGE_EXTENSIONS)
+                )
+                decode_pool = ThreadPoolExecutor(self.decode_threads)
+                frames = _read_images(paths, stride, decode_pool, depth=2 * self.batch_size * max(1, self.workers))
+                seconds_per_frame = 1 / source_fps if source_fps else 0.0
+            else:
+                capture = cv2.VideoCapture(source)
+                if not capture.isOpened():
+                    raise OSError(f"Cannot open video {source}")
+                video_fps = capture.get(cv2.CAP_PROP_FPS) or DEFAULT_VIDEO_FPS
+                source_fps = source_fps or video_fps
+                frames = _in_background(_read_video(capture, stride), depth=2 * self.batch_size * max(1, self.workers))
+                seconds_per_frame = 1 / video_fps
+
+            if self.workers > 1:
+                infer_pool = ProcessPoolExecutor(
+                    self.workers,
+                    initializer=_init_worker,
+                    initargs=(self.weights_path, self.prototxt_path, self.confidence,
+                              max(1, (os.cpu_count() or 1) // self.workers)),
+                )
+                count = lambda batch: infer_pool.submit(_count_in_worker, batch)
+            else:
+                if self._counter is None:
+                    self._counter = PersonCounter(self.weights_path, self.prototxt_path, self.confidence)
+                count = lambda batch: self._counter.count(batch)
+
+            start = time.perf_counter()
+            indices, batch = [], []
+            for index, frame in frames:
+                indices.append(index)
+                batch.append(frame)
+                if len(batch) == self.batch_size:
+                    in_flight.append((indices, count(batch)))
+                    indices, batch = [], []
+                    if len(in_flight) > max(1, self.workers):
+                        yield from finish_batch()
+            if batch:
+                in_flight.append((indices, count(batch)))
+            while in_flight:
+                yield from finish_batch()
+        finally:
+            # Stops the readers (joining the video's reader thread) before
+            # anything they read from is shut down or released
+            if frames is not None:
+                frames.close()
+            if infer_pool is not None:
+                infer_pool.shutdown(cancel_futures=True)
+            if decode_pool is not None:
+                decode_pool.shutdown(cancel_futures=True)
+            if capture is not None:
+                capture.release()
+
+
+# `python src/crowding.py <video or image directory>` prints the number of
+# people in each counted frame, then the frames counted per second
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Count people on platforms in recorded video or images')
+    parser.add_argument('source', help='video file or directory of images')
+    parser.add_argument('--weights', default=WEIGHTS_PATH, help='MobileNet-SSD .caffemodel')
+    parser.add_argument('--confidence', type=float, default=DEFAULT_CONFIDENCE)
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--workers', type=int, default=1, help='inference processes')
+    parser.add_argument('--source-fps', type=float, default=None,
+                        help='frame rate to keep pace with (default: the video\'s own)')
+    parser.add_argument('--no-skip', action='store_true', help='count every frame')
+    args = parser.parse_args()
+
+    pipeline = CrowdingPipeline(
+        args.weights, confidence=args.confidence, batch_size=args.batch_size,
+        workers=args.workers, adaptive=not args.no_skip,
+    )
+    print('frame\tseconds\tpeople')
+    for frame_count in pipeline.run(args.source, args.source_fps):
+        print(f"{frame_count.frame}\t{frame_count.seconds:.2f}\t{frame_count.people}")
+    print(f"{pipeline.frames_counted} frames in {pipeline.elapsed_seconds:.2f} s: "
+          f"{pipeline.fps:.1f} fps (stride {pipeline.stride})")
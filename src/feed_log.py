@@ -0,0 +1,163 @@
+import io
+import os
+import glob
+import time
+import struct
+import threading
+import numpy as np
+
+# Segments are closed and a new one started once they grow past this size
+SEGMENT_MAX_BYTES = 64 * 1024 * 1024
+
+SEGMENT_SUFFIX = '.seg'
+
+# Record frame: payload length, then recording time (POSIX seconds)
+_FRAME_HEADER = struct.Struct('<Id')
+
+# Name of the column holding the strings a record adds to the segment dictionary
+_DICTIONARY_COLUMN = '__dictionary__'
+
+
+# Appends snapshots (dicts of 1-D columns, not necessarily of equal length)
+# to an append-only log of segment files. Each record is a length-prefixed,
+# deflated .npz. To stay compact:
+#   - string columns are dictionary-encoded against a dictionary shared by the
+#     whole segment; a record carries only the strings new to the segment,
+#     so IDs repeated across polls cost a few bytes each
+#   - '*timestamp' integer columns are delta-encoded against the record time
+# Appending is one compressed write of a few KB, cheap enough for every poll.
+class FeedLogWriter:
+
+    def __init__(self, log_dir: str, feed: str, segment_max_bytes: int = SEGMENT_MAX_BYTES):
+        self.log_dir = log_dir
+        self.feed = feed
+        self.segment_max_bytes = segment_max_bytes
+        self._file = None
+        self._dictionary = {}
+        self._lock = threading.Lock()
+        os.makedirs(log_dir, exist_ok=True)
+
+    def _open_segment(self, recorded_at: float) -> None:
+        if self._file is not None:
+            self._file.close()
+        path = os.path.join(self.log_dir, f"{self.feed}-{int(recorded_at * 1000):015d}{SEGMENT_SUFFIX}")
+        self._file = open(path, 'ab')
+        self._dictionary = {}
+
+    def _encode(self, columns: dict[str, np.ndarray], recorded_at: float) -> dict[str, np.ndarray]:
+        encoded = {}
+        additions = []
+        for name, values in columns.items():
+            values = np.asarray(values)
+            if values.dtype.kind in 'OUS':
+                strings = np.array(['' if value is None else str(value) for value in values.tolist()], dtype=object)
+                uniques, inverse = np.unique(strings.astype(str), return_inverse=True)
+                unique_codes = np.empty(len(uniques), dtype=np.int32)
+                for i, value in enumerate(uniques.tolist()):
+                    code = self._dictionary.get(value)
+                    if code is None:
+                        code = self._dictionary[value] = len(self._dictionary)
+                        additions.append(value)
+                    unique_codes[i] = code
+                encoded[f"{name}.codes"] = unique_codes[inverse.reshape(-1)]
+            elif values.dtype.kind in 'iu' and name.endswith('timestamp'):
+                encoded[f"{name}.delta"] = (values.astype(np.int64) - int(recorded_at)).astype(np.int32)
+            else:
+                encoded[name] = values
+        encoded[_DICTIONARY_COLUMN] = np.array(additions, dtype=str)
+        return encoded
+
+    def append(self, columns: dict[str, np.ndarray], recorded_at: float | None = None) -> None:
+        recorded_at = time.time() if recorded_at is None else recorded_at
+        with self._lock:
+            if self._file is None or self._file.tell() >= self.segment_max_bytes:
+                self._open_segment(recorded_at)
+            buffer = io.BytesIO()
+            np.savez_compressed(buffer, **self._encode(columns, recorded_at))
+            payload = buffer.getvalue()
+            self._file.write(_FRAME_HEADER.pack(len(payload), recorded_at))
+            self._file.write(payload)
+            self._file.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def segment_paths(log_dir: str, feed: str) -> list[str]:
+    return sorted(glob.glob(os.path.join(log_dir, f"{feed}-*{SEGMENT_SUFFIX}")))
+
+
+def _decode(encoded, dictionary: list[str], recorded_at: float) -> dict[str, np.ndarray]:
+    dictionary.extend(encoded[_DICTIONARY_COLUMN].tolist())
+    lookup = np.array(dictionary, dtype=object)
+    columns = {}
+    for key in encoded.files:
+        if key == _DICTIONARY_COLUMN:
+            continue
+        if key.endswith('.codes'):
+            columns[key[:-len('.codes')]] = lookup[encoded[key]] if len(lookup) else np.array([], dtype=object)
+        elif key.endswith('.delta'):
+            columns[key[:-len('.delta')]] = encoded[key].astype(np.int64) + int(recorded_at)
+        else:
+            columns[key] = encoded[key]
+    return columns
+
+
+# Recording and replay are switched on for the apps with environment variables:
+#   TRANSIT_RECORD_DIR: record every polled snapshot to this directory
+#   TRANSIT_REPLAY_DIR: serve snapshots recorded in this directory instead of the live feeds
+#   TRANSIT_REPLAY_SPEED: playback speed, as a multiple of real time (default 1)
+RECORD_DIR = os.environ.get('TRANSIT_RECORD_DIR')
+REPLAY_DIR = os.environ.get('TRANSIT_REPLAY_DIR')
+REPLAY_SPEED = float(os.environ.get('TRANSIT_REPLAY_SPEED', 1))
+
+
+# Yields (recorded_at, columns) for every record of the feed, oldest first.
+# A partially written record at the end of a segment is ignored.
+def read_records(log_dir: str, feed: str):
+    for path in segment_paths(log_dir, feed):
+        dictionary = []
+        with open(path, 'rb') as f:
+            while True:
+                header = f.read(_FRAME_HEADER.size)
+                if len(header) < _FRAME_HEADER.size:
+                    break
+                length, recorded_at = _FRAME_HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length:
+                    break
+                with np.load(io.BytesIO(payload)) as encoded:
+                    yield recorded_at, _decode(encoded, dictionary, recorded_at)
+
+
+# Plays a recorded feed back against the wall clock, speed times faster than
+# it was recorded. current() returns the latest record that would have been
+# seen by now, so it can stand in for a live fetch on every poll. Playback
+# stays on the last record once the log is exhausted.
+class FeedReplay:
+
+    def __init__(self, log_dir: str, feed: str, speed: float = 1.0):
+        self.speed = speed
+        self._records = read_records(log_dir, feed)
+        self._current = next(self._records, None)
+        if self._current is None:
+            raise LookupError(f"No recorded {feed} snapshots in {log_dir}")
+        self._next = next(self._records, None)
+        self._recording_start = self._current[0]
+        self._replay_start = time.monotonic()
+        self._lock = threading.Lock()
+
+    # Recording time the replay has reached
+    def position(self) -> float:
+        return self._recording_start + (time.monotonic() - self._replay_start) * self.speed
+
+    def current(self) -> tuple[float, dict[str, np.ndarray]]:
+        with self._lock:
+            position = self.position()
+            while self._next is not None and self._next[0] <= position:
+                self._current = self._next
+                self._next = next(self._records, None)
+            return self._current
@@ -0,0 +1,419 @@
+from dataclasses import dataclass
+import numpy as np
+import pandas as pd
+import metrics
+
+# How many shape points before a train's next stop it is drawn, by status
+INCOMING_AT_SHAPE_OFFSET = 1
+IN_TRANSIT_TO_SHAPE_OFFSET = 5
+
+# Stations further than this (in degrees) from every point of a shape are
+# considered off the shape, e.g. stations on another branch of the same route
+MAX_STATION_DISTANCE_FROM_SHAPE = 0.001
+
+# Direction a shape runs in, by the trips' direction_id (NYCT GTFS)
+DIRECTION_ID_NAMES = {0: 'NORTH', 1: 'SOUTH'}
+
+# Direction letter of NYCT shape IDs, after the route and its dots:
+# '7..N95R' runs north, 'GS.S01R' south
+SHAPE_DIRECTION_PATTERN = r'^[^.]*\.+([NS])'
+SHAPE_DIRECTION_NAMES = {'N': 'NORTH', 'S': 'SOUTH'}
+
+
+# Returns the points of every shape as one frame sorted by shape and sequence,
+# so the points of any one shape form a contiguous run of rows
+def sorted_shape_points(shapes: pd.DataFrame) -> pd.DataFrame:
+    return shapes.reset_index()[
+        ['shape_id', 'shape_pt_lat', 'shape_pt_lon', 'shape_pt_sequence']
+    ].sort_values(by=['shape_id', 'shape_pt_sequence'], ignore_index=True)
+
+
+# Returns one row per (route_id, parent_station) for every station served by
+# any trip of the route, with the station's coordinates
+def served_stations_by_route(trips: pd.DataFrame,
+                             stop_times: pd.DataFrame,
+                             stops: pd.DataFrame) -> pd.DataFrame:
+    served_stop_ids = stop_times[['trip_id', 'stop_id']].merge(
+        trips[['trip_id', 'route_id']],
+        on='trip_id'
+    )[['route_id', 'stop_id']].drop_duplicates()
+    station_coords = stops.loc[
+        stops['parent_station'].notna(),
+        ['stop_id', 'parent_station', 'stop_lat', 'stop_lon']
+    ]
+    return served_stop_ids.merge(station_coords, on='stop_id')[
+        ['route_id', 'parent_station', 'stop_lat', 'stop_lon']
+    ].astype({'route_id': str, 'parent_station': str}).drop_duplicates(
+        subset=['route_id', 'parent_station'],
+        ignore_index=True
+    )
+
+
+# Returns the route each shape belongs to. Not every shape in shapes.txt is
+# referenced by a trip, so shapes without trips fall back to the route prefix
+# of NYCT shape IDs (e.g. '7..N95R' belongs to route '7').
+def shape_routes(shape_ids: np.ndarray, trips: pd.DataFrame) -> dict[str, str]:
+    routes = {
+        shape_id: shape_id.split('.')[0]
+        for shape_id in np.unique(np.asarray(shape_ids, dtype=str))
+    }
+    trip_shapes = trips[['shape_id', 'route_id']].dropna().astype(str).drop_duplicates('shape_id')
+    routes.update(zip(trip_shapes['shape_id'], trip_shapes['route_id']))
+    return routes
+
+
+# Returns the direction ('NORTH' or 'SOUTH') each shape runs in, from the
+# direction_id of its trips where trips has one, otherwise from the direction
+# letter of its NYCT shape ID. Shapes with neither are left out.
+def shape_directions(shape_ids: np.ndarray, trips: pd.DataFrame) -> dict[str, str]:
+    shape_ids = pd.Series(np.unique(np.asarray(shape_ids, dtype=str)))
+    letters = shape_ids.str.extract(SHAPE_DIRECTION_PATTERN)[0]
+    directions = {
+        shape_id: SHAPE_DIRECTION_NAMES[letter]
+        for shape_id, letter in zip(shape_ids, letters) if isinstance(letter, str)
+    }
+    if 'direction_id' in trips.columns:
+        trip_shapes = trips[['shape_id', 'direction_id']].dropna().drop_duplicates('shape_id')
+        directions.update(
+            (str(shape_id), DIRECTION_ID_NAMES[int(direction_id)])
+            for shape_id, direction_id in zip(trip_shapes['shape_id'], trip_shapes['direction_id'])
+            if int(direction_id) in DIRECTION_ID_NAMES
+        )
+    return directions
+
+
+# Builds the index used to place trains: for every shape and every station of
+# its route that lies on it, the station's coordinates and the position (row
+# offset within the shape) of the closest shape point, along with the
+# [shape_start, shape_end) row range of the shape itself.
+# Indexed by (shape_id, parent_station).
+def build_stop_shape_index(shape_points: pd.DataFrame,
+                           routes_by_shape: dict[str, str],
+                           route_stations: pd.DataFrame) -> pd.DataFrame:
+    shape_ids = shape_points['shape_id'].astype(str).to_numpy()
+    shape_lat = shape_points['shape_pt_lat'].to_numpy(dtype=float)
+    shape_lon = shape_points['shape_pt_lon'].to_numpy(dtype=float)
+    # shape_points is sorted by shape, so each shape is the slice [start, end)
+    boundaries = np.flatnonzero(shape_ids[1:] != shape_ids[:-1]) + 1
+    starts = np.concatenate(([0], boundaries)).astype(np.int64)
+    ends = np.concatenate((boundaries, [len(shape_ids)])).astype(np.int64)
+    stations_by_route = dict(tuple(route_stations.groupby('route_id', sort=False)))
+
+    pieces = []
+    for shape_id, start, end in zip(shape_ids[starts], starts, ends):
+        stations = stations_by_route.get(routes_by_shape.get(shape_id))
+        if stations is None:
+            continue
+        stop_lat = stations['stop_lat'].to_numpy(dtype=float)
+        stop_lon = stations['stop_lon'].to_numpy(dtype=float)
+        # Stations x shape points matrix of squared distances; stations are
+        # usually exactly on a shape point, in which case that point is chosen
+        squared_distances = (
+            (stop_lat[:, None] - shape_lat[None, start:end]) ** 2
+            + (stop_lon[:, None] - shape_lon[None, start:end]) ** 2
+        )
+        nearest = squared_distances.argmin(axis=1)
+        on_shape = squared_distances[np.arange(len(nearest)), nearest] <= MAX_STATION_DISTANCE_FROM_SHAPE ** 2
+        pieces.append(pd.DataFrame({
+            'shape_id': shape_id,
+            'parent_station': stations['parent_station'].to_numpy()[on_shape],
+            'stop_lat': stop_lat[on_shape],
+            'stop_lon': stop_lon[on_shape],
+            'shape_pt_index': nearest[on_shape],
+            'shape_start': 0,
+            'shape_end': end - start,
+        }))
+    if not pieces:
+        return pd.DataFrame(
+            columns=['stop_lat', 'stop_lon', 'shape_pt_index', 'shape_start', 'shape_end'],
+            index=pd.MultiIndex.from_arrays([[], []], names=['shape_id', 'parent_station'])
+        )
+    return pd.concat(pieces, ignore_index=True).set_index(['shape_id', 'parent_station'])
+
+
+# Returns the (lat, lon) at which to draw each train, in one vectorized pass.
+# Stopped trains are drawn at their station. Incoming and in-transit trains are
+# drawn a few shape points before their next stop, on the side they approach
+# from: trains running the way the station's shape runs travel in increasing
+# shape order. If that runs off the end of the shape (a train approaching
+# its first station), the train is drawn on the other side of the stop
+# instead. Stations not on any shape (shape_pt_index < 0) draw every train
+# at the station.
+#   stop_index: indexed by parent_station, with stop_lat, stop_lon,
+#       shape_pt_index, shape_start and shape_end columns (row positions
+#       within shape_lat/shape_lon), and shape_northbound (whether that
+#       shape runs north)
+#   shape_lat/shape_lon: shape points, in sequence order
+@metrics.instrumented('place_trains')
+def place_trains(stop_index: pd.DataFrame,
+                 shape_lat: np.ndarray,
+                 shape_lon: np.ndarray,
+                 parent_station: np.ndarray,
+                 current_status: np.ndarray,
+                 direction: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    rows = stop_index.index.get_indexer(np.asarray(parent_station, dtype=str))
+    if (rows < 0).any():
+        unknown = np.unique(np.asarray(parent_station, dtype=str)[rows < 0])
+        raise KeyError(f"Stations not on shape: {', '.join(unknown)}")
+    current_status = np.asarray(current_status, dtype=str)
+    direction = np.asarray(direction, dtype=str)
+
+    stop_lat = stop_index['stop_lat'].to_numpy(dtype=float)[rows]
+    stop_lon = stop_index['stop_lon'].to_numpy(dtype=float)[rows]
+    if len(shape_lat) == 0:
+        return stop_lat, stop_lon
+    stop_pt_index = stop_index['shape_pt_index'].to_numpy(dtype=np.int64)[rows]
+    shape_start = stop_index['shape_start'].to_numpy(dtype=np.int64)[rows]
+    shape_end = stop_index['shape_end'].to_numpy(dtype=np.int64)[rows]
+
+    offset = np.where(
+        current_status == 'INCOMING_AT',
+        INCOMING_AT_SHAPE_OFFSET,
+        IN_TRANSIT_TO_SHAPE_OFFSET
+    )
+    shape_northbound = stop_index['shape_northbound'].to_numpy(dtype=bool)[rows]
+    offset = np.where((direction == 'NORTH') == shape_northbound, -offset, offset)
+    display_pt_index = stop_pt_index + offset
+    off_shape = (display_pt_index < shape_start) | (display_pt_index >= shape_end)
+    display_pt_index = np.where(off_shape, stop_pt_index - offset, display_pt_index)
+    display_pt_index = np.clip(display_pt_index, shape_start, np.maximum(shape_end - 1, shape_start))
+    display_pt_index = display_pt_index.clip(0, len(shape_lat) - 1)
+
+    at_station = (current_status == 'STOPPED_AT') | (stop_pt_index < 0)
+    lat = np.where(at_station, stop_lat, np.asarray(shape_lat, dtype=float)[display_pt_index])
+    lon = np.where(at_station, stop_lon, np.asarray(shape_lon, dtype=float)[display_pt_index])
+    return lat, lon
+
+
+########################
+# Per-route geometry
+########################
+
+# Used for routes without a route_color in routes.txt
+DEFAULT_ROUTE_COLOR = '808183'
+
+# Zoom levels at which each route's shapes are pre-simplified. A map at zoom z
+# is drawn with the level of the smallest of these that is at least z.
+LOD_ZOOMS = (10, 12, 14, 16)
+
+# Decimal places of the coordinates sent to the map (about 1 m)
+PATH_COORDINATE_DECIMALS = 5
+
+
+def hex_to_rgba(hex_color: str, alpha: int = 255) -> tuple[int, int, int, int]:
+    hex_color = hex_color.lstrip('#')
+    return tuple(int(hex_color[i:i + 2], 16) for i in (0, 2, 4)) + (alpha,)
+
+
+# Simplification tolerance (in degrees) for a map at zoom: half a pixel of a
+# 256 px Web Mercator tile, so dropped points move the line by less than that
+def lod_tolerance(zoom: float) -> float:
+    return 0.5 * 360 / (256 * 2 ** zoom)
+
+
+# Douglas–Peucker significance of each point of a polyline: simplifying with
+# any tolerance below it keeps the point. Endpoints are always kept (inf).
+# Each point is capped at its parent's significance, so the points kept at a
+# coarser tolerance are always a subset of those kept at a finer one, and
+# every level of detail comes from this one pass. Longitudes are scaled by
+# cos(latitude) so distances are measured evenly in both directions.
+def simplification_significance(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    significance = np.zeros(len(lat))
+    if len(lat) == 0:
+        return significance
+    significance[[0, -1]] = np.inf
+    y = np.asarray(lat, dtype=float)
+    x = np.asarray(lon, dtype=float) * np.cos(np.radians(y.mean()))
+    pending = [(0, len(lat) - 1, np.inf)]
+    while pending:
+        start, end, parent = pending.pop()
+        if end - start < 2:
+            continue
+        dx, dy = x[end] - x[start], y[end] - y[start]
+        px, py = x[start + 1:end] - x[start], y[start + 1:end] - y[start]
+        length = np.hypot(dx, dy)
+        distances = np.abs(dx * py - dy * px) / length if length > 0 else np.hypot(px, py)
+        farthest = int(distances.argmax())
+        split = start + 1 + farthest
+        significance[split] = min(distances[farthest], parent)
+        pending.append((start, split, significance[split]))
+        pending.append((split, end, significance[split]))
+    return significance
+
+
+# One level of detail of a route's shapes: the kept points of every shape as
+# one float32 buffer of (lon, lat) rows, and the [start, end) row range of
+# each shape within it
+@dataclass(frozen=True)
+class PathLevel:
+    coordinates: np.ndarray
+    bounds: np.ndarray
+
+
+# Pre-simplifies shapes (concatenated in lat/lon, with [start, end) bounds)
+# at every zoom of LOD_ZOOMS
+def build_path_levels(lat: np.ndarray, lon: np.ndarray, bounds: np.ndarray) -> dict[int, PathLevel]:
+    significance = np.concatenate(
+        [simplification_significance(lat[start:end], lon[start:end]) for start, end in bounds] or [np.empty(0)]
+    )
+    coordinates = np.column_stack((lon, lat)).astype(np.float32)
+    shape_of_point = np.repeat(np.arange(len(bounds)), bounds[:, 1] - bounds[:, 0])
+    levels = {}
+    for zoom in LOD_ZOOMS:
+        kept = significance > lod_tolerance(zoom)
+        lengths = np.bincount(shape_of_point[kept], minlength=len(bounds))
+        level_bounds = np.cumsum(np.concatenate(([0], lengths)))
+        levels[zoom] = PathLevel(
+            coordinates=coordinates[kept],
+            bounds=np.column_stack((level_bounds[:-1], level_bounds[1:])).astype(np.int64),
+        )
+    return levels
+
+
+# Everything needed to draw one route and place its trains
+@dataclass(frozen=True)
+class RouteGeometry:
+    route_id: str
+    route_short_name: str
+    route_long_name: str
+    color: tuple[int, int, int, int]
+    # Shapes drawn for the route: the fewest shapes that together reach every
+    # station of the route, longest first
+    shape_ids: tuple[str, ...]
+    # [start, end) row range of each of shape_ids within shape_lat/shape_lon
+    shape_bounds: np.ndarray
+    # Points of all of shape_ids, concatenated in order
+    shape_lat: np.ndarray
+    shape_lon: np.ndarray
+    # Every station served by the route, indexed by parent_station, with
+    # stop_name, stop_lat, stop_lon and the station's position on the
+    # first of shape_ids that reaches it, and that shape's direction (see place_trains)
+    stations: pd.DataFrame
+    # The shapes, pre-simplified for each zoom of LOD_ZOOMS
+    path_levels: dict[int, PathLevel]
+
+    # Returns the (lat, lon) at which to draw each train of this route
+    def place_trains(self, parent_station: np.ndarray,
+                     current_status: np.ndarray,
+                     direction: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        return place_trains(self.stations, self.shape_lat, self.shape_lon,
+                            parent_station, current_status, direction)
+
+    # Returns the level of detail to draw at zoom: the coarsest one that is
+    # still at least as fine as zoom needs
+    def path_level(self, zoom: float) -> PathLevel:
+        return self.path_levels[next((level for level in LOD_ZOOMS if level >= zoom), LOD_ZOOMS[-1])]
+
+    # Returns one row per shape, with its simplified points for a map at zoom
+    # as a 'path' of [lon, lat] pairs (for a PathLayer)
+    def paths(self, zoom: float) -> pd.DataFrame:
+        level = self.path_level(zoom)
+        coordinates = level.coordinates.astype(float).round(PATH_COORDINATE_DECIMALS)
+        return pd.DataFrame({
+            'shape_id': list(self.shape_ids),
+            'path': [coordinates[start:end].tolist() for start, end in level.bounds],
+        })
+
+    # Returns the (lat, lon) midpoint of the route's bounding box
+    def center(self) -> tuple[float, float]:
+        lat = self.stations['stop_lat'].to_numpy(dtype=float)
+        lon = self.stations['stop_lon'].to_numpy(dtype=float)
+        if len(lat) == 0:
+            return float('nan'), float('nan')
+        return (lat.min() + lat.max()) / 2, (lon.min() + lon.max()) / 2
+
+
+# Precomputes the geometry of every route in routes.txt, keyed by route_id
+def build_route_geometries(shape_points: pd.DataFrame,
+                           trips: pd.DataFrame,
+                           stop_times: pd.DataFrame,
+                           stops: pd.DataFrame,
+                           routes: pd.DataFrame) -> dict[str, RouteGeometry]:
+    route_stations = served_stations_by_route(trips, stop_times, stops)
+    routes_by_shape = shape_routes(shape_points['shape_id'].to_numpy(), trips)
+    directions_by_shape = shape_directions(shape_points['shape_id'].to_numpy(), trips)
+    stop_shape_index = build_stop_shape_index(shape_points, routes_by_shape, route_stations)
+
+    shape_ids = shape_points['shape_id'].astype(str).to_numpy()
+    boundaries = np.flatnonzero(shape_ids[1:] != shape_ids[:-1]) + 1
+    starts = np.concatenate(([0], boundaries)).astype(np.int64)
+    ends = np.concatenate((boundaries, [len(shape_ids)])).astype(np.int64)
+    shape_slices = dict(zip(shape_ids[starts], zip(starts, ends)))
+    all_shape_lat = shape_points['shape_pt_lat'].to_numpy(dtype=float)
+    all_shape_lon = shape_points['shape_pt_lon'].to_numpy(dtype=float)
+
+    station_names = stops.loc[stops['parent_station'].notna(), ['parent_station', 'stop_name']].astype(str).drop_duplicates(
+        'parent_station'
+    ).set_index('parent_station')['stop_name']
+    stations_by_shape = {
+        str(shape_id): shape_stations.droplevel('shape_id')
+        for shape_id, shape_stations in stop_shape_index.groupby(level='shape_id', sort=False)
+    }
+    stations_by_route = dict(tuple(route_stations.groupby('route_id', sort=False)))
+    shapes_by_route = {}
+    for shape_id, route_id in routes_by_shape.items():
+        shapes_by_route.setdefault(route_id, []).append(shape_id)
+
+    route_geometries = {}
+    for route in routes.astype({'route_id': str}).itertuples(index=False):
+        route_id = route.route_id
+        stations = stations_by_route.get(route_id, route_stations.iloc[:0]).set_index('parent_station')[
+            ['stop_lat', 'stop_lon']
+        ]
+        candidate_shapes = sorted(
+            (shape_id for shape_id in shapes_by_route.get(route_id, []) if shape_id in stations_by_shape),
+            key=lambda shape_id: (-len(stations_by_shape[shape_id]), shape_slices[shape_id][0] - shape_slices[shape_id][1])
+        )
+
+        # Greedily add shapes until every station of the route is reached
+        chosen_shapes, station_positions, lat_pieces, lon_pieces = [], [], [], []
+        unreached = set(stations.index)
+        offset = 0
+        for shape_id in candidate_shapes:
+            shape_stations = stations_by_shape[shape_id]
+            newly_reached = shape_stations.loc[shape_stations.index.isin(list(unreached))]
+            if chosen_shapes and newly_reached.empty:
+                continue
+            start, end = shape_slices[shape_id]
+            chosen_shapes.append(shape_id)
+            lat_pieces.append(all_shape_lat[start:end])
+            lon_pieces.append(all_shape_lon[start:end])
+            station_positions.append(pd.DataFrame({
+                'shape_pt_index': newly_reached['shape_pt_index'].to_numpy() + offset,
+                'shape_start': offset,
+                'shape_end': offset + end - start,
+                'shape_northbound': directions_by_shape.get(shape_id) != 'SOUTH',
+            }, index=newly_reached.index))
+            unreached -= set(newly_reached.index)
+            offset += end - start
+            if not unreached:
+                break
+
+        positions = pd.concat(station_positions) if station_positions else pd.DataFrame(
+            columns=['shape_pt_index', 'shape_start', 'shape_end', 'shape_northbound']
+        )
+        stations = stations.join(positions, how='left').fillna(
+            {'shape_pt_index': -1, 'shape_start': 0, 'shape_end': 0, 'shape_northbound': True}
+        ).astype({'shape_pt_index': np.int64, 'shape_start': np.int64, 'shape_end': np.int64,
+                  'shape_northbound': bool})
+        stations.insert(0, 'stop_name', station_names.reindex(stations.index).to_numpy())
+        stations.index.name = 'parent_station'
+        bounds = np.cumsum([0] + [len(pieces) for pieces in lat_pieces])
+        shape_bounds = np.column_stack((bounds[:-1], bounds[1:])).astype(np.int64)
+        shape_lat = np.concatenate(lat_pieces) if lat_pieces else np.empty(0)
+        shape_lon = np.concatenate(lon_pieces) if lon_pieces else np.empty(0)
+
+        route_color = route.route_color if isinstance(route.route_color, str) and route.route_color else DEFAULT_ROUTE_COLOR
+        route_geometries[route_id] = RouteGeometry(
+            route_id=route_id,
+            route_short_name=str(route.route_short_name),
+            route_long_name=str(route.route_long_name),
+            color=hex_to_rgba(route_color),
+            shape_ids=tuple(str(shape_id) for shape_id in chosen_shapes),
+            shape_bounds=shape_bounds,
+            shape_lat=shape_lat,
+            shape_lon=shape_lon,
+            stations=stations.sort_index(),
+            path_levels=build_path_levels(shape_lat, shape_lon, shape_bounds),
+        )
+    return route_geometries
@@ -0,0 +1,215 @@
+import os
+import json
+import time
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+import metrics
+
+GTFS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gtfs_subway')
+
+# Compiled tables live next to the source .txt files so that a fresh
+# checkout (or an edited GTFS bundle) simply recompiles on first load.
+CACHE_DIR_NAME = '.cache'
+MANIFEST_FILE_NAME = 'manifest.json'
+
+# Each compile of a table writes a new version directory under the table's
+# cache directory; this file names the current one. Files of a version are
+# never rewritten, since other processes (and older in-memory frames) may
+# still have them memory-mapped: truncating a mapped file crashes its readers.
+CURRENT_FILE_NAME = 'CURRENT'
+
+# Bump whenever the on-disk layout changes so stale caches are rebuilt
+CACHE_FORMAT_VERSION = 2
+
+# Long, heavily repeated string IDs are interned as categorical codes:
+# each distinct ID is stored once and rows only hold a small integer.
+CATEGORICAL_COLUMNS = {
+    'trip_id',
+    'stop_id',
+    'shape_id',
+    'route_id',
+    'service_id',
+    'parent_station',
+    'trip_headsign',
+    'stop_name',
+    'from_stop_id',
+    'to_stop_id',
+}
+
+
+def _source_path(table: str, gtfs_dir: str) -> str:
+    return os.path.join(gtfs_dir, f"{table}.txt")
+
+def _table_cache_dir(table: str, gtfs_dir: str) -> str:
+    return os.path.join(gtfs_dir, CACHE_DIR_NAME, table)
+
+# Cheap fingerprint of a source file. Any edit (or replacement) of the .txt
+# changes its mtime and almost always its size, which triggers a rebuild.
+def _fingerprint(path: str) -> dict:
+    stat = os.stat(path)
+    return {
+        'mtime_ns': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'version': CACHE_FORMAT_VERSION,
+    }
+
+def _smallest_code_dtype(num_categories: int) -> np.dtype:
+    for dtype in (np.int8, np.int16, np.int32):
+        if num_categories < np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+# Directory of the table's current compiled version, or None if it has none
+def _current_version_dir(table: str, gtfs_dir: str) -> str | None:
+    table_dir = _table_cache_dir(table, gtfs_dir)
+    try:
+        with open(os.path.join(table_dir, CURRENT_FILE_NAME)) as f:
+            return os.path.join(table_dir, f.read().strip())
+    except OSError:
+        return None
+
+def _read_manifest(version_dir: str | None) -> dict | None:
+    if version_dir is None:
+        return None
+    try:
+        with open(os.path.join(version_dir, MANIFEST_FILE_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# Parses the GTFS table from CSV and writes one .npy file per column into a
+# new version directory, then makes it the current version. Categorical
+# columns are written as a codes array plus a categories array.
+def compile_table(table: str, gtfs_dir: str = GTFS_DIR) -> None:
+    source = _source_path(table, gtfs_dir)
+    fingerprint = _fingerprint(source)
+    header = pd.read_csv(source, nrows=0).columns
+    df = pd.read_csv(
+        source,
+        dtype={col: str for col in header if col in CATEGORICAL_COLUMNS}
+    )
+
+    # A directory of its own, so concurrent compiles never write the same files
+    table_dir = _table_cache_dir(table, gtfs_dir)
+    os.makedirs(table_dir, exist_ok=True)
+    cache_dir = tempfile.mkdtemp(prefix=f"{fingerprint['mtime_ns']}-", dir=table_dir)
+    columns = {}
+    for col in df.columns:
+        if col in CATEGORICAL_COLUMNS:
+            categorical = pd.Categorical(df[col])
+            categories = np.asarray(categorical.categories, dtype=str)
+            codes = categorical.codes.astype(_smallest_code_dtype(len(categories)))
+            np.save(os.path.join(cache_dir, f"{col}.codes.npy"), codes)
+            np.save(os.path.join(cache_dir, f"{col}.categories.npy"), categories)
+            columns[col] = 'categorical'
+        elif pd.api.types.is_numeric_dtype(df[col]):
+            np.save(os.path.join(cache_dir, f"{col}.npy"), df[col].to_numpy())
+            columns[col] = 'numeric'
+        else:
+            # Free-text columns (names, URLs, descriptions) are kept as plain strings
+            values = df[col].fillna('').to_numpy(dtype=str)
+            np.save(os.path.join(cache_dir, f"{col}.npy"), values)
+            columns[col] = 'string'
+
+    # Manifest is written last so a half-written cache is never considered valid
+    manifest = {'source': fingerprint, 'columns': columns}
+    with open(os.path.join(cache_dir, MANIFEST_FILE_NAME), 'w') as f:
+        json.dump(manifest, f)
+
+    # Readers switch to the new version at once, through the pointer. The
+    # previous version is deleted: that unlinks its files, but pages that are
+    # already mapped stay readable until their readers let go of them.
+    previous_dir = _current_version_dir(table, gtfs_dir)
+    pointer_path = os.path.join(table_dir, f"{CURRENT_FILE_NAME}.{os.getpid()}.tmp")
+    with open(pointer_path, 'w') as f:
+        f.write(os.path.basename(cache_dir))
+    os.replace(pointer_path, os.path.join(table_dir, CURRENT_FILE_NAME))
+    if previous_dir is not None and previous_dir != cache_dir:
+        shutil.rmtree(previous_dir, ignore_errors=True)
+    # Caches of format version 1 kept their files directly in the table's directory
+    for file_name in os.listdir(table_dir):
+        if file_name.endswith('.npy') or file_name == MANIFEST_FILE_NAME:
+            os.remove(os.path.join(table_dir, file_name))
+
+
+# Version stamp of a table's source file, for keying in-memory caches
+# (e.g. st.cache_resource) so they are invalidated along with the disk cache
+def source_version(table: str, gtfs_dir: str = GTFS_DIR) -> int:
+    return os.stat(_source_path(table, gtfs_dir)).st_mtime_ns
+
+
+# Returns True if the compiled cache for the table is missing or older than its source
+def is_stale(table: str, gtfs_dir: str = GTFS_DIR) -> bool:
+    manifest = _read_manifest(_current_version_dir(table, gtfs_dir))
+    if manifest is None:
+        return True
+    return manifest['source'] != _fingerprint(_source_path(table, gtfs_dir))
+
+
+# Returns the GTFS table as a DataFrame backed by the compiled cache,
+# (re)compiling it first if the source .txt changed. Numeric columns are
+# memory-mapped; ID columns come back as pandas Categoricals.
+def load_table(table: str, columns: list[str] | None = None, gtfs_dir: str = GTFS_DIR) -> pd.DataFrame:
+    with metrics.timer(f'gtfs_load:{table}'):
+        return _load_table(table, columns, gtfs_dir)
+
+def _load_table(table: str, columns: list[str] | None, gtfs_dir: str) -> pd.DataFrame:
+    if is_stale(table, gtfs_dir):
+        compile_table(table, gtfs_dir)
+    try:
+        return _load_version(_current_version_dir(table, gtfs_dir), columns)
+    except FileNotFoundError:
+        # Another process replaced the version between reading the pointer and
+        # opening its files: the pointer now names a complete newer version
+        return _load_version(_current_version_dir(table, gtfs_dir), columns)
+
+def _load_version(cache_dir: str, columns: list[str] | None) -> pd.DataFrame:
+    manifest = _read_manifest(cache_dir)
+    if manifest is None:
+        raise FileNotFoundError(cache_dir)
+
+    data = {}
+    for col, kind in manifest['columns'].items():
+        if columns is not None and col not in columns:
+            continue
+        if kind == 'categorical':
+            codes = np.load(os.path.join(cache_dir, f"{col}.codes.npy"), mmap_mode='r')
+            categories = np.load(os.path.join(cache_dir, f"{col}.categories.npy"))
+            data[col] = pd.Categorical.from_codes(codes, categories=categories, validate=False)
+        elif kind == 'numeric':
+            data[col] = np.load(os.path.join(cache_dir, f"{col}.npy"), mmap_mode='r')
+        else:
+            data[col] = np.load(os.path.join(cache_dir, f"{col}.npy")).astype(object)
+    return pd.DataFrame(data, copy=False)
+
+
+# Compiles every table in the GTFS directory
+def compile_all(gtfs_dir: str = GTFS_DIR) -> list[str]:
+    tables = sorted(
+        file_name[:-len('.txt')] for file_name in os.listdir(gtfs_dir)
+        if file_name.endswith('.txt')
+    )
+    for table in tables:
+        if is_stale(table, gtfs_dir):
+            compile_table(table, gtfs_dir)
+    return tables
+
+
+# Compile step: `python src/gtfs_cache.py` compiles the bundle and prints a
+# before/after comparison of parsing the CSV versus loading the cache.
+if __name__ == '__main__':
+    for table in compile_all():
+        start = time.perf_counter()
+        csv_df = pd.read_csv(_source_path(table, GTFS_DIR))
+        csv_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        cached_df = load_table(table)
+        cache_seconds = time.perf_counter() - start
+        print(
+            f"{table:>16}: {len(csv_df):>8} rows | "
+            f"read_csv {csv_seconds * 1000:8.2f} ms, {csv_df.memory_usage(deep=True).sum() / 1e6:7.2f} MB | "
+            f"cache {cache_seconds * 1000:8.2f} ms, {cached_df.memory_usage(deep=True).sum() / 1e6:7.2f} MB"
+        )
@@ -0,0 +1,100 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from json import loads
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import metrics
+
+# Connections kept alive per host; also bounds how many requests to one host run at once
+POOL_MAXSIZE = 16
+
+# Worker threads used to run requests concurrently
+MAX_WORKERS = 16
+
+# Idempotent GETs are retried on connection errors and on these statuses,
+# waiting BACKOFF_FACTOR * 2^(attempt - 1) seconds between attempts
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 0.3
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# (connect, read) timeouts in seconds, by host. The NYCT feeds are large
+# protobufs and are given longer to download than the small JSON responses.
+DEFAULT_TIMEOUT = (3.05, 10)
+ENDPOINT_TIMEOUTS = {
+    'api-v3.mbta.com': (3.05, 10),
+    'cdn.mbta.com': (3.05, 10),
+    'api-endpoint.mta.info': (3.05, 20),
+}
+
+_session = None
+_executor = None
+_lock = threading.Lock()
+
+
+def _build_session() -> requests.Session:
+    session = requests.Session()
+    retry = Retry(
+        total=MAX_RETRIES,
+        backoff_factor=BACKOFF_FACTOR,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=POOL_MAXSIZE, pool_maxsize=POOL_MAXSIZE, max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    # requests transparently decompresses gzip responses
+    session.headers['Accept-Encoding'] = 'gzip, deflate'
+    return session
+
+# Returns the process-wide session, whose connections are kept alive and reused
+def get_session() -> requests.Session:
+    global _session
+    with _lock:
+        if _session is None:
+            _session = _build_session()
+        return _session
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='http')
+        return _executor
+
+def timeout_for(url: str) -> tuple[float, float]:
+    return ENDPOINT_TIMEOUTS.get(urlsplit(url).hostname, DEFAULT_TIMEOUT)
+
+
+# Performs a GET over the shared session. Raises requests.HTTPError on
+# error statuses (after retries), but returns 304 Not Modified responses.
+@metrics.instrumented('http_get', nbytes=lambda resp: len(resp.content))
+def get(url: str, headers: dict | None = None) -> requests.Response:
+    resp = get_session().get(url, headers=headers, timeout=timeout_for(url))
+    if resp.status_code != 304:
+        resp.raise_for_status()
+    return resp
+
+def get_json(url: str) -> object:
+    return loads(get(url).content)
+
+
+# Runs fn(*args) on the shared worker pool
+def submit(fn, *args) -> Future:
+    return get_executor().submit(fn, *args)
+
+# Starts fetching the JSON at url in the background
+def submit_json(url: str) -> Future:
+    return submit(get_json, url)
+
+# Fetches all of the URLs concurrently; results are returned in the same order.
+# Raises the error of the first URL (in list order) whose request failed.
+def fetch_many(urls: list[str]) -> list[requests.Response]:
+    futures = [submit(get, url) for url in urls]
+    return [future.result() for future in futures]
+
+def fetch_many_json(urls: list[str]) -> list[object]:
+    futures = [submit_json(url) for url in urls]
+    return [future.result() for future in futures]
@@ -0,0 +1,429 @@
+import copy
+import datetime
+from dataclasses import dataclass
+import numpy as np
+import pandas as pd
+import schedule
+
+# Most trips a journey may take (transfers + 1)
+DEFAULT_MAX_TRIPS = 5
+
+# Arrival time of stops that haven't been reached
+UNREACHED = 10 ** 9
+
+# Stride between the departure columns of consecutive route-stops in the
+# search keys; larger than any time, which stay within four service days
+_KEY_STRIDE = 4 * 86400
+
+SECONDS_PER_DAY = 86400
+
+
+# One leg of a journey: a ride on a trip, or a transfer on foot between
+# platforms (trip_id None)
+@dataclass(frozen=True)
+class Leg:
+    trip_id: str | None
+    from_stop_id: str
+    departure: float  # POSIX seconds
+    to_stop_id: str
+    arrival: float    # POSIX seconds
+
+
+# The route-stops to scan for journeys starting on one service date: the
+# patterns running that day, and those of the previous day still running
+# after midnight (with their times offset by a day)
+@dataclass(frozen=True)
+class _DayPlan:
+    route_stops: np.ndarray  # route-stop of each entry
+    offsets: np.ndarray      # seconds added to that day's times to compare with the pattern's
+    stops: np.ndarray        # stop code of each entry
+    positions: np.ndarray    # position of the stop within its pattern
+    num_trips: np.ndarray    # trips of the entry's pattern
+    segments: np.ndarray     # running number of the entry's (pattern, day)
+    segment_starts: np.ndarray
+    by_stop: np.ndarray      # entries ordered by stop...
+    stop_bounds: np.ndarray  # ...starting at these offsets...
+    stops_reached: np.ndarray  # ...for these stops
+
+
+# Earliest-arrival journey planner over the whole network (RAPTOR: rounds of
+# route scans, one more trip per round, with transfers between rounds).
+#
+# Trips are grouped into patterns: trips of one service with the same stop
+# sequence that never overtake each other. Every (pattern, stop) is a
+# route-stop, and the departure and arrival times of all trips are stored
+# column by column (one column per route-stop, trips in order), so that:
+#   - the earliest trip catchable at every route-stop is one searchsorted
+#     over all columns at once (keys are route-stop * _KEY_STRIDE + time)
+#   - the trip a rider is on at each route-stop is a running minimum over
+#     the earlier route-stops of its pattern, for all patterns at once
+# A round is a handful of whole-network array operations, not a loop over
+# patterns, so queries take milliseconds.
+#
+# Platforms of a station, and stations listed in transfers.txt, are linked
+# by transfers taking min_transfer_time (changing trains at one station
+# included).
+class JourneyPlanner:
+
+    def __init__(self,
+                 schedule_index: schedule.ScheduleIndex,
+                 stop_times: pd.DataFrame,
+                 stops: pd.DataFrame,
+                 transfers: pd.DataFrame):
+        self.schedule_index = schedule_index
+        self.stop_ids = schedule_index.stop_ids
+        self._day_plans = {}
+        self._build_patterns(stop_times)
+        self._build_transfers(stops, transfers)
+        self._set_times(self.departures, self.arrivals)
+
+    def _build_patterns(self, stop_times: pd.DataFrame) -> None:
+        schedule_index = self.schedule_index
+        trip_codes = schedule_index.trip_ids.get_indexer(stop_times['trip_id'].to_numpy(dtype=object))
+        stop_codes = self.stop_ids.get_indexer(stop_times['stop_id'].to_numpy(dtype=object))
+        sequence = stop_times['stop_sequence'].to_numpy(dtype=np.int64)
+        order = np.lexsort((sequence, trip_codes))
+        trip_codes = trip_codes[order]
+        stop_codes = stop_codes[order].astype(np.int32)
+        arrivals = schedule.parse_gtfs_times(stop_times['arrival_time'].to_numpy(dtype=object))[order]
+        departures = schedule.parse_gtfs_times(stop_times['departure_time'].to_numpy(dtype=object))[order]
+
+        starts = np.flatnonzero(np.r_[True, trip_codes[1:] != trip_codes[:-1]])
+        ends = np.r_[starts[1:], len(trip_codes)]
+        trips_by_key = {}
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            key = (schedule_index.trip_services[trip_codes[start]], stop_codes[start:end].tobytes())
+            trips_by_key.setdefault(key, []).append(start)
+
+        pattern_trips, pattern_services, pattern_stops = [], [], []
+        pattern_departures, pattern_arrivals = [], []
+        for (service, stops_bytes), trip_starts in trips_by_key.items():
+            length = len(stops_bytes) // 4
+            trip_starts = np.array(trip_starts)
+            rows = trip_starts[:, None] + np.arange(length)
+            trip_departures = departures[rows]
+            trip_arrivals = arrivals[rows]
+            by_departure = np.lexsort((trip_departures[:, -1], trip_departures[:, 0]))
+            # Split into chains of trips that never overtake each other
+            chains = []
+            for trip in by_departure.tolist():
+                for chain in chains:
+                    last = chain[-1]
+                    if (trip_departures[last] <= trip_departures[trip]).all() and (trip_arrivals[last] <= trip_arrivals[trip]).all():
+                        chain.append(trip)
+                        break
+                else:
+                    chains.append([trip])
+            for chain in chains:
+                pattern_trips.append(trip_codes[trip_starts[chain]])
+                pattern_services.append(service)
+                pattern_stops.append(stop_codes[trip_starts[chain[0]]:trip_starts[chain[0]] + length])
+                # Column-major: one column (all trips) per stop
+                pattern_departures.append(trip_departures[chain].T.ravel())
+                pattern_arrivals.append(trip_arrivals[chain].T.ravel())
+
+        self.pattern_services = np.array(pattern_services, dtype=np.int32)
+        self.pattern_num_trips = np.array([len(trips) for trips in pattern_trips], dtype=np.int64)
+        self.pattern_lengths = np.array([len(stops) for stops in pattern_stops], dtype=np.int64)
+        self.pattern_trip_starts = np.r_[0, np.cumsum(self.pattern_num_trips)]
+        self.pattern_route_stop_starts = np.r_[0, np.cumsum(self.pattern_lengths)]
+        self.pattern_trips = np.concatenate(pattern_trips).astype(np.int32)
+        self.pattern_last_arrivals = np.array([arrivals.max() for arrivals in pattern_arrivals], dtype=np.int64)
+
+        self.route_stop_stops = np.concatenate(pattern_stops)
+        self.route_stop_patterns = np.repeat(np.arange(len(pattern_stops)), self.pattern_lengths)
+        self.route_stop_positions = np.arange(len(self.route_stop_stops)) - np.repeat(
+            self.pattern_route_stop_starts[:-1], self.pattern_lengths
+        )
+        route_stop_num_trips = self.pattern_num_trips[self.route_stop_patterns]
+        self.route_stop_column_starts = np.r_[0, np.cumsum(route_stop_num_trips)[:-1]]
+        self.departures = np.concatenate(pattern_departures).astype(np.int64)
+        self.arrivals = np.concatenate(pattern_arrivals).astype(np.int64)
+        # Route-stop and trip of every time
+        self._entry_route_stops = np.repeat(np.arange(len(self.route_stop_stops)), route_stop_num_trips)
+        self._entry_trips = self.pattern_trips[
+            self.pattern_trip_starts[self.route_stop_patterns[self._entry_route_stops]]
+            + np.arange(len(self.departures)) - self.route_stop_column_starts[self._entry_route_stops]
+        ]
+        # Larger than any trip row * _POSITION_STRIDE + position
+        self._position_stride = int(self.pattern_lengths.max()) + 1
+        self._no_trip = (int(self.pattern_num_trips.max()) + 1) * self._position_stride
+        self._segment_stride = self._no_trip + 1
+
+    def _build_transfers(self, stops: pd.DataFrame, transfers: pd.DataFrame) -> None:
+        parent_station = pd.Series(
+            stops['parent_station'].to_numpy(dtype=object),
+            index=stops['stop_id'].to_numpy(dtype=object)
+        ).reindex(self.stop_ids)
+        stations = np.where(parent_station.isna(), self.stop_ids.to_numpy(dtype=object), parent_station.to_numpy(dtype=object))
+        platforms = pd.DataFrame({'stop': np.arange(len(self.stop_ids)), 'station': stations})
+
+        station_transfers = pd.DataFrame({
+            'from_station': transfers['from_stop_id'].to_numpy(dtype=object),
+            'to_station': transfers['to_stop_id'].to_numpy(dtype=object),
+            'min_transfer_time': transfers['min_transfer_time'].fillna(0).to_numpy(dtype=np.int64),
+        })
+        # Changing platforms (or trains) within a station is free unless transfers.txt says otherwise
+        own_station = pd.DataFrame({
+            'from_station': pd.unique(stations),
+            'to_station': pd.unique(stations),
+            'min_transfer_time': 0,
+        })
+        station_transfers = pd.concat([station_transfers, own_station]).drop_duplicates(
+            subset=['from_station', 'to_station'], keep='first'
+        )
+        edges = station_transfers.merge(
+            platforms.rename(columns={'stop': 'from_stop', 'station': 'from_station'}), on='from_station'
+        ).merge(
+            platforms.rename(columns={'stop': 'to_stop', 'station': 'to_station'}), on='to_station'
+        ).sort_values(by=['to_stop', 'min_transfer_time'], kind='stable')
+        self.transfer_from = edges['from_stop'].to_numpy(dtype=np.int64)
+        self.transfer_to = edges['to_stop'].to_numpy(dtype=np.int64)
+        self.transfer_times = edges['min_transfer_time'].to_numpy(dtype=np.int64)
+        # Every platform transfers to itself, so every platform has edges
+        self.transfer_bounds = np.searchsorted(self.transfer_to, np.arange(len(self.stop_ids)))
+
+        self.station_of_stop = stations
+        self._stops_by_station = {
+            station: np.array(stop_codes, dtype=np.int64)
+            for station, stop_codes in platforms.groupby('station', sort=False)['stop']
+        }
+
+    def _set_times(self, departures: np.ndarray, arrivals: np.ndarray) -> None:
+        self._departures = departures
+        self._arrivals = arrivals
+        self._column_keys = self._entry_route_stops * _KEY_STRIDE + departures
+
+    # Returns a planner with live delays (seconds, keyed by realtime trip ID,
+    # e.g. from ScheduleIndex.delays) applied to every time of the delayed
+    # trips. Trains of a pattern can't overtake each other, so a delay also
+    # holds back the trains behind: times are kept non-decreasing down every
+    # column. The static structures are shared with this planner, which is
+    # left unchanged, so the two can be queried concurrently.
+    def with_delays(self, delays_by_trip_id: dict[str, float]) -> 'JourneyPlanner':
+        delays = pd.Series(delays_by_trip_id, dtype=float).dropna()
+        trip_delays = delays.reindex(self.schedule_index.trip_keys).fillna(0).to_numpy().round().astype(np.int64)
+        entry_delays = trip_delays[self._entry_trips]
+        offsets = self._entry_route_stops * _KEY_STRIDE
+        delayed = copy.copy(self)
+        delayed._set_times(
+            np.maximum.accumulate(self.departures + entry_delays + offsets) - offsets,
+            np.maximum.accumulate(self.arrivals + entry_delays + offsets) - offsets,
+        )
+        return delayed
+
+    # Stations with stop times, i.e. those journeys can start and end at
+    @property
+    def stations(self) -> list[str]:
+        return list(self._stops_by_station)
+
+    def stops_of_station(self, station: str) -> np.ndarray:
+        stop_codes = self._stops_by_station.get(station)
+        if stop_codes is None:
+            raise LookupError(f"No stop times at station {station}")
+        return stop_codes
+
+    def _day_plan(self, date: datetime.date) -> _DayPlan:
+        plan = self._day_plans.get(date)
+        if plan is not None:
+            return plan
+        patterns, offsets = [], []
+        for day, offset in ((date - schedule.ONE_DAY, SECONDS_PER_DAY), (date, 0)):
+            active = self.schedule_index.active_services(day)[self.pattern_services]
+            if offset:
+                # Only the previous day's trips still running after midnight
+                active &= self.pattern_last_arrivals >= offset
+            day_patterns = np.flatnonzero(active)
+            patterns.append(day_patterns)
+            offsets.append(np.full(len(day_patterns), offset, dtype=np.int64))
+        patterns = np.concatenate(patterns)
+        offsets = np.concatenate(offsets)
+
+        lengths = self.pattern_lengths[patterns]
+        segments = np.repeat(np.arange(len(patterns)), lengths)
+        segment_starts = np.r_[0, np.cumsum(lengths)[:-1]].astype(np.int64)
+        positions = np.arange(lengths.sum()) - np.repeat(segment_starts, lengths)
+        route_stops = self.pattern_route_stop_starts[patterns][segments] + positions
+        stops = self.route_stop_stops[route_stops]
+        by_stop = np.argsort(stops, kind='stable')
+        stops_reached, stop_bounds = np.unique(stops[by_stop], return_index=True)
+        plan = self._day_plans[date] = _DayPlan(
+            route_stops=route_stops,
+            offsets=offsets[segments],
+            stops=stops,
+            positions=positions,
+            num_trips=self.pattern_num_trips[patterns][segments],
+            segments=segments,
+            segment_starts=segment_starts,
+            by_stop=by_stop,
+            stop_bounds=stop_bounds,
+            stops_reached=stops_reached,
+        )
+        return plan
+
+    # One RAPTOR round: from the times at which every stop can be boarded,
+    # returns the earliest arrival at every stop with one more trip, and for
+    # each entry of the plan the (trip row, boarding position) key ridden there
+    def _scan(self, plan: _DayPlan, board: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        num_entries = len(plan.route_stops)
+        boardable = np.flatnonzero(board[plan.stops] < UNREACHED)
+        trip_rows = plan.num_trips.copy()
+        route_stops = plan.route_stops[boardable]
+        times = np.clip(board[plan.stops[boardable]] + plan.offsets[boardable], 0, _KEY_STRIDE - 1)
+        trip_rows[boardable] = np.minimum(
+            np.searchsorted(self._column_keys, route_stops * _KEY_STRIDE + times) - self.route_stop_column_starts[route_stops],
+            plan.num_trips[boardable]
+        )
+
+        # The trip ridden at each route-stop is the earliest one boarded at any
+        # earlier stop of the pattern: an exclusive running minimum per segment
+        keys = trip_rows * self._position_stride + plan.positions
+        ridden = np.empty(num_entries, dtype=np.int64)
+        ridden[1:] = keys[:-1]
+        ridden[plan.segment_starts] = self._no_trip
+        segment_offsets = plan.segments * self._segment_stride
+        ridden = np.minimum.accumulate(ridden - segment_offsets) + segment_offsets
+
+        rows = ridden // self._position_stride
+        riding = rows < plan.num_trips
+        entries = self.route_stop_column_starts[plan.route_stops] + np.minimum(rows, plan.num_trips - 1)
+        arrival = np.where(riding, self._arrivals[entries] - plan.offsets, UNREACHED)
+        best = np.minimum.reduceat((arrival * num_entries + np.arange(num_entries))[plan.by_stop], plan.stop_bounds)
+        return best // num_entries, best % num_entries, ridden
+
+    # Earliest time every stop can be boarded after arriving at the given
+    # stops, and the stop each of those transfers starts from
+    def _transfer(self, arrival: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        num_stops = len(self.stop_ids)
+        candidates = np.minimum(arrival[self.transfer_from] + self.transfer_times, UNREACHED)
+        best = np.minimum.reduceat(candidates * num_stops + self.transfer_from, self.transfer_bounds)
+        return best // num_stops, best % num_stops
+
+    # Returns the legs of the earliest-arriving journey from any platform of
+    # station origin to any platform of station destination, leaving at or
+    # after when (POSIX seconds), using at most max_trips trips; among
+    # journeys arriving equally early, the one with the fewest trips.
+    # Returns an empty list when there is none.
+    def plan(self, origin: str, destination: str, when: float, max_trips: int = DEFAULT_MAX_TRIPS) -> list[Leg]:
+        origin_stops = self.stops_of_station(origin)
+        destination_stops = self.stops_of_station(destination)
+        schedule_index = self.schedule_index
+        date = datetime.datetime.fromtimestamp(when, schedule_index.timezone).date()
+        day_start = schedule_index.service_day_start(date)
+        plan = self._day_plan(date)
+        num_stops = len(self.stop_ids)
+
+        # Riders can start from any platform of the origin, or walk to the
+        # stations it has transfers to
+        start = np.full(num_stops, UNREACHED, dtype=np.int64)
+        start[origin_stops] = int(np.ceil(when - day_start))
+        board, board_from = self._transfer(start)
+        board[origin_stops] = start[origin_stops]
+        board_from[origin_stops] = origin_stops
+        best = board.copy()
+        # Per round: arrival at the stops it improved, the plan entry each was
+        # reached through, the trip ridden at every entry, and the stop each
+        # next boarding walks from. The origin is "round 0".
+        rounds = [(start, None, None, board_from)]
+        for _ in range(max_trips):
+            arrival_at_reached, via_at_reached, ridden = self._scan(plan, board)
+            improved = arrival_at_reached < best[plan.stops_reached]
+            if not improved.any():
+                break
+            arrival = np.full(num_stops, UNREACHED, dtype=np.int64)
+            via = np.full(num_stops, -1, dtype=np.int64)
+            arrival[plan.stops_reached[improved]] = arrival_at_reached[improved]
+            via[plan.stops_reached[improved]] = via_at_reached[improved]
+            best = np.minimum(best, arrival)
+            board, board_from = self._transfer(arrival)
+            rounds.append((arrival, via, ridden, board_from))
+
+        destination_arrivals = [arrival[destination_stops].min() for arrival, _, _, _ in rounds[1:]]
+        if not destination_arrivals or min(destination_arrivals) >= UNREACHED:
+            return []
+        num_trips = int(np.argmin(destination_arrivals)) + 1
+        arrival = rounds[num_trips][0]
+        stop = int(destination_stops[np.argmin(arrival[destination_stops])])
+
+        legs = []
+        for round_number in range(num_trips, 0, -1):
+            arrival, via, ridden, _ = rounds[round_number]
+            entry = via[stop]
+            row, position = divmod(int(ridden[entry]), self._position_stride)
+            pattern = self.route_stop_patterns[plan.route_stops[entry]]
+            boarding_route_stop = self.pattern_route_stop_starts[pattern] + position
+            boarding_stop = int(self.route_stop_stops[boarding_route_stop])
+            trip = self.pattern_trips[self.pattern_trip_starts[pattern] + row]
+            departure = self._departures[self.route_stop_column_starts[boarding_route_stop] + row] - plan.offsets[entry]
+            legs.append(Leg(
+                schedule_index.trip_ids[trip], self.stop_ids[boarding_stop], float(day_start + departure),
+                self.stop_ids[stop], float(day_start + arrival[stop])
+            ))
+            previous_arrival, _, _, board_from = rounds[round_number - 1]
+            stop = int(board_from[boarding_stop])
+            if stop != boarding_stop:
+                legs.append(Leg(
+                    None, self.stop_ids[stop], float(day_start + previous_arrival[stop]),
+                    self.stop_ids[boarding_stop], float(day_start + departure)
+                ))
+        return legs[::-1]
+
+    # Earliest arrival (POSIX seconds, or None) of plan(...)
+    def earliest_arrival(self, origin: str, destination: str, when: float,
+                         max_trips: int = DEFAULT_MAX_TRIPS) -> float | None:
+        legs = self.plan(origin, destination, when, max_trips)
+        return legs[-1].arrival if legs else None
+
+
+# Legs as a frame, with local times, for display
+def legs_to_dataframe(legs: list[Leg], timezone: datetime.tzinfo) -> pd.DataFrame:
+    legs = pd.DataFrame(legs, columns=['trip_id', 'from_stop_id', 'departure', 'to_stop_id', 'arrival'])
+    for column in ('departure', 'arrival'):
+        legs[column] = pd.to_datetime(legs[column], unit='s', utc=True).dt.tz_convert(timezone)
+    return legs
+
+
+# `python src/journey.py` builds the planner for the local GTFS and times
+# queries between random pairs of stations
+if __name__ == '__main__':
+    import sys
+    import time
+    import gtfs_cache
+
+    num_queries = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    start = time.perf_counter()
+    schedule_index = schedule.ScheduleIndex(
+        gtfs_cache.load_table('stop_times', ['trip_id', 'stop_id', 'arrival_time']),
+        gtfs_cache.load_table('trips', ['trip_id', 'service_id']),
+        gtfs_cache.load_table('calendar'),
+        gtfs_cache.load_table('calendar_dates'),
+    )
+    planner = JourneyPlanner(
+        schedule_index,
+        gtfs_cache.load_table('stop_times', ['trip_id', 'stop_id', 'stop_sequence', 'arrival_time', 'departure_time']),
+        gtfs_cache.load_table('stops', ['stop_id', 'parent_station']),
+        gtfs_cache.load_table('transfers'),
+    )
+    print(f"built in {time.perf_counter() - start:.3f} s: {len(planner.pattern_num_trips)} patterns, "
+          f"{len(planner.route_stop_stops)} route-stops")
+
+    # 8 am on the first weekday the calendar covers
+    date = datetime.datetime.strptime(str(schedule_index._start_dates.min()), '%Y%m%d').date()
+    while date.weekday() >= 5:
+        date += schedule.ONE_DAY
+    when = datetime.datetime.combine(date, datetime.time(8), tzinfo=schedule_index.timezone).timestamp()
+    rng = np.random.default_rng(0)
+    stations = np.array(planner.stations)
+    pairs = rng.choice(stations, size=(num_queries, 2))
+    planner.plan(*pairs[0], when)
+
+    latencies = np.empty(num_queries)
+    num_found = 0
+    for i, (origin, destination) in enumerate(pairs):
+        start = time.perf_counter()
+        legs = planner.plan(origin, destination, when)
+        latencies[i] = time.perf_counter() - start
+        num_found += bool(legs)
+    latencies *= 1000
+    print(f"{num_queries} queries ({num_found} with a journey): mean {latencies.mean():.2f} ms, "
+          f"p50 {np.percentile(latencies, 50):.2f} ms, p95 {np.percentile(latencies, 95):.2f} ms")
@@ -1,15 +1,34 @@
-import requests
-from json import loads
 import streamlit as st
+import time
 import datetime
+import pandas as pd
+import http_client
+import feed_log
+import metrics
+from mbta_metadata import MetadataCache, DestinationResolver
+from mbta_vehicles import VehicleSnapshot, carriage_details, flatten_feed, unflatten_feed
+from mbta_alerts import parse_alerts
+import mbta_occupancy
+from occupancy_history import OccupancyHistory
+import carriage_render
+from poller import FeedPoller, PollJob
 
 # Returns an object containing the JSON object returned by the
 # specified API endpoint
+@metrics.instrumented('get_api_json_resp')
 def get_api_json_resp(url: str) -> object:
-    resp = requests.get(url)
-    content = resp.content
-    json = loads(content)
-    return json
+    return http_client.get_json(url)
+
+
+# With TRANSIT_METRICS set, each app process serves its metrics in the
+# Prometheus text format on TRANSIT_METRICS_PORT (see metrics)
+@st.cache_resource
+def start_metrics_server() -> None:
+    if metrics.ENABLED:
+        metrics.serve()
+
+start_metrics_server()
+render_start = time.perf_counter()
 
 
 #########################
@@ -19,51 +38,118 @@ def get_api_json_resp(url: str) -> object:
 TRIPS_ENDPOINT_URL="https://api-v3.mbta.com/trips/"
 
 ROUTES_ENDPOINT_URL="https://api-v3.mbta.com/routes"
-route_ids = [
-    route['id'] for route 
-    in get_api_json_resp(ROUTES_ENDPOINT_URL)['data']
-]
 
 STOPS_ENDPOINT_URL="https://api-v3.mbta.com/stops"
-stop_attr_by_id = {
-    stop['id']: stop['attributes'] for stop 
-    in get_api_json_resp(STOPS_ENDPOINT_URL)['data']
-}
 
 # Using this endpoint instead of the V3 endpoint because V3 endpoint does not
 # include the sequence numbers of the carriages in a vehicle, which are necessary to
 # give occupancy percentage any meaning in the context of asset wear/damage.
 VEHICLE_POSITIONS_ENDPOINT_URL="https://cdn.mbta.com/realtime/VehiclePositions.json"
 
-ALERTS_ENDPOINT_URL="https://api-v3.mbta.com/alerts?route=Orange"
+# Line the trip and alert monitors follow
+ROUTE_ID = 'Orange'
+
+ALERTS_ENDPOINT_URL=f"https://api-v3.mbta.com/alerts?route={ROUTE_ID}"
+# Sort by newest alerts first
+SORTED_ALERTS_ENDPOINT_URL=ALERTS_ENDPOINT_URL + '&' + 'sort=-created_at'
+
+
+# How often (in seconds) the background poller refreshes each feed
+VEHICLE_POSITIONS_POLL_INTERVAL_SECONDS = 10
+ALERTS_POLL_INTERVAL_SECONDS = 60
+
+
+# One VehiclePositions snapshot shared by every accessor, rerun and session.
+# The poller keeps it fresh; its TTL only matters if the poller falls behind.
+# When replaying (see feed_log) it has no URL and is only filled by the poller.
+@st.cache_resource
+def get_vehicle_snapshot() -> VehicleSnapshot:
+    return VehicleSnapshot(
+        None if feed_log.REPLAY_DIR else VEHICLE_POSITIONS_ENDPOINT_URL,
+        ttl_seconds=3 * VEHICLE_POSITIONS_POLL_INTERVAL_SECONDS
+    )
+
+@st.cache_resource
+def get_vehicle_positions_replay() -> feed_log.FeedReplay:
+    return feed_log.FeedReplay(feed_log.REPLAY_DIR, 'mbta_vehicle_positions', feed_log.REPLAY_SPEED)
+
+@st.cache_resource
+def get_vehicle_positions_recorder() -> feed_log.FeedLogWriter:
+    return feed_log.FeedLogWriter(feed_log.RECORD_DIR, 'mbta_vehicle_positions')
+
+# Occupancy history of every carriage, filled by the poller and saved
+# periodically, so it survives server restarts
+@st.cache_resource
+def get_occupancy_history() -> OccupancyHistory:
+    return OccupancyHistory.load()
+
+def poll_vehicle_snapshot() -> VehicleSnapshot:
+    vehicle_snapshot = get_vehicle_snapshot()
+    if feed_log.REPLAY_DIR:
+        columns = get_vehicle_positions_replay().current()[1]
+        vehicle_snapshot.load(unflatten_feed(columns))
+    else:
+        vehicle_snapshot.refresh(force=True)
+        columns = flatten_feed({
+            'header': vehicle_snapshot.header,
+            'entity': vehicle_snapshot.entity
+        })
+        if feed_log.RECORD_DIR:
+            get_vehicle_positions_recorder().append(columns)
+    get_occupancy_history().record(
+        columns['header_timestamp'][0],
+        columns['carriage.label'],
+        columns['carriage.occupancy_percentage']
+    )
+    return vehicle_snapshot
+
+# A single background poller per server process fetches the feeds on a
+# schedule; reruns and sessions only read the latest published responses
+@st.cache_resource
+def get_feed_poller() -> FeedPoller:
+    return FeedPoller([
+        PollJob(
+            'vehicle_positions',
+            poll_vehicle_snapshot,
+            VEHICLE_POSITIONS_POLL_INTERVAL_SECONDS / (feed_log.REPLAY_SPEED if feed_log.REPLAY_DIR else 1)
+        ),
+        PollJob('alerts', lambda: get_api_json_resp(SORTED_ALERTS_ENDPOINT_URL), ALERTS_POLL_INTERVAL_SECONDS),
+    ]).start()
+
+# Stop and route metadata, shared by every rerun and session and persisted
+# across restarts; stops are looked up only when a page first needs them
+@st.cache_resource
+def get_stop_cache() -> MetadataCache:
+    return MetadataCache('stops', STOPS_ENDPOINT_URL)
+
+@st.cache_resource
+def get_route_cache() -> MetadataCache:
+    return MetadataCache('routes', ROUTES_ENDPOINT_URL)
+
+@st.cache_resource
+def get_destination_resolver() -> DestinationResolver:
+    return DestinationResolver(TRIPS_ENDPOINT_URL.rstrip('/'), get_route_cache())
+
+feed_store = get_feed_poller().store
+feed_store.get('vehicle_positions')
+alerts_resp_obj = feed_store.get('alerts')
 
 
 # Assumes that all active trips are those (and only those) associated with a current vehicle position
 # Excludes non-revenue trips
-def get_active_trip_ids() -> list[object]:
-    resp_obj = get_api_json_resp(VEHICLE_POSITIONS_ENDPOINT_URL)
-    entity = resp_obj['entity']
+def get_active_trip_ids(route_id: str = ROUTE_ID) -> list[object]:
     return [
-        vehicle_position['vehicle']['trip']['trip_id']
-        for vehicle_position in entity
-        if vehicle_position['vehicle']['trip']['route_id'] == 'Orange'
-            and not vehicle_position['vehicle']['trip']['trip_id'].startswith('NONREV')
+        vehicle['trip']['trip_id']
+        for vehicle in get_vehicle_snapshot().get_vehicles()
+        if vehicle['trip']['route_id'] == route_id
+            and not vehicle['trip']['trip_id'].startswith('NONREV')
     ]
 
 
 # Returns the VehicleDescriptor of the first VehiclePosition with the specified trip ID.
 # Raises an Exception if no VehiclePosition can be found with the specified trip ID.
 def get_vehicle(trip_id: str) -> object:
-    header, entity = get_api_json_resp(VEHICLE_POSITIONS_ENDPOINT_URL).values()
-    matching_vehicles = [    # vehicles matching trip ID
-        vehicle_position['vehicle']
-        for vehicle_position 
-        in entity
-        if vehicle_position['vehicle']['trip']['trip_id'] == trip_id
-    ]
-    if len(matching_vehicles) < 1:
-        raise Exception(f"No VehiclePosition found with trip_id={trip_id}")
-    return matching_vehicles[0]
+    return get_vehicle_snapshot().get_vehicle(trip_id)
 
 
 def get_current_status(trip_id: str) -> str:
@@ -74,67 +160,62 @@ def get_current_stop(trip_id: str) -> str:
     vehicle = get_vehicle(trip_id)
     return vehicle['stop_id']
 
-def get_destination_name(trip_id: str) -> str:
-    trip_resp_obj = get_api_json_resp(url=f"{TRIPS_ENDPOINT_URL}/{trip_id}")
-    route = trip_resp_obj['data']['relationships']['route']
-    route_id = route['data']['id']
-    route_resp_obj = get_api_json_resp(url=f"{ROUTES_ENDPOINT_URL}/{route_id}")
-    direction_id = int(trip_resp_obj['data']['attributes']['direction_id']) # e.g. "0" or "1"
-    direction_destinations = route_resp_obj['data']['attributes']['direction_destinations'] # e.g. "Forest Hills" or "Oak Grove"
-    destination = direction_destinations[direction_id]
-    return destination
+# Returns the destination (e.g. "Forest Hills" or "Oak Grove") of each of the trips, keyed by trip ID
+def get_destination_names(trip_ids: list[str]) -> dict[str, str]:
+    return get_destination_resolver().resolve(trip_ids)
 
 def get_carriage_details(trip_id: str) -> list:
-    vehicle = get_vehicle(trip_id)
-    return {
-        carriage['carriage_sequence']: {
-            'label': carriage['label'],
-            'occupancy_status': carriage['occupancy_status'],
-            'occupancy_percentage': carriage['occupancy_percentage'] if 'occupancy_percentage' in carriage.keys() else float('NaN')  
-        }
-        for carriage in vehicle['multi_carriage_details']
-    }
-
-def _parse_date(date_string: str) -> datetime.datetime:
-    # remove colon separating hour and minute of timezone offset
-    # so that it can be parsed by the %z directive
-    date_string = date_string[:-3] + date_string[-2:]
-    date_string = datetime.datetime.strptime(
-        date_string, 
-        "%Y-%m-%dT%H:%M:%S%z"
-    )
-    return date_string
-def get_alerts() -> list[object]:
-    # Sort by newest alerts first
-    resp_obj = get_api_json_resp(ALERTS_ENDPOINT_URL + '&' + 'sort=-created_at')
-    return [
-        {
-            'service_effect': alert['attributes']['service_effect'],
-            'created_at': _parse_date(alert['attributes']['created_at']),
-            'url': alert['attributes']['url'],
-            'short_header': alert['attributes']['short_header'],
-            'severity': alert['attributes']['severity']
-        }
-        for alert in resp_obj['data']
-    ]
+    return carriage_details(get_vehicle(trip_id))
+
+# Every carriage of every revenue trip on every line, flattened once per
+# VehiclePositions snapshot and shared by all sessions
+@st.cache_resource(max_entries=1)
+def get_fleet_carriages(snapshot_fetched_at: float | None) -> pd.DataFrame:
+    vehicle_snapshot = get_vehicle_snapshot()
+    return mbta_occupancy.fleet_carriages(flatten_feed({
+        'header': vehicle_snapshot.header,
+        'entity': vehicle_snapshot.entity
+    }))
+
+# Carriages of every train in the fleet as one HTML block, built once per
+# VehiclePositions snapshot, so reruns send the same payload
+@st.cache_resource(max_entries=1)
+def get_fleet_carriages_html(snapshot_fetched_at: float | None) -> str:
+    return carriage_render.trains_html([
+        (f"{route_id} · {trip_id}", carriages)
+        for route_id, trip_id, carriages
+        in mbta_occupancy.carriages_by_trip(get_fleet_carriages(snapshot_fetched_at))
+    ])
+
+def get_alerts(resp_obj: object | None = None) -> list[object]:
+    if resp_obj is None:
+        resp_obj = get_api_json_resp(SORTED_ALERTS_ENDPOINT_URL)
+    return parse_alerts(resp_obj)
 
 
 ####################
 # UI (Streamlit App)
 ####################
 st.set_page_config(layout="wide")
+# Styles of the carriage and legend blocks, shared by all of them
+st.markdown(carriage_render.STYLE, unsafe_allow_html=True)
 
 def get_current_status_formatted(trip_id: str) -> str:
     return get_current_status(trip_id).replace('_', ' ').lower()
     
+# Stops the API does not know (e.g. temporary ones) are shown by their ID
 def get_current_stop_name(trip_id: str) -> str:
-    current_stop_id = get_current_stop(trip_id)
-    resp_obj = get_api_json_resp(url=f"{STOPS_ENDPOINT_URL}/{current_stop_id}")
-    return resp_obj['data']['attributes']['name']
+    stop_id = get_current_stop(trip_id)
+    return get_stop_cache().get_many([stop_id]).get(stop_id, {}).get('name', stop_id)
 
 active_trip_ids = get_active_trip_ids()
+# Look up the current stops of all active trips in one batch, so switching
+# between trips reads stop names from the cache
+get_stop_cache().get_many([get_current_stop(trip_id) for trip_id in active_trip_ids])
+# Destinations of all active trips, resolved together
+destination_names = get_destination_names(active_trip_ids)
 
-st.title('MBTA Orange Line Asset Monitor')
+st.title(f"MBTA {ROUTE_ID} Line Asset Monitor")
 
 st.divider()
 
@@ -148,118 +229,61 @@ with st.container(border=True):
     )
     st.caption('Non-revenue trips are not displayed.')
     carriage_details = get_carriage_details(SELECTED_TRIP_ID)
+    with st.expander('All active trips'):
+        st.dataframe(
+            [
+                {
+                    'Trip': trip_id,
+                    'Destination': destination_names.get(trip_id),
+                    'Location': f"{get_current_status_formatted(trip_id)} {get_current_stop_name(trip_id)}",
+                }
+                for trip_id in active_trip_ids
+            ],
+            hide_index=True
+        )
 
 st.subheader(f"Trip _{SELECTED_TRIP_ID}_")
 
 with st.container(border=True):
     st.subheader('General Info', divider='grey')
-    st.markdown(f"**Destination:** _{get_destination_name(SELECTED_TRIP_ID)}_")
+    st.markdown(f"**Destination:** _{destination_names.get(SELECTED_TRIP_ID, 'unknown')}_")
     st.markdown(f"**Location:** {get_current_status_formatted(SELECTED_TRIP_ID)} _{get_current_stop_name(SELECTED_TRIP_ID)}_")
 
-OCCUPANCY_STATUS_COLORS = {
-    'EMPTY': "#00f2ffd5",
-    'MANY_SEATS_AVAILABLE': '#b3ffb3',
-    'FEW_SEATS_AVAILABLE': "#ffff99",
-    'STANDING_ROOM_ONLY': "#ffc800",
-    'CRUSHED_STANDING_ROOM_ONLY': "#f0837d",
-    'FULL': "#ff00d0b4",
-    'NOT_ACCEPTING_PASSENGERS': "#9b9b9b",
-    'NO_DATA_AVAILABLE': '#9b9b9b',
-    'NOT_BOARDABLE': '#9b9b9b'
-}
-def st_carriage_metric(label, occupancy_percentage, occupancy_status) -> None:
-    color = OCCUPANCY_STATUS_COLORS[occupancy_status]
-    st.markdown(
-        f"""
-            <div class="train">
-                <div class="train-body"
-                    style="
-                        font-size:{CARRIAGE_SIZE_PX}px;
-                        display:flex;
-                        flex-direction: row;
-                        justify-content:center;
-                        align-items: center;
-                        border-style:solid;
-                        border-radius:25px;
-                        background-color:{color}
-                    "
-                >
-                    <div
-                        style="
-                            display:flex;
-                            flex-direction: column;
-                            justify-content:center;
-                            align-items: center;
-                        "
-                    >
-                        <p>{occupancy_percentage}<small>%</small></p>
-                        <p style="font-size:20px;">Car #{label}</p>
-                    </div>
-                </div>
-                <div 
-                    class="train-wheels"
-                    style="
-                        display:flex;
-                        flex-direction:row;
-                        justify-content:space-evenly;
-                    "
-                >
-                    <div
-                        style="
-                            height:{CARRIAGE_SIZE_PX // 4}px;
-                            width:{CARRIAGE_SIZE_PX // 4}px;
-                            border-style:solid;
-                            border-radius:50px;
-                            background-color:{color};
-                        "
-                    ></div>
-                    <div 
-                        style="
-                            height:{CARRIAGE_SIZE_PX // 4}px;
-                            width:{CARRIAGE_SIZE_PX // 4}px;
-                            border-style:solid;
-                            border-radius:50px;
-                            background-color:{color};
-                        "
-                    ></div>
-                </div>
-            </div>
-        """, 
-        unsafe_allow_html=True
-    )
-
 with st.container(border=True):
     st.subheader('Live Occupancy Of Each Carriage', divider='grey')
-    CARRIAGE_SIZE_PX=100
-
-    carriage_display_containers = st.columns(
-        spec=len(carriage_details),
-        vertical_alignment='center',
-        border=False,
+    # The whole train in one element
+    st.markdown(
+        carriage_render.train_html([
+            (carriage['label'], carriage['occupancy_percentage'], carriage['occupancy_status'])
+            for _, carriage in sorted(carriage_details.items())
+        ]),
+        unsafe_allow_html=True
     )
 
-    for i in range(len(carriage_display_containers)):
-        container = carriage_display_containers[i]
-        with container:
-            carriage = carriage_details[i+1]
-            st_carriage_metric(
-                carriage['label'],
-                carriage['occupancy_percentage'], 
-                carriage['occupancy_status']
-            )
-
     # Occupancy status color legend
-    st.markdown('<h3>Legend</h3>', unsafe_allow_html=True)
-    for occupancy_status, color in OCCUPANCY_STATUS_COLORS.items():
-        st.markdown(
-            f"""
-                <span style="display:flex; flex-direction:row; align-items:center;">
-                    <span style="color:{color}; font-size:40px; -webkit-text-stroke: 2px black;">◼︎</span>
-                    {occupancy_status.replace('_', ' ').capitalize()}
-                </span>
-            """,
-            unsafe_allow_html=True
+    st.markdown('<h3>Legend</h3>' + carriage_render.legend_html(), unsafe_allow_html=True)
+
+with st.container(border=True):
+    st.subheader('Occupancy History', divider='grey')
+    car_label_column, resolution_column = st.columns(2)
+    with car_label_column:
+        history_car_label = st.selectbox(
+            label='Car',
+            options=[carriage['label'] for carriage in carriage_details.values()],
+            format_func=lambda label: f"Car #{label}"
         )
+    with resolution_column:
+        history_resolution = st.radio(
+            label='Resolution',
+            options=['raw', 'minute', 'hour'],
+            format_func={'raw': 'Every poll', 'minute': 'Per minute', 'hour': 'Per hour'}.get,
+            horizontal=True
+        )
+    car_history = get_occupancy_history().history(history_car_label, history_resolution)
+    if car_history.empty:
+        st.caption('No history recorded for this car yet.')
+    else:
+        st.line_chart(car_history, y_label='Occupancy (%)')
 
 def format_date(date: datetime.datetime) -> str:
     # Processing each piece separately so separate
@@ -273,8 +297,20 @@ def format_date(date: datetime.datetime) -> str:
 
 st.divider()
 
+st.header('Fleet Occupancy')
+fleet_carriages = get_fleet_carriages(get_vehicle_snapshot().fetched_at)
+st.caption('Every line, from the same VehiclePositions snapshot. Non-revenue trips are not counted.')
+st.subheader('By line')
+st.dataframe(mbta_occupancy.occupancy_by_line(fleet_carriages))
+st.subheader('By car position')
+st.dataframe(mbta_occupancy.occupancy_by_position(fleet_carriages))
+with st.expander(f"Carriages of every train ({fleet_carriages['trip_id'].nunique()})"):
+    st.markdown(get_fleet_carriages_html(get_vehicle_snapshot().fetched_at), unsafe_allow_html=True)
+
+st.divider()
+
 st.header('Alerts Monitor')
-alerts = get_alerts()
+alerts = get_alerts(alerts_resp_obj)
 alerts_list, alerts_metrics = st.columns(2)
 # List of recent alerts
 with alerts_list:
@@ -306,6 +342,15 @@ with alerts_metrics:
 
     st.metric(value=len(alerts), label='Active Alerts', border=True)
 
+####################################
+# Debug panel (with TRANSIT_METRICS set)
+####################################
+
+if metrics.ENABLED:
+    metrics.record('render:mbta', time.perf_counter() - render_start)
+    with st.expander('Debug: metrics'):
+        st.dataframe(metrics.summary(), hide_index=True)
+
 ##############################
 # Active trips:
 # |  A  |  B  | -C- |  D  |
@@ -0,0 +1,27 @@
+import datetime
+import metrics
+
+
+def _parse_date(date_string: str) -> datetime.datetime:
+    # remove colon separating hour and minute of timezone offset
+    # so that it can be parsed by the %z directive
+    date_string = date_string[:-3] + date_string[-2:]
+    date_string = datetime.datetime.strptime(
+        date_string, 
+        "%Y-%m-%dT%H:%M:%S%z"
+    )
+    return date_string
+
+# Returns the fields of each alert in an /alerts response that the dashboards display
+@metrics.instrumented('parse_alerts')
+def parse_alerts(resp_obj: object) -> list[object]:
+    return [
+        {
+            'service_effect': alert['attributes']['service_effect'],
+            'created_at': _parse_date(alert['attributes']['created_at']),
+            'url': alert['attributes']['url'],
+            'short_header': alert['attributes']['short_header'],
+            'severity': alert['attributes']['severity']
+        }
+        for alert in resp_obj['data']
+    ]
@@ -0,0 +1,194 @@
+import os
+import json
+import time
+import threading
+import http_client
+
+# Metadata is kept on disk between server restarts, one JSON file per resource
+CACHE_DIR = os.environ.get(
+    'TRANSIT_METADATA_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'mbta_metadata')
+)
+
+# How long (in seconds) a cached stop or route is served before it is looked
+# up again. They only change with service changes, a few times a year.
+METADATA_TTL_SECONDS = 7 * 24 * 60 * 60
+
+# How long (in seconds) an ID the API did not know is not looked up again
+MISSING_METADATA_TTL_SECONDS = 60 * 60
+
+# Most IDs looked up per filter[id]= request, keeping URLs short
+MAX_IDS_PER_REQUEST = 100
+
+
+# Attributes of the resources of an MBTA V3 API endpoint (e.g. /stops,
+# /routes), stored under resource (e.g. 'stops'), by ID. Filled
+# lazily: IDs not yet cached, or cached longer than the TTL, are looked up
+# together in batched filter[id]= requests and written through to disk.
+# Warm lookups make no requests at all. If a lookup fails, IDs that were
+# cached before are served stale rather than failing the page. IDs the API
+# does not know are cached as such, for missing_ttl_seconds.
+class MetadataCache:
+
+    def __init__(self, resource: str, url: str, cache_dir: str = CACHE_DIR,
+                 ttl_seconds: float = METADATA_TTL_SECONDS,
+                 missing_ttl_seconds: float = MISSING_METADATA_TTL_SECONDS):
+        self.resource = resource
+        self.url = url
+        self.path = os.path.join(cache_dir, f"{resource}.json")
+        self.ttl_seconds = ttl_seconds
+        self.missing_ttl_seconds = missing_ttl_seconds
+        # ID -> [fetched_at (wall-clock seconds), attributes, or None if the API did not know the ID]
+        self._entries = self._read()
+        self._lock = threading.Lock()
+
+    def _read(self) -> dict[str, list]:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    # Writes the whole cache to a temporary file, then moves it into place,
+    # so readers (e.g. another app process) never see a partial file
+    def _write(self) -> None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(self._entries, f)
+        os.replace(temp_path, self.path)
+
+    def _is_fresh(self, id: str, now: float) -> bool:
+        entry = self._entries.get(id)
+        if entry is None:
+            return False
+        return now - entry[0] < (self.ttl_seconds if entry[1] is not None else self.missing_ttl_seconds)
+
+    def _fetch(self, ids: list[str]) -> None:
+        now = time.time()
+        for start in range(0, len(ids), MAX_IDS_PER_REQUEST):
+            batch = ids[start:start + MAX_IDS_PER_REQUEST]
+            resp_obj = http_client.get_json(f"{self.url}?filter[id]={','.join(batch)}")
+            found = set()
+            for resource in resp_obj['data']:
+                self._entries[resource['id']] = [now, resource['attributes']]
+                found.add(resource['id'])
+            for id in batch:
+                if id not in found:
+                    self._entries[id] = [now, None]
+
+    # Returns the attributes of each of the IDs, keyed by ID, looking up all
+    # missing or expired IDs at once. IDs the API does not know are left out.
+    def get_many(self, ids: list[str]) -> dict[str, dict]:
+        with self._lock:
+            now = time.time()
+            missing = [id for id in dict.fromkeys(ids) if not self._is_fresh(id, now)]
+            if missing:
+                try:
+                    self._fetch(missing)
+                except Exception:
+                    if any(id not in self._entries for id in missing):
+                        raise
+                else:
+                    self._write()
+            return {
+                id: entry[1] for id in ids
+                if (entry := self._entries.get(id)) is not None and entry[1] is not None
+            }
+
+    # Returns the attributes of one ID. Raises a KeyError if the API does not know it.
+    def get(self, id: str) -> dict:
+        attributes = self.get_many([id])
+        if id not in attributes:
+            raise KeyError(f"No {self.resource} found with id={id}")
+        return attributes[id]
+
+    # Adds resources already fetched with another request (e.g. the
+    # resources `included` in a response), as JSON:API resource objects
+    def add(self, resources: list[dict]) -> None:
+        if not resources:
+            return
+        with self._lock:
+            now = time.time()
+            for resource in resources:
+                self._entries[resource['id']] = [now, resource['attributes']]
+            self._write()
+
+
+# Trips remembered by a DestinationResolver before it forgets those no longer requested
+MAX_RESOLVED_TRIPS = 10_000
+
+# How long (in seconds) a trip the API did not know is not looked up again.
+# Trips added in realtime may only be published later, so this is kept short.
+UNKNOWN_TRIP_TTL_SECONDS = 10 * 60
+
+
+# Resolves the destination of trips: the direction_destination of the trip's
+# route in the trip's direction. Trips not seen before are fetched together in
+# batched filter[id]= requests that include their routes, which fill the route
+# cache; a trip's route and direction never change, so each trip is fetched once.
+# Trips the API does not know (e.g. added in realtime) are not looked up again
+# until unknown_ttl_seconds have passed.
+class DestinationResolver:
+
+    def __init__(self, trips_url: str, route_cache: MetadataCache,
+                 unknown_ttl_seconds: float = UNKNOWN_TRIP_TTL_SECONDS):
+        self.trips_url = trips_url
+        self.route_cache = route_cache
+        self.unknown_ttl_seconds = unknown_ttl_seconds
+        # trip ID -> (route ID, direction ID)
+        self._trip_directions = {}
+        # trip ID -> when (monotonic seconds) the API last did not know it
+        self._unknown_trips = {}
+        self._lock = threading.Lock()
+
+    def _fetch(self, trip_ids: list[str], now: float) -> None:
+        for start in range(0, len(trip_ids), MAX_IDS_PER_REQUEST):
+            batch = trip_ids[start:start + MAX_IDS_PER_REQUEST]
+            resp_obj = http_client.get_json(
+                f"{self.trips_url}?filter[id]={','.join(batch)}"
+                "&include=route&fields[trip]=direction_id"
+            )
+            self.route_cache.add([resource for resource in resp_obj.get('included', []) if resource['type'] == 'route'])
+            for trip in resp_obj['data']:
+                self._trip_directions[trip['id']] = (
+                    trip['relationships']['route']['data']['id'],
+                    int(trip['attributes']['direction_id']),
+                )
+            for trip_id in batch:
+                if trip_id in self._trip_directions:
+                    self._unknown_trips.pop(trip_id, None)
+                else:
+                    self._unknown_trips[trip_id] = now
+
+    def _is_known_unknown(self, trip_id: str, now: float) -> bool:
+        checked_at = self._unknown_trips.get(trip_id)
+        return checked_at is not None and now - checked_at < self.unknown_ttl_seconds
+
+    # Returns the destination of each of the trips, keyed by trip ID.
+    # Trips the API does not know are left out.
+    def resolve(self, trip_ids: list[str]) -> dict[str, str]:
+        with self._lock:
+            now = time.monotonic()
+            missing = [
+                trip_id for trip_id in dict.fromkeys(trip_ids)
+                if trip_id not in self._trip_directions and not self._is_known_unknown(trip_id, now)
+            ]
+            if missing:
+                self._fetch(missing, now)
+            trip_directions = {
+                trip_id: self._trip_directions[trip_id] for trip_id in trip_ids if trip_id in self._trip_directions
+            }
+            if len(self._trip_directions) > MAX_RESOLVED_TRIPS:
+                self._trip_directions = trip_directions
+            if len(self._unknown_trips) > MAX_RESOLVED_TRIPS:
+                self._unknown_trips = {
+                    trip_id: checked_at for trip_id, checked_at in self._unknown_trips.items()
+                    if now - checked_at < self.unknown_ttl_seconds
+                }
+        routes = self.route_cache.get_many([route_id for route_id, _ in trip_directions.values()])
+        return {
+            trip_id: routes[route_id]['direction_destinations'][direction_id]
+            for trip_id, (route_id, direction_id) in trip_directions.items()
+            if route_id in routes
+        }
@@ -0,0 +1,120 @@
+import numpy as np
+import pandas as pd
+
+# GTFS-realtime OccupancyStatus values, from least to most occupied
+# (then the statuses that carry no occupancy)
+OCCUPANCY_STATUSES = (
+    'EMPTY',
+    'MANY_SEATS_AVAILABLE',
+    'FEW_SEATS_AVAILABLE',
+    'STANDING_ROOM_ONLY',
+    'CRUSHED_STANDING_ROOM_ONLY',
+    'FULL',
+    'NOT_ACCEPTING_PASSENGERS',
+    'NO_DATA_AVAILABLE',
+    'NOT_BOARDABLE',
+)
+
+# Trip IDs of trains not in passenger service start with this
+NON_REVENUE_TRIP_PREFIX = 'NONREV'
+
+
+# One row per carriage of every revenue trip on every line, from the columns
+# of one VehiclePositions feed (see mbta_vehicles.flatten_feed). Vehicle
+# fields are repeated onto their carriages with one take per column.
+# Vehicles not on a line (no route_id) are left out, as they belong to no line's stats.
+def fleet_carriages(columns: dict[str, np.ndarray]) -> pd.DataFrame:
+    revenue_vehicles = np.array([
+        trip_id is not None and not trip_id.startswith(NON_REVENUE_TRIP_PREFIX) and route_id is not None
+        for trip_id, route_id in zip(columns['trip_id'].tolist(), columns['route_id'].tolist())
+    ], dtype=bool)
+    rows = np.flatnonzero(revenue_vehicles[columns['carriage.vehicle']])
+    vehicle = columns['carriage.vehicle'][rows]
+    return pd.DataFrame({
+        'route_id': pd.Categorical(columns['route_id'][vehicle]),
+        'trip_id': columns['trip_id'][vehicle],
+        'vehicle_label': columns['vehicle_label'][vehicle],
+        'carriage_label': columns['carriage.label'][rows],
+        'carriage_sequence': columns['carriage.carriage_sequence'][rows],
+        'occupancy_status': pd.Categorical(columns['carriage.occupancy_status'][rows], categories=OCCUPANCY_STATUSES),
+        'occupancy_percentage': columns['carriage.occupancy_percentage'][rows],
+    })
+
+
+# Number of carriages, mean and highest occupancy percentage of each group
+# (group_codes are 0..num_groups-1), with a few bincounts over all carriages
+def _occupancy_stats(group_codes: np.ndarray, num_groups: int, percentage: np.ndarray) -> dict[str, np.ndarray]:
+    reported = ~np.isnan(percentage)
+    num_reported = np.bincount(group_codes[reported], minlength=num_groups)
+    total = np.bincount(group_codes[reported], weights=percentage[reported], minlength=num_groups)
+    highest = np.full(num_groups, np.nan)
+    np.fmax.at(highest, group_codes, percentage)
+    return {
+        'carriages': np.bincount(group_codes, minlength=num_groups),
+        'mean_occupancy_percentage': np.divide(
+            total, num_reported, out=np.full(num_groups, np.nan), where=num_reported > 0
+        ).round(1),
+        'max_occupancy_percentage': highest,
+    }
+
+
+# Occupancy of each line: trips and carriages in service, mean and highest
+# carriage occupancy percentage, and the number of carriages in each status
+def occupancy_by_line(carriages: pd.DataFrame) -> pd.DataFrame:
+    routes = carriages['route_id'].cat.categories
+    route_codes = carriages['route_id'].cat.codes.to_numpy().astype(np.int64)
+    trip_codes, trip_ids = pd.factorize(carriages['trip_id'])
+    line_trips = np.unique(route_codes * len(trip_ids) + trip_codes) // max(len(trip_ids), 1)
+    stats = {
+        'trips': np.bincount(line_trips, minlength=len(routes)),
+        **_occupancy_stats(route_codes, len(routes), carriages['occupancy_percentage'].to_numpy(dtype=np.float64)),
+    }
+
+    status_codes = carriages['occupancy_status'].cat.codes.to_numpy().astype(np.int64)
+    known = status_codes >= 0
+    status_counts = np.bincount(
+        route_codes[known] * len(OCCUPANCY_STATUSES) + status_codes[known],
+        minlength=len(routes) * len(OCCUPANCY_STATUSES)
+    ).reshape(len(routes), len(OCCUPANCY_STATUSES))
+    for status, counts in zip(OCCUPANCY_STATUSES, status_counts.T):
+        if counts.any():
+            stats[status] = counts
+    in_service = stats['carriages'] > 0
+    return pd.DataFrame(
+        {column: values[in_service] for column, values in stats.items()},
+        index=pd.Index(routes[in_service], name='route_id'),
+    )
+
+
+# Occupancy of each carriage position (carriage_sequence, 1 at the front) on
+# each line, e.g. to find the cars of a train that wear fastest
+def occupancy_by_position(carriages: pd.DataFrame) -> pd.DataFrame:
+    routes = carriages['route_id'].cat.categories
+    route_codes = carriages['route_id'].cat.codes.to_numpy().astype(np.int64)
+    sequences = carriages['carriage_sequence'].to_numpy().astype(np.int64)
+    stride = int(sequences.max()) + 1 if len(sequences) else 1
+    keys, group_codes = np.unique(route_codes * stride + sequences, return_inverse=True)
+    return pd.DataFrame(
+        _occupancy_stats(group_codes, len(keys), carriages['occupancy_percentage'].to_numpy(dtype=np.float64)),
+        index=pd.MultiIndex.from_arrays(
+            [routes[keys // stride], keys % stride], names=['route_id', 'carriage_sequence']
+        ),
+    )
+
+
+# The carriages of each trip, front first, as (route_id, trip_id, carriages)
+# with carriages a list of (label, occupancy_percentage, occupancy_status)
+def carriages_by_trip(carriages: pd.DataFrame) -> list[tuple[str, str, list[tuple[str, float, str]]]]:
+    ordered = carriages.sort_values(['route_id', 'trip_id', 'carriage_sequence'])
+    route_ids = ordered['route_id'].astype(str).tolist()
+    trip_ids = ordered['trip_id'].tolist()
+    rows = list(zip(
+        ordered['carriage_label'].tolist(),
+        ordered['occupancy_percentage'].tolist(),
+        ordered['occupancy_status'].astype(str).tolist(),
+    ))
+    starts = [i for i in range(len(trip_ids)) if i == 0 or trip_ids[i] != trip_ids[i - 1]]
+    return [
+        (route_ids[start], trip_ids[start], rows[start:end])
+        for start, end in zip(starts, starts[1:] + [len(trip_ids)])
+    ]
@@ -0,0 +1,177 @@
+import time
+import threading
+from json import loads
+import numpy as np
+import http_client
+
+# How long (in seconds) a fetched VehiclePositions snapshot is served before
+# the feed is polled again. The feed itself is only regenerated every few seconds.
+SNAPSHOT_TTL_SECONDS = 10
+
+
+# One parsed VehiclePositions.json feed, with vehicles indexed by trip ID.
+# All accessors in a page render share one snapshot, so the feed is downloaded
+# (at most) once per TTL rather than once per widget. Re-polls are conditional
+# (ETag / If-Modified-Since), so an unchanged feed costs a 304 and no parsing.
+class VehicleSnapshot:
+
+    def __init__(self, url: str, ttl_seconds: float = SNAPSHOT_TTL_SECONDS):
+        self.url = url
+        self.ttl_seconds = ttl_seconds
+        self.header = {}
+        self.entity = []
+        self.vehicles_by_trip_id = {}
+        self.fetched_at = None
+        self._etag = None
+        self._last_modified = None
+        self._lock = threading.Lock()
+
+    def is_expired(self) -> bool:
+        return self.fetched_at is None or time.monotonic() - self.fetched_at >= self.ttl_seconds
+
+    # Polls the feed, unless the current snapshot is still fresh. Snapshots
+    # without a url are only ever filled by load() (e.g. when replaying).
+    def refresh(self, force: bool = False) -> None:
+        with self._lock:
+            if self.url is None or (not force and not self.is_expired()):
+                return
+            headers = {}
+            if self._etag is not None:
+                headers['If-None-Match'] = self._etag
+            if self._last_modified is not None:
+                headers['If-Modified-Since'] = self._last_modified
+            resp = http_client.get(self.url, headers=headers)
+            if resp.status_code != 304:
+                self._index(loads(resp.content))
+                self._etag = resp.headers.get('ETag')
+                self._last_modified = resp.headers.get('Last-Modified')
+            self.fetched_at = time.monotonic()
+
+    # Replaces the snapshot with an already parsed feed
+    def load(self, feed: dict) -> None:
+        with self._lock:
+            self._index(feed)
+            self.fetched_at = time.monotonic()
+
+    def _index(self, feed: dict) -> None:
+        vehicles_by_trip_id = {}
+        for vehicle_position in feed['entity']:
+            vehicle = vehicle_position['vehicle']
+            # Keep the first VehiclePosition for a trip, as get_vehicle always has
+            vehicles_by_trip_id.setdefault(vehicle['trip']['trip_id'], vehicle)
+        self.header = feed['header']
+        self.entity = feed['entity']
+        self.vehicles_by_trip_id = vehicles_by_trip_id
+
+    # Returns the VehicleDescriptor of the first VehiclePosition with the specified trip ID.
+    # Raises an Exception if no VehiclePosition can be found with the specified trip ID.
+    def get_vehicle(self, trip_id: str) -> object:
+        self.refresh()
+        try:
+            return self.vehicles_by_trip_id[trip_id]
+        except KeyError:
+            raise Exception(f"No VehiclePosition found with trip_id={trip_id}")
+
+    # Returns the VehicleDescriptor of every vehicle in the snapshot
+    def get_vehicles(self) -> list[object]:
+        self.refresh()
+        return [vehicle_position['vehicle'] for vehicle_position in self.entity]
+
+
+# Returns the details of each carriage of a vehicle, keyed by carriage sequence number
+def carriage_details(vehicle: object) -> dict:
+    return {
+        carriage['carriage_sequence']: {
+            'label': carriage['label'],
+            'occupancy_status': carriage['occupancy_status'],
+            'occupancy_percentage': carriage['occupancy_percentage'] if 'occupancy_percentage' in carriage.keys() else float('NaN')  
+        }
+        for carriage in vehicle['multi_carriage_details']
+    }
+
+
+# Flattens a VehiclePositions feed into columns, e.g. for recording it with
+# feed_log: one row per vehicle, plus 'carriage.*' columns with one row per
+# carriage ('carriage.vehicle' is the row of the carriage's vehicle)
+def flatten_feed(feed: dict) -> dict[str, np.ndarray]:
+    vehicle_columns = {
+        'entity_id': [], 'trip_id': [], 'route_id': [], 'direction_id': [],
+        'current_status': [], 'stop_id': [], 'timestamp': [],
+        'vehicle_id': [], 'vehicle_label': [], 'latitude': [], 'longitude': [],
+    }
+    carriage_columns = {
+        'carriage.vehicle': [], 'carriage.label': [], 'carriage.carriage_sequence': [],
+        'carriage.occupancy_status': [], 'carriage.occupancy_percentage': [],
+    }
+    for row, vehicle_position in enumerate(feed['entity']):
+        vehicle = vehicle_position['vehicle']
+        trip = vehicle.get('trip', {})
+        descriptor = vehicle.get('vehicle', {})
+        position = vehicle.get('position', {})
+        vehicle_columns['entity_id'].append(vehicle_position.get('id'))
+        vehicle_columns['trip_id'].append(trip.get('trip_id'))
+        vehicle_columns['route_id'].append(trip.get('route_id'))
+        vehicle_columns['direction_id'].append(trip.get('direction_id', -1))
+        vehicle_columns['current_status'].append(vehicle.get('current_status'))
+        vehicle_columns['stop_id'].append(vehicle.get('stop_id'))
+        vehicle_columns['timestamp'].append(vehicle.get('timestamp', 0))
+        vehicle_columns['vehicle_id'].append(descriptor.get('id'))
+        vehicle_columns['vehicle_label'].append(descriptor.get('label'))
+        vehicle_columns['latitude'].append(position.get('latitude', float('NaN')))
+        vehicle_columns['longitude'].append(position.get('longitude', float('NaN')))
+        for carriage in vehicle.get('multi_carriage_details', []):
+            carriage_columns['carriage.vehicle'].append(row)
+            carriage_columns['carriage.label'].append(carriage.get('label'))
+            carriage_columns['carriage.carriage_sequence'].append(carriage.get('carriage_sequence', 0))
+            carriage_columns['carriage.occupancy_status'].append(carriage.get('occupancy_status'))
+            carriage_columns['carriage.occupancy_percentage'].append(carriage.get('occupancy_percentage', float('NaN')))
+
+    columns = {name: np.array(values, dtype=object) for name, values in vehicle_columns.items()}
+    columns['direction_id'] = np.array(vehicle_columns['direction_id'], dtype=np.int8)
+    columns['timestamp'] = np.array(vehicle_columns['timestamp'], dtype=np.int64)
+    columns['latitude'] = np.array(vehicle_columns['latitude'], dtype=np.float64)
+    columns['longitude'] = np.array(vehicle_columns['longitude'], dtype=np.float64)
+    columns['header_timestamp'] = np.array([feed['header'].get('timestamp', 0)], dtype=np.int64)
+    columns['carriage.vehicle'] = np.array(carriage_columns['carriage.vehicle'], dtype=np.int32)
+    columns['carriage.label'] = np.array(carriage_columns['carriage.label'], dtype=object)
+    columns['carriage.carriage_sequence'] = np.array(carriage_columns['carriage.carriage_sequence'], dtype=np.int16)
+    columns['carriage.occupancy_status'] = np.array(carriage_columns['carriage.occupancy_status'], dtype=object)
+    columns['carriage.occupancy_percentage'] = np.array(carriage_columns['carriage.occupancy_percentage'], dtype=np.float64)
+    return columns
+
+
+# Rebuilds a VehiclePositions feed (with the fields flatten_feed keeps) from its columns
+def unflatten_feed(columns: dict[str, np.ndarray]) -> dict:
+    carriages_by_vehicle = {}
+    for row, label, sequence, status, percentage in zip(
+        columns['carriage.vehicle'].tolist(),
+        columns['carriage.label'].tolist(),
+        columns['carriage.carriage_sequence'].tolist(),
+        columns['carriage.occupancy_status'].tolist(),
+        columns['carriage.occupancy_percentage'].tolist(),
+    ):
+        carriage = {'label': label, 'carriage_sequence': sequence, 'occupancy_status': status}
+        if percentage == percentage:  # not NaN
+            carriage['occupancy_percentage'] = int(percentage)
+        carriages_by_vehicle.setdefault(row, []).append(carriage)
+
+    entity = []
+    for row in range(len(columns['trip_id'])):
+        trip = {'trip_id': columns['trip_id'][row], 'route_id': columns['route_id'][row]}
+        if columns['direction_id'][row] >= 0:
+            trip['direction_id'] = int(columns['direction_id'][row])
+        vehicle = {
+            'trip': trip,
+            'current_status': columns['current_status'][row],
+            'stop_id': columns['stop_id'][row],
+            'timestamp': int(columns['timestamp'][row]),
+            'vehicle': {'id': columns['vehicle_id'][row], 'label': columns['vehicle_label'][row]},
+            'multi_carriage_details': carriages_by_vehicle.get(row, []),
+        }
+        if columns['latitude'][row] == columns['latitude'][row]:
+            vehicle['position'] = {
+                'latitude': float(columns['latitude'][row]),
+                'longitude': float(columns['longitude'][row]),
+            }
+        entity.append({'id': columns['entity_id'][row], 'vehicle': vehicle})
+    return {'header': {'timestamp': int(columns['header_timestamp'][0])}, 'entity': entity}
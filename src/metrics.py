@@ -0,0 +1,212 @@
+import os
+import time
+import bisect
+import threading
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+# Instrumentation is off unless TRANSIT_METRICS is set, and this is decided once
+# at import. When off, @instrumented returns functions undecorated and timer()
+# returns a shared no-op, so the hot paths cost what they did before.
+ENABLED = os.environ.get('TRANSIT_METRICS', '').lower() in ('1', 'true', 'yes')
+
+# Port the apps serve the Prometheus text endpoint on (when metrics are enabled).
+# Each app runs in its own process, so give each its own port.
+PORT = int(os.environ.get('TRANSIT_METRICS_PORT', 9464))
+
+# Upper bounds (in seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRIC_PREFIX = 'transit_stage'
+
+
+# Latency histogram, call, error and byte counts of one stage
+class _StageStats:
+    __slots__ = ('bucket_counts', 'sum_seconds', 'max_seconds', 'calls', 'errors', 'bytes')
+
+    def __init__(self):
+        # One count per bucket, plus one for +Inf
+        self.bucket_counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum_seconds = 0.0
+        self.max_seconds = 0.0
+        self.calls = 0
+        self.errors = 0
+        self.bytes = 0
+
+
+_stats = {}
+_lock = threading.Lock()
+
+
+# Records one call of a stage that took seconds and handled nbytes bytes
+def record(stage: str, seconds: float, nbytes: int = 0, error: bool = False) -> None:
+    bucket = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+    with _lock:
+        stats = _stats.get(stage)
+        if stats is None:
+            stats = _stats[stage] = _StageStats()
+        stats.bucket_counts[bucket] += 1
+        stats.sum_seconds += seconds
+        stats.max_seconds = max(stats.max_seconds, seconds)
+        stats.calls += 1
+        stats.errors += error
+        stats.bytes += nbytes
+
+
+# Times a block as one call of a stage; the block can add the bytes it handled
+class _Timer:
+    __slots__ = ('stage', 'nbytes', '_start')
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.nbytes = 0
+
+    def add_bytes(self, nbytes: int) -> None:
+        self.nbytes += nbytes
+
+    def __enter__(self) -> '_Timer':
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        record(self.stage, time.perf_counter() - self._start, self.nbytes, exc_type is not None)
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def add_bytes(self, nbytes: int) -> None:
+        pass
+
+    def __enter__(self) -> '_NullTimer':
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+# Returns a context manager timing a block as one call of stage, e.g.
+#     with metrics.timer('nyct_fetch') as timer:
+#         content = ...
+#         timer.add_bytes(len(content))
+def timer(stage: str) -> _Timer | _NullTimer:
+    return _Timer(stage) if ENABLED else _NULL_TIMER
+
+
+# Decorator timing every call of a function as a stage. nbytes, if given,
+# returns the number of bytes handled from the function's result.
+def instrumented(stage: str, nbytes: Callable[[object], int] | None = None):
+    def decorate(fn):
+        if not ENABLED:
+            return fn
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException:
+                record(stage, time.perf_counter() - start, error=True)
+                raise
+            record(stage, time.perf_counter() - start, nbytes(result) if nbytes is not None else 0)
+            return result
+        return wrapper
+    return decorate
+
+
+####################################
+# Reporting
+####################################
+
+def _copy_stats() -> dict[str, _StageStats]:
+    with _lock:
+        copies = {}
+        for stage, stats in _stats.items():
+            copy = copies[stage] = _StageStats()
+            for slot in _StageStats.__slots__:
+                value = getattr(stats, slot)
+                setattr(copy, slot, list(value) if isinstance(value, list) else value)
+        return copies
+
+
+def _escape(label: str) -> str:
+    return label.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+# All stages in the Prometheus text exposition format
+def render_prometheus() -> str:
+    stats_by_stage = sorted(_copy_stats().items())
+    lines = [
+        f"# HELP {METRIC_PREFIX}_seconds Time taken by each call of a stage",
+        f"# TYPE {METRIC_PREFIX}_seconds histogram",
+    ]
+    for stage, stats in stats_by_stage:
+        label = f'stage="{_escape(stage)}"'
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + (float('inf'),), stats.bucket_counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(f'{METRIC_PREFIX}_seconds_bucket{{{label},le="{le}"}} {cumulative}')
+        lines.append(f"{METRIC_PREFIX}_seconds_sum{{{label}}} {stats.sum_seconds!r}")
+        lines.append(f"{METRIC_PREFIX}_seconds_count{{{label}}} {stats.calls}")
+    for name, help_text, slot in (
+        ('calls_total', 'Calls of a stage', 'calls'),
+        ('errors_total', 'Calls of a stage that raised', 'errors'),
+        ('bytes_total', 'Bytes downloaded or decoded by a stage', 'bytes'),
+    ):
+        lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {METRIC_PREFIX}_{name} counter")
+        for stage, stats in stats_by_stage:
+            lines.append(f'{METRIC_PREFIX}_{name}{{stage="{_escape(stage)}"}} {getattr(stats, slot)}')
+    return '\n'.join(lines) + '\n'
+
+
+# One row per stage, for display (e.g. the apps' debug panels). p95_ms is the
+# upper bound of the histogram bucket holding the 95th percentile.
+def summary() -> list[dict]:
+    rows = []
+    for stage, stats in sorted(_copy_stats().items()):
+        p95_rank = 0.95 * stats.calls
+        cumulative = 0
+        p95_seconds = float('inf')
+        for bound, count in zip(LATENCY_BUCKETS, stats.bucket_counts):
+            cumulative += count
+            if cumulative >= p95_rank:
+                p95_seconds = bound
+                break
+        rows.append({
+            'stage': stage,
+            'calls': stats.calls,
+            'errors': stats.errors,
+            'MiB': round(stats.bytes / 2**20, 3),
+            'mean_ms': round(stats.sum_seconds / stats.calls * 1000, 3),
+            'p95_ms': round(min(p95_seconds, stats.max_seconds) * 1000, 3),
+            'max_ms': round(stats.max_seconds * 1000, 3),
+        })
+    return rows
+
+
+# Serves render_prometheus() at /metrics on a background thread
+def serve(port: int = PORT, host: str = '') -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = render_prometheus().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True, name='metrics').start()
+    return server
@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+import gtfs_realtime_NYCT_pb2 as nyct
+from gtfs_realtime_NYCT_pb2 import gtfs__realtime__pb2 as gtfs
+
+# Enum value -> name lookups, built once instead of calling Name() per entity
+VEHICLE_STOP_STATUS_NAMES = {
+    value.number: value.name
+    for value in gtfs.VehiclePosition.VehicleStopStatus.DESCRIPTOR.values
+}
+DIRECTION_NAMES = {
+    value.number: value.name
+    for value in nyct.NyctTripDescriptor.Direction.DESCRIPTOR.values
+}
+
+VEHICLE_POSITION_COLUMNS = ('trip_id', 'route_id', 'direction', 'current_status', 'stop_id', 'timestamp')
+
+# Columns of the NYCT trip descriptor beyond the direction, decoded on request:
+# the train ID (e.g. '01 0153+ 242/SFT': type and line, origin time, origin and
+# destination) and whether the trip has been assigned a physical train
+TRAIN_COLUMNS = ('train_id', 'is_assigned')
+
+
+def parse_feed_message(content: bytes) -> gtfs.FeedMessage:
+    feed_message = gtfs.FeedMessage()
+    feed_message.ParseFromString(content)
+    return feed_message
+
+
+# Decodes the vehicle positions of a NYCT GTFS-realtime feed into flat,
+# equal-length columns (struct-of-arrays), one row per vehicle entity.
+# Non-vehicle entities (trip updates, alerts) and, if route_ids is given,
+# vehicles on other routes are skipped before any of their fields are read.
+# With train_columns, the TRAIN_COLUMNS are decoded as well.
+def decode_vehicle_positions(content: bytes | gtfs.FeedMessage,
+                             route_ids: set[str] | None = None,
+                             train_columns: bool = False) -> dict[str, np.ndarray]:
+    feed_message = content if isinstance(content, gtfs.FeedMessage) else parse_feed_message(content)
+    columns = {column: [] for column in VEHICLE_POSITION_COLUMNS + (TRAIN_COLUMNS if train_columns else ())}
+    trip_ids = columns['trip_id']
+    routes = columns['route_id']
+    directions = columns['direction']
+    statuses = columns['current_status']
+    stop_ids = columns['stop_id']
+    timestamps = columns['timestamp']
+    train_ids = columns.get('train_id')
+    assigned = columns.get('is_assigned')
+    nyct_trip_descriptor = nyct.nyct_trip_descriptor
+
+    for entity in feed_message.entity:
+        if not entity.HasField('vehicle'):
+            continue
+        vehicle = entity.vehicle
+        trip = vehicle.trip
+        route_id = trip.route_id
+        if route_ids is not None and route_id not in route_ids:
+            continue
+        trip_ids.append(trip.trip_id)
+        routes.append(route_id)
+        if trip.HasExtension(nyct_trip_descriptor):
+            nyct_trip = trip.Extensions[nyct_trip_descriptor]
+            directions.append(DIRECTION_NAMES.get(nyct_trip.direction))
+            if train_columns:
+                train_ids.append(nyct_trip.train_id or None)
+                assigned.append(nyct_trip.is_assigned if nyct_trip.HasField('is_assigned') else None)
+        else:
+            directions.append(None)
+            if train_columns:
+                train_ids.append(None)
+                assigned.append(None)
+        statuses.append(VEHICLE_STOP_STATUS_NAMES[vehicle.current_status])
+        stop_ids.append(vehicle.stop_id)
+        timestamps.append(vehicle.timestamp)
+
+    decoded = {
+        column: np.array(values, dtype=object)
+        for column, values in columns.items() if column != 'timestamp'
+    }
+    decoded['timestamp'] = np.array(timestamps, dtype=np.int64)
+    return decoded
+
+
+# Origin and destination (e.g. '242' and 'SFT') of each train ID, as in its
+# trailing '<origin>/<destination>'; None where a train ID has no such part.
+# A train reports the same ID all trip long, so only distinct IDs are parsed.
+def train_origin_destination(train_ids: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    codes, distinct = pd.factorize(train_ids, use_na_sentinel=False)
+    parts = pd.Series(distinct, dtype=object).str.extract(r'(?:^|\s)([^\s/]+)/([^\s/]+)$')
+    return (
+        parts[0].to_numpy(dtype=object, na_value=None)[codes],
+        parts[1].to_numpy(dtype=object, na_value=None)[codes],
+    )
+
+
+# Returns decoded vehicle positions as a DataFrame, with low-cardinality
+# columns as categoricals and a 'time' column derived from the POSIX timestamp
+def to_dataframe(decoded: dict[str, np.ndarray]) -> pd.DataFrame:
+    df = pd.DataFrame(decoded, columns=list(VEHICLE_POSITION_COLUMNS))
+    df = df.astype({
+        'route_id': 'category',
+        'direction': 'category',
+        'current_status': 'category',
+        'timestamp': np.int64,
+    })
+    df['time'] = pd.to_datetime(df['timestamp'], unit='s')
+    return df
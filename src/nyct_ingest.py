@@ -0,0 +1,183 @@
+import time
+import threading
+from concurrent.futures import wait
+from dataclasses import dataclass, field, replace
+import numpy as np
+import pandas as pd
+import http_client
+import metrics
+import nyct_decoder
+from snapshot_diff import SnapshotDiff
+
+NYCT_FEED_BASE_URL = r'https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/nyct%2F'
+
+# The NYCT realtime feeds, one per division, keyed by the lines they cover
+NYCT_FEED_URLS = {
+    '1234567S': NYCT_FEED_BASE_URL + 'gtfs',
+    'ACE': NYCT_FEED_BASE_URL + 'gtfs-ace',
+    'BDFM': NYCT_FEED_BASE_URL + 'gtfs-bdfm',
+    'G': NYCT_FEED_BASE_URL + 'gtfs-g',
+    'JZ': NYCT_FEED_BASE_URL + 'gtfs-jz',
+    'NQRW': NYCT_FEED_BASE_URL + 'gtfs-nqrw',
+    'L': NYCT_FEED_BASE_URL + 'gtfs-l',
+    'SIR': NYCT_FEED_BASE_URL + 'gtfs-si',
+}
+
+# Feed carrying the trains of each route in routes.txt
+FEED_BY_ROUTE_ID = {
+    **{route_id: '1234567S' for route_id in ('1', '2', '3', '4', '5', '5X', '6', '6X', '7', '7X', 'GS')},
+    **{route_id: 'ACE' for route_id in ('A', 'C', 'E', 'H', 'FS')},
+    **{route_id: 'BDFM' for route_id in ('B', 'D', 'F', 'FX', 'M')},
+    'G': 'G',
+    'J': 'JZ',
+    'Z': 'JZ',
+    **{route_id: 'NQRW' for route_id in ('N', 'Q', 'R', 'W')},
+    'L': 'L',
+    'SI': 'SIR',
+}
+
+# Express variants of a line (e.g. 7X, the <7>) are its route_id with this suffix
+EXPRESS_ROUTE_SUFFIX = 'X'
+
+# How long (in seconds) a refresh waits on feeds before publishing a snapshot.
+# Feeds still downloading keep their previous data and are merged in when they land.
+REFRESH_TIMEOUT_SECONDS = 5
+
+
+# Freshness of one feed within a snapshot
+@dataclass(frozen=True)
+class FeedStatus:
+    feed: str
+    fetched_at: float | None = None     # wall-clock time the feed was last decoded
+    feed_timestamp: int | None = None   # FeedHeader timestamp of that feed
+    fetch_seconds: float | None = None  # time taken to fetch and decode it
+    error: str | None = None            # error of the latest attempt, if it failed
+
+
+# Vehicle positions of every feed, merged. Never mutated after it is published,
+# so readers always see one consistent set of positions.
+@dataclass(frozen=True)
+class SystemSnapshot:
+    positions: pd.DataFrame
+    positions_by_route: dict[str, pd.DataFrame]
+    feed_status: dict[str, FeedStatus] = field(default_factory=dict)
+    # Trains changed since the previous snapshot, and the version of each
+    # route, when snapshots are tracked (see snapshot_diff.SnapshotTracker)
+    diff: SnapshotDiff | None = None
+    route_versions: dict[str, int] = field(default_factory=dict)
+
+    def route(self, route_id: str) -> pd.DataFrame:
+        return self.positions_by_route.get(route_id, self.positions.iloc[:0])
+
+    # Positions of a line's trains, including its express variant
+    def line(self, route_id: str) -> pd.DataFrame:
+        return pd.concat([self.route(route_id), self.route(route_id + EXPRESS_ROUTE_SUFFIX)])
+
+
+# Columns of a snapshot's positions: the decoded columns plus the feed of each row
+SNAPSHOT_COLUMNS = nyct_decoder.VEHICLE_POSITION_COLUMNS + ('feed',)
+
+
+# Builds a snapshot from flat columns (see SNAPSHOT_COLUMNS)
+def snapshot_from_columns(columns: dict[str, np.ndarray],
+                          feed_status: dict[str, FeedStatus] | None = None) -> SystemSnapshot:
+    positions = nyct_decoder.to_dataframe({
+        column: columns[column] for column in nyct_decoder.VEHICLE_POSITION_COLUMNS
+    })
+    positions['feed'] = pd.Categorical(columns['feed'])
+    positions_by_route = {
+        str(route_id): route_positions
+        for route_id, route_positions in positions.groupby('route_id', observed=True)
+    }
+    return SystemSnapshot(positions, positions_by_route, feed_status or {})
+
+# Returns the flat columns of a snapshot, e.g. for recording it with feed_log
+def snapshot_columns(snapshot: SystemSnapshot) -> dict[str, np.ndarray]:
+    return {
+        column: snapshot.positions[column].to_numpy(dtype=np.int64 if column == 'timestamp' else object)
+        for column in SNAPSHOT_COLUMNS
+    }
+
+
+def _merge(decoded_by_feed: dict[str, dict[str, np.ndarray]],
+           feed_status: dict[str, FeedStatus]) -> SystemSnapshot:
+    if decoded_by_feed:
+        merged = {
+            column: np.concatenate([decoded[column] for decoded in decoded_by_feed.values()])
+            for column in nyct_decoder.VEHICLE_POSITION_COLUMNS
+        }
+    else:
+        merged = nyct_decoder.decode_vehicle_positions(b'')
+    merged['feed'] = np.repeat(
+        np.array(list(decoded_by_feed.keys()), dtype=object),
+        [len(decoded['trip_id']) for decoded in decoded_by_feed.values()]
+    )
+    return snapshot_from_columns(merged, feed_status)
+
+
+# Fetches and decodes all NYCT feeds in parallel and merges them into one
+# system-wide snapshot. A slow or failing feed never holds back the others:
+# its previous data stays in the snapshot until a newer download succeeds.
+class NyctIngestor:
+
+    def __init__(self, feed_urls: dict[str, str] = NYCT_FEED_URLS, route_ids: set[str] | None = None):
+        self.feed_urls = feed_urls
+        self.route_ids = route_ids
+        self._decoded_by_feed = {}
+        self._status_by_feed = {feed: FeedStatus(feed) for feed in feed_urls}
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._snapshot = _merge({}, dict(self._status_by_feed))
+
+    @property
+    def snapshot(self) -> SystemSnapshot:
+        return self._snapshot
+
+    # Runs on a worker thread. The new snapshot is published before the task
+    # completes, so anyone waiting on the task sees the feed's new data.
+    def _refresh_feed(self, feed: str) -> None:
+        start = time.perf_counter()
+        try:
+            with metrics.timer('nyct_fetch') as timer:
+                content = http_client.get(self.feed_urls[feed]).content
+                timer.add_bytes(len(content))
+            with metrics.timer('nyct_decode') as timer:
+                timer.add_bytes(len(content))
+                feed_message = nyct_decoder.parse_feed_message(content)
+                decoded = nyct_decoder.decode_vehicle_positions(feed_message, route_ids=self.route_ids)
+        except Exception as e:
+            with self._lock:
+                self._status_by_feed[feed] = replace(self._status_by_feed[feed], error=repr(e))
+                self._snapshot = replace(self._snapshot, feed_status=dict(self._status_by_feed))
+                del self._in_flight[feed]
+            return
+        status = FeedStatus(feed, time.time(), feed_message.header.timestamp, time.perf_counter() - start)
+        with self._lock:
+            self._decoded_by_feed[feed] = decoded
+            self._status_by_feed[feed] = status
+            self._snapshot = _merge(self._decoded_by_feed, dict(self._status_by_feed))
+            del self._in_flight[feed]
+
+    # Starts downloading every feed that isn't already downloading, waits up to
+    # timeout seconds for them, and returns the latest snapshot
+    def refresh(self, timeout: float = REFRESH_TIMEOUT_SECONDS) -> SystemSnapshot:
+        with self._lock:
+            for feed in self.feed_urls:
+                if feed not in self._in_flight:
+                    self._in_flight[feed] = http_client.submit(self._refresh_feed, feed)
+            in_flight = list(self._in_flight.values())
+        wait(in_flight, timeout=timeout)
+        return self._snapshot
+
+
+# `python src/nyct_ingest.py` refreshes once and compares the wall-clock time
+# of the full-system refresh against the time of each individual feed
+if __name__ == '__main__':
+    ingestor = NyctIngestor()
+    start = time.perf_counter()
+    snapshot = ingestor.refresh(timeout=None)
+    wall_seconds = time.perf_counter() - start
+    for status in snapshot.feed_status.values():
+        seconds = f"{status.fetch_seconds:.3f} s" if status.fetch_seconds is not None else '-'
+        print(f"{status.feed:>9}: {seconds:>9} {status.error or ''}")
+    print(f"full refresh: {wall_seconds:.3f} s, {len(snapshot.positions)} vehicles on {len(snapshot.positions_by_route)} routes")
@@ -0,0 +1,233 @@
+import os
+import time
+import threading
+import numpy as np
+import pandas as pd
+
+# The history is saved here between server restarts
+HISTORY_PATH = os.environ.get(
+    'TRANSIT_OCCUPANCY_HISTORY_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'occupancy_history.npz')
+)
+
+# Carriages tracked at once. When a new carriage appears in a full store, the
+# carriage seen least recently is forgotten to make room.
+MAX_CARRIAGES = 1024
+
+# Columns (time steps) kept at each resolution:
+# raw samples (one per poll, ~1 hour at a 10 s poll interval),
+# minute rollups (6 hours) and hour rollups (1 week)
+RAW_CAPACITY = 360
+MINUTE_CAPACITY = 6 * 60
+HOUR_CAPACITY = 7 * 24
+
+# How often (in seconds) the history is saved to disk
+PERSIST_INTERVAL_SECONDS = 5 * 60
+
+# Statistics kept per rollup bucket
+ROLLUP_STATS = ('min', 'mean', 'max', 'p95')
+
+
+# The qth percentile of each row, ignoring NaNs, with linear interpolation
+# (as np.nanpercentile) but with one sort for all rows instead of a loop over them.
+# Every row must have at least one non-NaN value.
+def _nan_percentile(values: np.ndarray, q: float) -> np.ndarray:
+    ordered = np.sort(values, axis=1)  # NaNs sort last
+    rank = (np.count_nonzero(~np.isnan(values), axis=1) - 1) * (q / 100)
+    below = np.floor(rank).astype(np.int64)
+    above = np.minimum(below + 1, values.shape[1] - 1)
+    low = np.take_along_axis(ordered, below[:, None], axis=1)[:, 0]
+    high = np.take_along_axis(ordered, above[:, None], axis=1)[:, 0]
+    return low + (rank - below) * np.where(rank > below, high - low, 0)
+
+
+# A ring of time steps shared by every carriage: column i of each array holds
+# the step that started at times[i], one row per carriage (NaN if the
+# carriage had no data in that step)
+class _Ring:
+
+    def __init__(self, num_rows: int, capacity: int, stats: tuple[str, ...]):
+        self.times = np.full(capacity, -1, dtype=np.int64)
+        self.values = {stat: np.full((num_rows, capacity), np.nan, dtype=np.float32) for stat in stats}
+        self.position = 0
+
+    # Writes one column (one value per row for each stat), overwriting the oldest
+    def append(self, step_time: int, columns: dict[str, np.ndarray]) -> None:
+        self.times[self.position] = step_time
+        for stat, column in columns.items():
+            self.values[stat][:, self.position] = column
+        self.position = (self.position + 1) % len(self.times)
+
+    # Column indices of the steps in [start, end), oldest first
+    def columns_between(self, start: int, end: int) -> np.ndarray:
+        order = np.roll(np.arange(len(self.times)), -self.position)
+        step_times = self.times[order]
+        return order[(step_times >= start) & (step_times < end)]
+
+    def clear_row(self, row: int) -> None:
+        for values in self.values.values():
+            values[row] = np.nan
+
+
+# Occupancy percentage history of every carriage, by carriage label, in fixed
+# NumPy ring buffers, so memory stays bounded however long it runs (about
+# 10 MiB at the default sizes). Raw samples are rolled up into min/mean/max/p95
+# per minute as each minute closes, and minutes into hours as each hour closes.
+# Recording a poll and querying a carriage are a few array operations each.
+# Hour rollups are computed from the minute rollups, so an hour's p95 is the
+# 95th percentile of its minutes' p95s rather than of its raw samples.
+class OccupancyHistory:
+
+    def __init__(self, max_carriages: int = MAX_CARRIAGES, path: str | None = HISTORY_PATH):
+        self.path = path
+        self.rows_by_label = {}
+        self.last_seen = np.full(max_carriages, -1, dtype=np.int64)
+        self.raw = _Ring(max_carriages, RAW_CAPACITY, ('value',))
+        self.minutes = _Ring(max_carriages, MINUTE_CAPACITY, ROLLUP_STATS)
+        self.hours = _Ring(max_carriages, HOUR_CAPACITY, ROLLUP_STATS)
+        # Start of the minute and hour currently being filled
+        self.open_minute = None
+        self.open_hour = None
+        self.saved_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    # Row of each label, making room for new ones (-1 for labels left out
+    # because the poll alone has more carriages than there are rows)
+    def _rows(self, labels: list[str], timestamp: int) -> np.ndarray:
+        rows = np.array([self.rows_by_label.get(label, -1) for label in labels], dtype=np.int64)
+        # Carriages of this poll are stamped before any row is reused, so
+        # making room for a new carriage never evicts one seen in the same poll
+        self.last_seen[rows[rows >= 0]] = timestamp
+        for i in np.flatnonzero(rows < 0):
+            label = labels[i]
+            row = self.rows_by_label.get(label)
+            if row is None:
+                if len(self.rows_by_label) < len(self.last_seen):
+                    row = len(self.rows_by_label)
+                else:
+                    row = int(np.argmin(self.last_seen))
+                    if self.last_seen[row] >= timestamp:
+                        continue
+                    del self.rows_by_label[next(l for l, r in self.rows_by_label.items() if r == row)]
+                    for ring in (self.raw, self.minutes, self.hours):
+                        ring.clear_row(row)
+                self.rows_by_label[label] = row
+                self.last_seen[row] = timestamp
+            rows[i] = row
+        return rows
+
+    # Rolls the steps of source in [start, start + seconds) into one step of target
+    def _roll_up(self, source: _Ring, target: _Ring, start: int, seconds: int) -> None:
+        columns = source.columns_between(start, start + seconds)
+        if 'value' in source.values:
+            mins = maxs = values = source.values['value'][:, columns]
+            p95s = values
+        else:
+            mins = source.values['min'][:, columns]
+            maxs = source.values['max'][:, columns]
+            values = source.values['mean'][:, columns]
+            p95s = source.values['p95'][:, columns]
+        has_data = ~np.isnan(values).all(axis=1)
+        rollup = {stat: np.full(len(has_data), np.nan, dtype=np.float32) for stat in ROLLUP_STATS}
+        if len(columns) and has_data.any():
+            rollup['min'][has_data] = np.nanmin(mins[has_data], axis=1)
+            rollup['mean'][has_data] = np.nanmean(values[has_data], axis=1)
+            rollup['max'][has_data] = np.nanmax(maxs[has_data], axis=1)
+            rollup['p95'][has_data] = _nan_percentile(p95s[has_data], 95)
+        target.append(start, rollup)
+
+    # Records one poll: the occupancy percentage of each carriage label at
+    # timestamp (POSIX seconds). Carriages not in the poll get no sample.
+    # Polls no newer than the last one recorded (e.g. of an unchanged feed) are ignored.
+    def record(self, timestamp: int, labels: np.ndarray, percentages: np.ndarray) -> None:
+        timestamp = int(timestamp)
+        minute = timestamp - timestamp % 60
+        hour = timestamp - timestamp % 3600
+        with self._lock:
+            if timestamp <= self.raw.times.max():
+                return
+            if self.open_minute is not None and minute > self.open_minute:
+                self._roll_up(self.raw, self.minutes, self.open_minute, 60)
+                if hour > self.open_hour:
+                    self._roll_up(self.minutes, self.hours, self.open_hour, 3600)
+            self.open_minute, self.open_hour = minute, hour
+
+            rows = self._rows(labels.tolist(), timestamp)
+            recorded = rows >= 0
+            column = np.full(len(self.last_seen), np.nan, dtype=np.float32)
+            column[rows[recorded]] = np.asarray(percentages)[recorded]
+            self.raw.append(timestamp, {'value': column})
+            if self.path is not None and time.monotonic() - self.saved_at >= PERSIST_INTERVAL_SECONDS:
+                self._save()
+
+    # History of one carriage at a resolution ('raw', 'minute' or 'hour'),
+    # oldest first, indexed by time: a 'value' column for raw samples, or
+    # one column per rollup stat
+    def history(self, label: str, resolution: str = 'raw') -> pd.DataFrame:
+        ring = {'raw': self.raw, 'minute': self.minutes, 'hour': self.hours}[resolution]
+        with self._lock:
+            row = self.rows_by_label.get(label)
+            columns = ring.columns_between(0, np.iinfo(np.int64).max)
+            data = {stat: values[row, columns] if row is not None else np.empty(0, np.float32)
+                    for stat, values in ring.values.items()}
+            times = ring.times[columns] if row is not None else np.empty(0, np.int64)
+        history = pd.DataFrame(data, index=pd.to_datetime(times, unit='s', utc=True).rename('time'))
+        return history.loc[history.notna().any(axis=1)]
+
+    ####################################
+    # Persistence
+    ####################################
+
+    def _save(self) -> None:
+        arrays = {
+            'labels': np.array(list(self.rows_by_label), dtype=str),
+            'rows': np.array(list(self.rows_by_label.values()), dtype=np.int64),
+            'last_seen': self.last_seen,
+            'open': np.array([
+                -1 if self.open_minute is None else self.open_minute,
+                -1 if self.open_hour is None else self.open_hour,
+            ], dtype=np.int64),
+        }
+        for name, ring in (('raw', self.raw), ('minute', self.minutes), ('hour', self.hours)):
+            arrays[f"{name}.times"] = ring.times
+            arrays[f"{name}.position"] = np.array([ring.position])
+            for stat, values in ring.values.items():
+                arrays[f"{name}.{stat}"] = values
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = f"{self.path}.{os.getpid()}.tmp.npz"
+        np.savez(temp_path, **arrays)
+        os.replace(temp_path, self.path)
+        self.saved_at = time.monotonic()
+
+    # Saves the history to its path now (it is otherwise saved every
+    # PERSIST_INTERVAL_SECONDS while recording)
+    def save(self) -> None:
+        with self._lock:
+            self._save()
+
+    # Loads the history saved at path, or starts an empty one if there is none
+    # (or it was saved with different sizes)
+    @classmethod
+    def load(cls, path: str = HISTORY_PATH, max_carriages: int = MAX_CARRIAGES) -> 'OccupancyHistory':
+        history = cls(max_carriages, path)
+        try:
+            with np.load(path) as saved:
+                arrays = {name: saved[name] for name in saved.files}
+        except (OSError, ValueError):
+            return history
+        if len(arrays['last_seen']) != max_carriages or any(
+            len(arrays[f"{name}.times"]) != len(ring.times)
+            for name, ring in (('raw', history.raw), ('minute', history.minutes), ('hour', history.hours))
+        ):
+            return history
+        history.rows_by_label = dict(zip(arrays['labels'].tolist(), arrays['rows'].tolist()))
+        history.last_seen = arrays['last_seen']
+        open_minute, open_hour = arrays['open'].tolist()
+        history.open_minute = None if open_minute < 0 else open_minute
+        history.open_hour = None if open_hour < 0 else open_hour
+        for name, ring in (('raw', history.raw), ('minute', history.minutes), ('hour', history.hours)):
+            ring.times = arrays[f"{name}.times"]
+            ring.position = int(arrays[f"{name}.position"][0])
+            for stat in ring.values:
+                ring.values[stat] = arrays[f"{name}.{stat}"]
+        return history
@@ -0,0 +1,111 @@
+import time
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable
+import http_client
+
+# How long (in seconds) a reader waits for the first value of a feed before giving up
+FIRST_VALUE_TIMEOUT_SECONDS = 30
+
+
+# A feed refreshed by the poller: fn() is called every interval_seconds and
+# whatever it returns is published to the store under name
+@dataclass(frozen=True)
+class PollJob:
+    name: str
+    fn: Callable[[], Any]
+    interval_seconds: float
+
+
+# Latest decoded value of every polled feed, shared by all sessions of the
+# app. Values are replaced whole, never mutated, so readers need no locking.
+class SnapshotStore:
+
+    def __init__(self):
+        self._values = {}
+        self._published_at = {}
+        self._errors = {}
+        self._condition = threading.Condition()
+
+    def publish(self, name: str, value: Any) -> None:
+        with self._condition:
+            self._values[name] = value
+            self._published_at[name] = time.time()
+            self._errors.pop(name, None)
+            self._condition.notify_all()
+
+    def publish_error(self, name: str, error: Exception) -> None:
+        with self._condition:
+            self._errors[name] = error
+            self._condition.notify_all()
+
+    # Returns the latest value published under name. Blocks until the first
+    # value arrives; raises LookupError if none does within timeout seconds
+    # (re-raising the poll's error, if it failed).
+    def get(self, name: str, timeout: float | None = FIRST_VALUE_TIMEOUT_SECONDS) -> Any:
+        with self._condition:
+            self._condition.wait_for(
+                lambda: name in self._values or name in self._errors,
+                timeout=timeout
+            )
+            if name in self._values:
+                return self._values[name]
+            if name in self._errors:
+                raise LookupError(f"No value published for {name}") from self._errors[name]
+            raise LookupError(f"No value published for {name}")
+
+    # Wall-clock time the latest value of name was published, or None
+    def published_at(self, name: str) -> float | None:
+        return self._published_at.get(name)
+
+    # Error raised by the latest poll of name, if it failed
+    def error(self, name: str) -> Exception | None:
+        return self._errors.get(name)
+
+
+# Refreshes feeds on a schedule in the background and publishes the results
+# to a SnapshotStore. Page renders only read the store, so upstream traffic
+# stays constant however many sessions are open. Jobs run on the shared
+# http_client pool so their fetches overlap; a job is never run twice at once.
+class FeedPoller:
+
+    def __init__(self, jobs: list[PollJob], store: SnapshotStore | None = None):
+        self.jobs = jobs
+        self.store = store if store is not None else SnapshotStore()
+        self._running = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='feed-poller', daemon=True)
+
+    def start(self) -> 'FeedPoller':
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _poll(self, job: PollJob) -> None:
+        try:
+            self.store.publish(job.name, job.fn())
+        except Exception as e:
+            self.store.publish_error(job.name, e)
+        finally:
+            with self._lock:
+                self._running.discard(job.name)
+
+    def _run(self) -> None:
+        next_due = {job.name: 0.0 for job in self.jobs}
+        while not self._stop.is_set():
+            now = time.monotonic()
+            for job in self.jobs:
+                if next_due[job.name] > now:
+                    continue
+                next_due[job.name] = now + job.interval_seconds
+                with self._lock:
+                    # Still running from last time: skip this round
+                    if job.name in self._running:
+                        continue
+                    self._running.add(job.name)
+                http_client.submit(self._poll, job)
+            self._stop.wait(max(0.0, min(next_due.values()) - time.monotonic()))
@@ -0,0 +1,276 @@
+import datetime
+from zoneinfo import ZoneInfo
+import numpy as np
+import pandas as pd
+
+# Timezone GTFS times are local to (agency_timezone in agency.txt)
+DEFAULT_TIMEZONE = 'America/New_York'
+
+WEEKDAY_COLUMNS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+
+# calendar_dates.txt exception_type values
+SERVICE_ADDED = 1
+SERVICE_REMOVED = 2
+
+DEFAULT_NUM_DEPARTURES = 5
+
+# current_status of a train at a stop (GTFS-realtime VehicleStopStatus)
+STOPPED_AT = 'STOPPED_AT'
+
+ONE_DAY = datetime.timedelta(days=1)
+
+
+# Converts GTFS times (H:MM:SS or HH:MM:SS, past 24:00:00 for trips running
+# after midnight) to seconds since the start of the service day. Times are
+# zero-padded to HH:MM:SS and read digit by digit from their ASCII bytes,
+# which is several times faster than splitting strings.
+def parse_gtfs_times(times) -> np.ndarray:
+    times = np.asarray(times, dtype='U8')
+    if len(times) == 0:
+        return np.zeros(0, dtype=np.int32)
+    padded = np.char.zfill(times, 8).astype('S8')
+    digits = padded.view(np.uint8).reshape(-1, 8).astype(np.int32) - ord('0')
+    return (
+        (digits[:, 0] * 10 + digits[:, 1]) * 3600
+        + (digits[:, 3] * 10 + digits[:, 4]) * 60
+        + digits[:, 6] * 10 + digits[:, 7]
+    )
+
+
+# Trip IDs in the NYCT realtime feeds drop the service prefix of the static
+# trip ID: static 'ASP25GEN-7024-Saturday-00_001150_7..S35R' is realtime
+# '001150_7..S35R' (origin time in hundredths of a minute, then the path)
+def realtime_trip_ids(trip_ids) -> np.ndarray:
+    return pd.Series(np.asarray(trip_ids, dtype=object)).str.split('_', n=1).str[-1].to_numpy(dtype=object)
+
+
+def _date_int(date: datetime.date) -> int:
+    return date.year * 10000 + date.month * 100 + date.day
+
+
+# Compact, array-based index of the static timetable. Every stop time is
+# stored once per view as int32 codes and seconds:
+#   - by stop, sorted by arrival: for binary-search lookups of the next
+#     departures from a stop (a CSR layout; stop_bounds delimits each stop)
+#   - by (trip, stop) key, sorted: for looking up the scheduled arrival of
+#     many live trains at once
+# Which trips run on a date (calendar.txt, with the exceptions of
+# calendar_dates.txt applied) is resolved once per date and memoized.
+class ScheduleIndex:
+
+    def __init__(self,
+                 stop_times: pd.DataFrame,
+                 trips: pd.DataFrame,
+                 calendar: pd.DataFrame,
+                 calendar_dates: pd.DataFrame,
+                 timezone: str = DEFAULT_TIMEZONE):
+        self.timezone = ZoneInfo(timezone)
+
+        self.service_ids = pd.Index(pd.unique(np.concatenate([
+            calendar['service_id'].to_numpy(dtype=object),
+            calendar_dates['service_id'].to_numpy(dtype=object),
+        ])))
+        self._weekdays = calendar[list(WEEKDAY_COLUMNS)].to_numpy(dtype=np.int8).astype(bool)
+        self._calendar_services = self.service_ids.get_indexer(calendar['service_id'].to_numpy(dtype=object))
+        self._start_dates = calendar['start_date'].to_numpy(dtype=np.int64)
+        self._end_dates = calendar['end_date'].to_numpy(dtype=np.int64)
+        self._exception_dates = calendar_dates['date'].to_numpy(dtype=np.int64)
+        self._exception_services = self.service_ids.get_indexer(calendar_dates['service_id'].to_numpy(dtype=object))
+        self._exception_types = calendar_dates['exception_type'].to_numpy(dtype=np.int8)
+        self._active_by_date = {}
+        self._active_trips_by_date = {}
+        self._day_start_by_date = {}
+        self._trips_by_key_by_date = {}
+
+        trip_codes, trip_ids = pd.factorize(stop_times['trip_id'].to_numpy(dtype=object))
+        stop_codes, stop_ids = pd.factorize(stop_times['stop_id'].to_numpy(dtype=object))
+        self.trip_ids = pd.Index(trip_ids)
+        self.stop_ids = pd.Index(stop_ids)
+        self._stop_codes = {stop_id: code for code, stop_id in enumerate(stop_ids.tolist())}
+        trip_services = pd.Series(
+            trips['service_id'].to_numpy(dtype=object),
+            index=trips['trip_id'].to_numpy(dtype=object)
+        )
+        self.trip_services = self.service_ids.get_indexer(trip_services.reindex(trip_ids).to_numpy()).astype(np.int32)
+        self.trip_keys = realtime_trip_ids(trip_ids)
+        arrivals = parse_gtfs_times(stop_times['arrival_time'].to_numpy(dtype=object)).astype(np.int32)
+        trip_codes = trip_codes.astype(np.int32)
+        stop_codes = stop_codes.astype(np.int32)
+
+        by_stop = np.lexsort((arrivals, stop_codes))
+        self.stop_bounds = np.searchsorted(stop_codes[by_stop], np.arange(len(stop_ids) + 1)).astype(np.int64)
+        self.stop_arrivals = arrivals[by_stop]
+        self.stop_trips = trip_codes[by_stop]
+
+        trip_stop_keys = trip_codes.astype(np.int64) * len(stop_ids) + stop_codes
+        by_trip_stop = np.argsort(trip_stop_keys, kind='stable')
+        self.trip_stop_keys = trip_stop_keys[by_trip_stop]
+        self.trip_stop_arrivals = arrivals[by_trip_stop]
+
+    # Bytes held by the index arrays
+    @property
+    def nbytes(self) -> int:
+        return sum(array.nbytes for array in (
+            self.trip_services, self.stop_bounds, self.stop_arrivals, self.stop_trips,
+            self.trip_stop_keys, self.trip_stop_arrivals,
+        ))
+
+    # Returns whether each service (in service_ids order) runs on date
+    def active_services(self, date: datetime.date) -> np.ndarray:
+        active = self._active_by_date.get(date)
+        if active is None:
+            day = _date_int(date)
+            active = np.zeros(len(self.service_ids), dtype=bool)
+            in_effect = (
+                self._weekdays[:, date.weekday()]
+                & (self._start_dates <= day) & (day <= self._end_dates)
+            )
+            active[self._calendar_services[in_effect]] = True
+            on_date = self._exception_dates == day
+            active[self._exception_services[on_date & (self._exception_types == SERVICE_ADDED)]] = True
+            active[self._exception_services[on_date & (self._exception_types == SERVICE_REMOVED)]] = False
+            self._active_by_date[date] = active
+        return active
+
+    # Returns whether each trip (in trip_ids order) runs on date
+    def active_trips(self, date: datetime.date) -> np.ndarray:
+        active = self._active_trips_by_date.get(date)
+        if active is None:
+            services = self.active_services(date)
+            active = self._active_trips_by_date[date] = (
+                (self.trip_services >= 0) & services[np.maximum(self.trip_services, 0)]
+            )
+        return active
+
+    # GTFS times count from noon minus 12 hours, which is midnight except on
+    # days when the clocks change
+    def service_day_start(self, date: datetime.date) -> float:
+        day_start = self._day_start_by_date.get(date)
+        if day_start is None:
+            noon = datetime.datetime.combine(date, datetime.time(12), tzinfo=self.timezone)
+            day_start = self._day_start_by_date[date] = noon.timestamp() - 12 * 3600
+        return day_start
+
+    def _service_dates(self, timestamps: np.ndarray) -> list[datetime.date]:
+        local_dates = {
+            datetime.datetime.fromtimestamp(timestamp, self.timezone).date()
+            for timestamp in np.unique(np.asarray(timestamps, dtype=np.int64) // 3600 * 3600).tolist()
+        }
+        # Trips after midnight belong to the previous day's service
+        return sorted(local_dates | {date - ONE_DAY for date in local_dates})
+
+    # Returns the trip codes and times (POSIX seconds) of the next departures
+    # from stop_id at or after when, across the service days in progress,
+    # soonest first
+    def next_departure_times(self, stop_id: str, when: float,
+                             limit: int = DEFAULT_NUM_DEPARTURES) -> tuple[np.ndarray, np.ndarray]:
+        stop = self._stop_codes.get(stop_id)
+        if stop is None:
+            raise LookupError(f"No stop times for stop {stop_id}")
+        start, end = self.stop_bounds[stop], self.stop_bounds[stop + 1]
+        stop_arrivals = self.stop_arrivals[start:end]
+        stop_trips = self.stop_trips[start:end]
+
+        departure_trips, departure_times = [], []
+        today = datetime.datetime.fromtimestamp(when, self.timezone).date()
+        # Trips after midnight belong to the previous day's service
+        for date in (today - ONE_DAY, today):
+            day_start = self.service_day_start(date)
+            first = np.searchsorted(stop_arrivals, when - day_start, side='left')
+            upcoming_trips = stop_trips[first:]
+            active = self.active_trips(date)[upcoming_trips]
+            taken = np.flatnonzero(active)[:limit]
+            departure_trips.append(upcoming_trips[taken])
+            departure_times.append(stop_arrivals[first:][taken] + day_start)
+
+        trips = np.concatenate(departure_trips)
+        times = np.concatenate(departure_times)
+        soonest = np.argsort(times, kind='stable')[:limit]
+        return trips[soonest], times[soonest]
+
+    # next_departure_times as a frame of trip_id and local departure time
+    def next_departures(self, stop_id: str, when: float, limit: int = DEFAULT_NUM_DEPARTURES) -> pd.DataFrame:
+        trips, times = self.next_departure_times(stop_id, when, limit)
+        return pd.DataFrame({
+            'trip_id': self.trip_ids[trips],
+            'time': pd.to_datetime(times, unit='s', utc=True).tz_convert(self.timezone),
+        })
+
+    # Index of the trips running on date, by realtime trip ID
+    def _trips_by_key(self, date: datetime.date) -> tuple[pd.Index, np.ndarray]:
+        trips_by_key = self._trips_by_key_by_date.get(date)
+        if trips_by_key is None:
+            trips = np.flatnonzero(self.active_trips(date))
+            keys = pd.Index(self.trip_keys[trips])
+            unique = ~keys.duplicated()
+            trips_by_key = self._trips_by_key_by_date[date] = (keys[unique], trips[unique])
+        return trips_by_key
+
+    # Returns the scheduled arrival (POSIX seconds, NaN when unknown) of each
+    # live train at the given stop, matching realtime trip IDs against the
+    # trips running on each service day in progress. Where a trip ID runs on
+    # two of those days, the scheduled arrival closest to timestamp is used.
+    def scheduled_arrivals(self, trip_ids, stop_ids, timestamps) -> np.ndarray:
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        stops = self.stop_ids.get_indexer(np.asarray(stop_ids, dtype=object))
+        scheduled = np.full(len(timestamps), np.nan)
+        if len(timestamps) == 0:
+            return scheduled
+        for date in self._service_dates(timestamps):
+            keys, key_trips = self._trips_by_key(date)
+            if len(keys) == 0:
+                continue
+            trip_rows = keys.get_indexer(np.asarray(trip_ids, dtype=object))
+            trips = np.where(trip_rows >= 0, key_trips[trip_rows], -1)
+            trip_stop_keys = trips.astype(np.int64) * len(self.stop_ids) + stops
+            found = np.minimum(np.searchsorted(self.trip_stop_keys, trip_stop_keys), len(self.trip_stop_keys) - 1)
+            matched = (trips >= 0) & (stops >= 0) & (self.trip_stop_keys[found] == trip_stop_keys)
+            candidate = np.where(matched, self.trip_stop_arrivals[found] + self.service_day_start(date), np.nan)
+            closer = np.isnan(scheduled) | (np.abs(candidate - timestamps) < np.abs(scheduled - timestamps))
+            scheduled = np.where(matched & closer, candidate, scheduled)
+        return scheduled
+
+    # Returns each live train's delay in seconds (positive when late, NaN when
+    # it can't be matched to the timetable): the time of its latest position
+    # minus its scheduled arrival at the stop it's stopped at. Trains between
+    # stops get NaN, since a train heading to a stop is due there later than
+    # its position's time, which would make it look early.
+    def delays(self, positions: pd.DataFrame) -> np.ndarray:
+        timestamps = positions['timestamp'].to_numpy(dtype=np.int64)
+        stopped = positions['current_status'].to_numpy(dtype=object) == STOPPED_AT
+        delays = np.full(len(timestamps), np.nan)
+        delays[stopped] = timestamps[stopped] - self.scheduled_arrivals(
+            positions['trip_id'].to_numpy(dtype=object)[stopped],
+            positions['stop_id'].to_numpy(dtype=object)[stopped],
+            timestamps[stopped]
+        )
+        return delays
+
+
+# `python src/schedule.py` builds the index for the local GTFS and times lookups
+if __name__ == '__main__':
+    import time
+    import gtfs_cache
+
+    start = time.perf_counter()
+    schedule = ScheduleIndex(
+        gtfs_cache.load_table('stop_times', ['trip_id', 'stop_id', 'arrival_time']),
+        gtfs_cache.load_table('trips', ['trip_id', 'service_id']),
+        gtfs_cache.load_table('calendar'),
+        gtfs_cache.load_table('calendar_dates'),
+    )
+    print(f"built in {time.perf_counter() - start:.3f} s: {len(schedule.stop_arrivals)} stop times, "
+          f"{schedule.nbytes / 2**20:.1f} MiB")
+    # A time the calendar covers
+    now = datetime.datetime.combine(
+        datetime.datetime.strptime(str(schedule._start_dates.max()), '%Y%m%d').date(),
+        datetime.time(8),
+        tzinfo=schedule.timezone
+    ).timestamp()
+    stop_id = schedule.stop_ids[np.argmax(np.diff(schedule.stop_bounds))]
+    schedule.next_departure_times(stop_id, now)
+    num_lookups = 1000
+    start = time.perf_counter()
+    for _ in range(num_lookups):
+        schedule.next_departure_times(stop_id, now)
+    print(f"next_departure_times: {(time.perf_counter() - start) / num_lookups * 1e6:.1f} us per lookup")
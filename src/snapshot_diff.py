@@ -0,0 +1,93 @@
+from dataclasses import dataclass, field
+import numpy as np
+import pandas as pd
+import train_positions
+
+# Trains are matched across snapshots by trip_id; a matched train has moved
+# if its stop_id changed, and changed status if its current_status or
+# direction changed at the same stop
+TRAIN_KEY_COLUMN = 'trip_id'
+STATUS_COLUMNS = ('current_status', 'direction')
+
+
+# What changed between two snapshots, as trip IDs
+@dataclass(frozen=True)
+class SnapshotDiff:
+    appeared: np.ndarray
+    disappeared: np.ndarray
+    moved: np.ndarray
+    status_changed: np.ndarray
+    # Routes with at least one train in any of the above
+    changed_routes: frozenset[str] = field(default_factory=frozenset)
+
+    # Number of trains that changed
+    def __len__(self) -> int:
+        return len(self.appeared) + len(self.disappeared) + len(self.moved) + len(self.status_changed)
+
+
+# Compares the trains of two snapshots (one row per trip, e.g. from
+# train_positions.latest_positions). All comparisons are vectorized over
+# rows matched through one hash lookup of trip IDs, so a diff costs a few
+# array passes however many trains there are.
+def diff_positions(previous: pd.DataFrame, current: pd.DataFrame) -> SnapshotDiff:
+    previous_trips = previous[TRAIN_KEY_COLUMN].to_numpy(dtype=object)
+    current_trips = current[TRAIN_KEY_COLUMN].to_numpy(dtype=object)
+    previous_rows = pd.Index(previous_trips).get_indexer(current_trips)
+    matched = previous_rows >= 0
+    current_matched = np.flatnonzero(matched)
+    previous_matched = previous_rows[matched]
+    still_there = np.zeros(len(previous_trips), dtype=bool)
+    still_there[previous_matched] = True
+
+    def changed(column: str) -> np.ndarray:
+        before = previous[column].to_numpy(dtype=object)[previous_matched]
+        after = current[column].to_numpy(dtype=object)[current_matched]
+        return ~((before == after) | (pd.isna(before) & pd.isna(after)))
+
+    moved = changed('stop_id')
+    status_changed = ~moved & np.logical_or.reduce([changed(column) for column in STATUS_COLUMNS])
+
+    appeared = ~matched
+    disappeared = ~still_there
+    current_routes = current['route_id'].to_numpy(dtype=object)
+    changed_routes = frozenset(map(str, np.concatenate([
+        current_routes[appeared],
+        current_routes[current_matched[moved | status_changed]],
+        previous['route_id'].to_numpy(dtype=object)[disappeared],
+    ]).tolist()))
+    return SnapshotDiff(
+        appeared=current_trips[appeared],
+        disappeared=previous_trips[disappeared],
+        moved=current_trips[current_matched[moved]],
+        status_changed=current_trips[current_matched[status_changed]],
+        changed_routes=changed_routes,
+    )
+
+
+# Diffs every snapshot against the one before it and keeps a version number
+# per route, bumped whenever any of the route's trains changes. Renderers key
+# their caches on a route's version, so they redo work only for routes whose
+# trains changed. Not thread-safe: updated by the single poll job of a feed.
+class SnapshotTracker:
+
+    def __init__(self):
+        self._previous = None
+        self._route_versions = {}
+
+    # Diffs positions (raw vehicle positions, several per trip allowed)
+    # against the previous update, and returns the diff. Trains whose
+    # positions have gone stale (against their own route's newest update, as
+    # the lines are drawn) count as disappeared.
+    def update(self, positions: pd.DataFrame) -> SnapshotDiff:
+        current = train_positions.latest_positions_by_route(positions)
+        previous = self._previous if self._previous is not None else current.iloc[:0]
+        diff = diff_positions(previous, current)
+        for route_id in diff.changed_routes:
+            self._route_versions[route_id] = self._route_versions.get(route_id, 0) + 1
+        self._previous = current
+        return diff
+
+    # A copy of the version of every route that has had trains
+    @property
+    def route_versions(self) -> dict[str, int]:
+        return dict(self._route_versions)
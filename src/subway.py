@@ -1,22 +1,45 @@
-import requests
 import gtfs_realtime_NYCT_pb2 as nyct
 from gtfs_realtime_NYCT_pb2 import gtfs__realtime__pb2 as gtfs
-from datetime import datetime, timedelta
 import streamlit as st
 from pydeck.bindings import Deck, Layer, ViewState
 from pydeck.types import String
+import time
+from dataclasses import replace
 import pandas as pd
+import gtfs_cache
+import geometry
+import nyct_ingest
+import train_positions
+import schedule
+import journey
+import feed_log
+import metrics
+from snapshot_diff import SnapshotTracker
+from poller import FeedPoller, PollJob
 
-SEVEN_TRAIN_PURPLE = {
-    'hex': '#9A38A1',
-    'rgba': (154, 56, 161, 255)
-}
+# With TRANSIT_METRICS set, each app process serves its metrics in the
+# Prometheus text format on TRANSIT_METRICS_PORT (see metrics)
+@st.cache_resource
+def start_metrics_server() -> None:
+    if metrics.ENABLED:
+        metrics.serve()
 
-SUBWAY_REALTIME_API_ENDPOINT = r'https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/nyct%2Fgtfs'
+start_metrics_server()
+render_start = time.perf_counter()
 
-resp = requests.get(
-    url=SUBWAY_REALTIME_API_ENDPOINT
-).content
+# Line shown when the page is first opened
+DEFAULT_ROUTE_ID = '7'
+
+# How often (in seconds) the background poller refreshes the NYCT feeds
+NYCT_POLL_INTERVAL_SECONDS = 15
+
+# Zoom the line map opens at
+MAP_ZOOM = 12
+
+# Zoom whose level of detail the selected line's track is drawn at. The map
+# is sent once, so the track is drawn finer than MAP_ZOOM needs to stay
+# smooth when zooming in; the other lines are drawn at MAP_ZOOM's detail.
+TRACK_DETAIL_ZOOM = 15
 
 # vehicle_position = gtfs.VehiclePosition()
 # vehicle_position.ParseFromString(resp)
@@ -44,198 +67,194 @@ resp = requests.get(
 
 
 
-feed_message = gtfs.FeedMessage()
-feed_message.ParseFromString(resp)
-
-# Feed Entities pertain to vehicles when their vehicle attribute 
-# is not empty (is not equal to an empty Vehicle Position)
-def vehicle_info_json(vehicle: gtfs.VehiclePosition) -> object:
-    return {
-        "time": datetime.fromtimestamp(vehicle.timestamp),
-        "trip": trip_info_json(vehicle.trip),
-        "current_status": gtfs.VehiclePosition.VehicleStopStatus.Name(vehicle.current_status),
-        "stop_id": vehicle.stop_id
-    }
-
-def trip_info_json(trip: gtfs.TripDescriptor) -> object:
-    nyct_trip = trip.Extensions[nyct.nyct_trip_descriptor]
-    type_and_line, decoded_origin_type, origin_and_destination = nyct_trip.train_id.split()
-    return {
-        "trip_id": trip.trip_id,
-        "line": type_and_line[1],
-        "origin": origin_and_destination.split('/')[0],
-        "destination": origin_and_destination.split('/')[1],
-        "direction": nyct.NyctTripDescriptor.Direction.Name(nyct_trip.direction)
-    }
-
-##########################
-# Plot lines between stops
-##########################
-shapes = pd.read_csv('./src/gtfs_subway/shapes.txt', index_col='shape_id')
-shape_7_local = shapes.loc['7..N95R'].sort_values(by='shape_pt_sequence').loc[
-    :, 
-    ['shape_pt_lat', 'shape_pt_lon', 'shape_pt_sequence']
-]
-shape_7_local['next_shape_pt_lat'] = shape_7_local['shape_pt_lat'].shift(-1)
-shape_7_local['next_shape_pt_lon'] = shape_7_local['shape_pt_lon'].shift(-1)
-
-############
-# Plot stops
-############
-trips = pd.read_csv('./src/gtfs_subway/trips.txt')
-all_7_trip_ids = trips.loc[trips['route_id'] == '7', 'trip_id'].unique()
-
-stop_times = pd.read_csv('./src/gtfs_subway/stop_times.txt')
-all_7_stop_ids = stop_times.loc[stop_times['trip_id'].isin(all_7_trip_ids), 'stop_id'].unique()
-
-stops = pd.read_csv('./src/gtfs_subway/stops.txt')
-all_7_stops = stops.loc[stops['stop_id'].isin(all_7_stop_ids)]
+# GTFS tables are loaded from the compiled cache once per server process
+# (not once per rerun/session); editing a source .txt invalidates both caches.
+@st.cache_resource
+def load_gtfs_table(table: str, version: int, columns: tuple[str] | None = None) -> pd.DataFrame:
+    return gtfs_cache.load_table(table, columns=list(columns) if columns else None)
 
-####################################
-# Plot number of trains at each stop
-####################################
+def get_gtfs_table(table: str, columns: tuple[str] | None = None) -> pd.DataFrame:
+    return load_gtfs_table(table, gtfs_cache.source_version(table), columns)
 
-all_7_train_position_entities = []
-for entity in feed_message.entity:
-    # Ignore non-vehicle entities
-    if entity.vehicle == gtfs.VehiclePosition():
-        continue
-    vehicle = vehicle_info_json(entity.vehicle)
-    # Focus on 7 train
-    if vehicle['trip']['line'] != '7':
-        continue
-    all_7_train_position_entities.append(vehicle)
-
-
-all_7_train_position_entities: pd.DataFrame = pd.DataFrame.from_dict(data=all_7_train_position_entities)
-# Get trip id
-all_7_train_position_entities['trip_id'] = all_7_train_position_entities['trip'].apply(lambda trip: trip['trip_id'])
-all_7_train_position_entities = all_7_train_position_entities.sort_values(by='time', ascending=False).drop_duplicates('trip_id', keep='first')
-# Get direction
-all_7_train_position_entities['direction'] = all_7_train_position_entities['trip'].apply(lambda trip: trip['direction'])
-# Filter out old vehicle position updates
-time_of_latest_update: datetime = all_7_train_position_entities['time'].iloc[0]
-all_7_train_position_entities = all_7_train_position_entities.loc[
-    time_of_latest_update - all_7_train_position_entities['time'] < timedelta(minutes=1)
-]
-
-all_7_train_positions = all_7_train_position_entities.merge(
-    all_7_stops, 
-    on='stop_id'
-)[['trip_id', 'current_status', 'direction', 'parent_station', 'stop_name', 'stop_lat', 'stop_lon']].sort_values(
-    by='parent_station'
-).groupby(
-    by=['parent_station', 'current_status', 'direction']
-).agg(
-    num_trains=('trip_id', 'count'),
-)
+# Shapes, stations and station positions along the shapes of every route,
+# built once per server process and looked up by route_id
+@st.cache_resource
+def load_route_geometries(versions: tuple[int, ...]) -> dict[str, geometry.RouteGeometry]:
+    return geometry.build_route_geometries(
+        geometry.sorted_shape_points(get_gtfs_table('shapes')),
+        get_gtfs_table('trips', ('route_id', 'trip_id', 'shape_id', 'direction_id')),
+        get_gtfs_table('stop_times', ('trip_id', 'stop_id')),
+        get_gtfs_table('stops'),
+        get_gtfs_table('routes'),
+    )
 
-def get_coordinates(parent_station: str, 
-                    current_status: gtfs.VehiclePosition.VehicleStopStatus, 
-                    direction: nyct.NyctTripDescriptor.Direction) -> tuple[float, float]:
-    if current_status == gtfs.VehiclePosition.VehicleStopStatus.STOPPED_AT:
-        lat, lon = stops.loc[
-            stops['parent_station'] == parent_station, 
-            ['stop_lat', 'stop_lon']
-        ].astype('float').drop_duplicates().values[0]
-    
-    else:
-        buffer = 1 if current_status == gtfs.VehiclePosition.VehicleStopStatus.INCOMING_AT else 5
-        if direction == nyct.NyctTripDescriptor.Direction.NORTH or parent_station == '701':
-            buffer *= -1
-        next_stop_lat, next_stop_lon = stops.loc[
-            stops['parent_station'] == parent_station, 
-            ['stop_lat', 'stop_lon']
-        ].astype('float').drop_duplicates().values[0]
-        next_stop_shape_sequence_number: int = shape_7_local.loc[
-            (shape_7_local['shape_pt_lat'] == next_stop_lat)
-                & (shape_7_local['shape_pt_lon'] == next_stop_lon),
-            'shape_pt_sequence'
-        ].values[0]
-        display_pt_sequence_number: int = next_stop_shape_sequence_number + buffer
-        try:
-            lat, lon = shape_7_local.loc[
-                shape_7_local['shape_pt_sequence'] == display_pt_sequence_number,
-                ['shape_pt_lat', 'shape_pt_lon']
-            ].drop_duplicates().values[0]
-        except IndexError as e:
-            print(
-                str(current_status), 
-                str(parent_station), 
-                str(direction), 
-                next_stop_shape_sequence_number, 
-                display_pt_sequence_number
-            )
-            raise e
-    return lat, lon
-
-# Dataframe for plotting active trains on map 
-all_7_train_positions_display = all_7_train_positions.reset_index()
-# Use customized coordinates to represent in-progress and incoming trains
-all_7_train_positions_display['lat'], all_7_train_positions_display['lon'] = tuple(zip(*all_7_train_positions_display.apply(
-    lambda row: get_coordinates(
-        row['parent_station'],
-        getattr(gtfs.VehiclePosition.VehicleStopStatus, row['current_status']),
-        getattr(nyct.NyctTripDescriptor.Direction, row['direction'])
-    ),
-    axis=1
-)))
-
-# Get English station names
-all_7_train_positions_display = all_7_train_positions_display.merge(
-    stops[['parent_station', 'stop_name']].drop_duplicates(), how='left', on='parent_station'
-)
-# Format columns to contain the text that will be displayed rather than raw data
-all_7_train_positions_display['num_trains'] = all_7_train_positions_display['num_trains'].apply(
-    lambda num: f"{num} train" + ("s" if num > 1 else "")
-)
-all_7_train_positions_display['current_status'] = all_7_train_positions_display['current_status'].apply(
-    lambda status: status.lower().replace('_', ' ')
-)
+def get_route_geometries() -> dict[str, geometry.RouteGeometry]:
+    return load_route_geometries(tuple(
+        gtfs_cache.source_version(table) for table in ('shapes', 'trips', 'stop_times', 'stops', 'routes')
+    ))
 
-st.title('7 Train')
-st.text('Desktop: hold shift and move mouse to rotate view')
-st.pydeck_chart(
-    Deck(
+# Timetable of every trip, indexed for next-departure lookups and delay
+# computation, built once per server process
+@st.cache_resource
+def load_schedule_index(versions: tuple[int, ...]) -> schedule.ScheduleIndex:
+    return schedule.ScheduleIndex(
+        get_gtfs_table('stop_times', ('trip_id', 'stop_id', 'arrival_time')),
+        get_gtfs_table('trips', ('trip_id', 'service_id')),
+        get_gtfs_table('calendar'),
+        get_gtfs_table('calendar_dates'),
+    )
+
+def get_schedule_index() -> schedule.ScheduleIndex:
+    return load_schedule_index(tuple(
+        gtfs_cache.source_version(table) for table in ('stop_times', 'trips', 'calendar', 'calendar_dates')
+    ))
+
+# Journey planner over the whole network, built once per server process
+@st.cache_resource
+def load_journey_planner(versions: tuple[int, ...]) -> journey.JourneyPlanner:
+    return journey.JourneyPlanner(
+        get_schedule_index(),
+        get_gtfs_table('stop_times', ('trip_id', 'stop_id', 'stop_sequence', 'arrival_time', 'departure_time')),
+        get_gtfs_table('stops', ('stop_id', 'parent_station')),
+        get_gtfs_table('transfers'),
+    )
+
+def get_journey_planner() -> journey.JourneyPlanner:
+    return load_journey_planner(tuple(
+        gtfs_cache.source_version(table)
+        for table in ('stop_times', 'trips', 'calendar', 'calendar_dates', 'stops', 'transfers')
+    ))
+
+# The journey planner with the delays of the latest NYCT snapshot, rebuilt
+# once per snapshot and shared by all sessions. Trains ahead of schedule are
+# planned on time, since they hold at timepoints rather than leave early.
+@st.cache_resource(max_entries=1)
+def get_delayed_journey_planner(snapshot_published_at: float | None) -> journey.JourneyPlanner:
+    positions = train_positions.latest_positions(get_feed_poller().store.get('nyct').positions)
+    delays = get_schedule_index().delays(positions).clip(min=0)
+    return get_journey_planner().with_delays(dict(zip(positions['trip_id'], delays)))
+
+# A single background poller per server process keeps the system-wide NYCT
+# snapshot fresh; reruns and sessions only read its latest snapshot.
+# With TRANSIT_REPLAY_DIR set, snapshots come from a recorded log instead
+# (see feed_log); with TRANSIT_RECORD_DIR set, every polled snapshot is recorded.
+# Every snapshot is diffed against the one before it, so the map only
+# rebuilds the trains of routes that changed.
+@st.cache_resource
+def get_feed_poller() -> FeedPoller:
+    tracker = SnapshotTracker()
+    def track(snapshot: nyct_ingest.SystemSnapshot) -> nyct_ingest.SystemSnapshot:
+        diff = tracker.update(snapshot.positions)
+        return replace(snapshot, diff=diff, route_versions=tracker.route_versions)
+
+    if feed_log.REPLAY_DIR:
+        replay = feed_log.FeedReplay(feed_log.REPLAY_DIR, 'nyct', feed_log.REPLAY_SPEED)
+        return FeedPoller([
+            PollJob(
+                'nyct',
+                lambda: track(nyct_ingest.snapshot_from_columns(replay.current()[1])),
+                NYCT_POLL_INTERVAL_SECONDS / feed_log.REPLAY_SPEED
+            ),
+        ]).start()
+
+    ingestor = nyct_ingest.NyctIngestor()
+    recorder = feed_log.FeedLogWriter(feed_log.RECORD_DIR, 'nyct') if feed_log.RECORD_DIR else None
+    def poll_nyct() -> nyct_ingest.SystemSnapshot:
+        snapshot = ingestor.refresh()
+        if recorder is not None:
+            recorder.append(nyct_ingest.snapshot_columns(snapshot))
+        return track(snapshot)
+    return FeedPoller([
+        PollJob('nyct', poll_nyct, NYCT_POLL_INTERVAL_SECONDS),
+    ]).start()
+
+# Latest position of each of a line's trains (including its express variant)
+def line_positions(snapshot: nyct_ingest.SystemSnapshot, route_id: str) -> pd.DataFrame:
+    return train_positions.latest_positions(snapshot.line(route_id))
+
+# Layers of a line that never change while the server runs (its track and
+# stations), built once per process. Decks reuse these very Layer objects.
+@st.cache_resource
+def get_static_layers(route_id: str) -> list[Layer]:
+    route = get_route_geometries()[route_id]
+    return [
+        # One pre-simplified path per shape, rather than a row per pair of points
+        Layer(
+            "PathLayer",
+            data=route.paths(TRACK_DETAIL_ZOOM),
+            get_path='path',
+            get_color=route.color,
+            get_width=3,
+            width_units='pixels',
+            joint_rounded=True,
+        ),
+        Layer(
+            "ScatterplotLayer",
+            data=route.stations.reset_index(),
+            get_position="[stop_lon, stop_lat]",
+            filled=False,
+            stroked=True,
+            get_line_color=route.color,
+            pickable=False,
+            radius_min_pixels=10,
+            radius_max_pixels=10,
+            line_width_min_pixels=3,
+            line_width_max_pixels=3,
+        ),
+    ]
+
+# The track of every line, drawn under the selected one, at the detail MAP_ZOOM needs
+@st.cache_resource
+def get_all_lines_layer() -> Layer:
+    paths = []
+    for route in get_route_geometries().values():
+        route_paths = route.paths(MAP_ZOOM)
+        route_paths['color'] = [route.color] * len(route_paths)
+        paths.append(route_paths)
+    return Layer(
+        "PathLayer",
+        data=pd.concat(paths, ignore_index=True),
+        get_path='path',
+        get_color='color',
+        get_width=2,
+        width_units='pixels',
+        opacity=0.5,
+    )
+
+# The map of a line, keyed on the versions of its routes (the line and its
+# express variant). Trains are counted and placed again only when one of them
+# changed; otherwise every rerun and session gets the same Deck, which
+# serializes to the same message, so the browser is not sent the map again.
+@st.cache_resource(max_entries=64)
+def get_route_deck(route_id: str, route_versions: tuple[int, int],
+                   _snapshot: nyct_ingest.SystemSnapshot, show_all_lines: bool = False) -> Deck:
+    route = get_route_geometries()[route_id]
+    train_counts = train_positions.count_trains_by_station(
+        line_positions(_snapshot, route_id), get_gtfs_table('stops', ('stop_id', 'parent_station')), route
+    )
+    # Dataframe for plotting active trains on map
+    train_positions_display = train_positions.display_positions(train_counts, route)
+
+    center_lat, center_lon = route.center()
+    return Deck(
         map_provider='google_maps',
         map_style=None,
         initial_view_state=ViewState(
-            latitude=40.747786461448925,
-            longitude=-73.9020397548519,
-            zoom=12,
+            latitude=center_lat,
+            longitude=center_lon,
+            zoom=MAP_ZOOM,
             pitch=0,
         ),
         layers=[
-            Layer(
-                "ArcLayer",
-                data=shape_7_local.dropna(),
-                getHeight=0,
-                getSourcePosition=['shape_pt_lon', 'shape_pt_lat'],
-                getTargetPosition=['next_shape_pt_lon', 'next_shape_pt_lat'],
-                getSourceColor=SEVEN_TRAIN_PURPLE['rgba'],
-                getTargetColor=SEVEN_TRAIN_PURPLE['rgba'],
-                getWidth=3,
-            ),
+            *([get_all_lines_layer()] if show_all_lines else []),
+            *get_static_layers(route_id),
             Layer(
                 "ScatterplotLayer",
-                data=all_7_stops,
-                get_position="[stop_lon, stop_lat]",
-                filled=False,
-                stroked=True,
-                get_line_color=SEVEN_TRAIN_PURPLE['rgba'],
-                pickable=False,
-                radius_min_pixels=10,
-                radius_max_pixels=10,
-                line_width_min_pixels=3,
-                line_width_max_pixels=3,
-            ),
-            Layer(
-                "ScatterplotLayer",
-                data=all_7_train_positions_display,
+                data=train_positions_display,
                 get_position="[lon, lat]",
                 filled=True,
                 stroked=True,
-                get_color=SEVEN_TRAIN_PURPLE['rgba'],
+                get_color=route.color,
                 pickable=True,
                 radius_min_pixels=10,
                 radius_max_pixels=10,
@@ -254,6 +273,110 @@ st.pydeck_chart(
             }
         }
     )
+
+route_geometries = get_route_geometries()
+# Routes without scheduled stops (e.g. in routes.txt but not running) have nothing to draw
+route_ids = [route_id for route_id in route_geometries if len(route_geometries[route_id].stations)]
+ROUTE_ID = st.selectbox(
+    label='Line',
+    options=route_ids,
+    index=route_ids.index(DEFAULT_ROUTE_ID),
+    format_func=lambda route_id: f"{route_geometries[route_id].route_short_name} - {route_geometries[route_id].route_long_name}"
+)
+route = route_geometries[ROUTE_ID]
+stops = get_gtfs_table('stops', ('stop_id', 'parent_station'))
+
+####################################
+# Plot number of trains at each stop
+####################################
+
+nyct_snapshot: nyct_ingest.SystemSnapshot = get_feed_poller().store.get('nyct')
+train_position_entities = line_positions(nyct_snapshot, ROUTE_ID)
+st.title(f"{route.route_short_name} Train")
+st.text('Desktop: hold shift and move mouse to rotate view')
+show_all_lines = st.checkbox('Show all lines')
+st.pydeck_chart(get_route_deck(ROUTE_ID, (
+    nyct_snapshot.route_versions.get(ROUTE_ID, 0),
+    nyct_snapshot.route_versions.get(ROUTE_ID + nyct_ingest.EXPRESS_ROUTE_SUFFIX, 0),
+), nyct_snapshot, show_all_lines))
+
+# Add cone of light indicating train direction
+
+####################################
+# Delays and scheduled departures
+####################################
+
+schedule_index = get_schedule_index()
+
+# Each live train's delay against its scheduled arrival at the stop it's stopped at
+train_delays = train_position_entities[['trip_id', 'direction', 'stop_id']].copy()
+train_delays['delay_minutes'] = (schedule_index.delays(train_position_entities) / 60).round(1)
+train_delays['stop_name'] = route.stations['stop_name'].reindex(
+    stops.set_index('stop_id')['parent_station'].reindex(train_delays['stop_id']).astype(str)
+).to_numpy()
+st.subheader('Delays')
+st.dataframe(
+    train_delays.dropna(subset=['delay_minutes'])[['trip_id', 'direction', 'stop_name', 'delay_minutes']],
+    hide_index=True
+)
+
+station = st.selectbox(
+    label='Station',
+    options=list(route.stations.index),
+    format_func=lambda parent_station: route.stations.at[parent_station, 'stop_name']
+)
+# Departures after the latest position in the feed (not the wall clock), so
+# that replayed feeds are compared with the timetable of their own time
+departures_after = float(train_position_entities['timestamp'].max()) if len(train_position_entities) else time.time()
+st.subheader('Next scheduled departures')
+for direction_suffix, direction_name in (('N', 'Northbound'), ('S', 'Southbound')):
+    try:
+        departures = schedule_index.next_departures(station + direction_suffix, departures_after)
+    except LookupError:
+        continue
+    st.text(direction_name)
+    st.dataframe(departures, hide_index=True)
+
+####################################
+# Journey planner
+####################################
+
+journey_planner = get_journey_planner()
+all_stops = get_gtfs_table('stops', ('stop_id', 'stop_name'))
+stop_names = pd.Series(all_stops['stop_name'].to_numpy(dtype=object), index=all_stops['stop_id'].to_numpy(dtype=object))
+st.subheader('Plan a journey')
+origin = st.selectbox(
+    label='From',
+    options=journey_planner.stations,
+    format_func=lambda station: stop_names.get(station, station)
+)
+destination = st.selectbox(
+    label='To',
+    options=journey_planner.stations,
+    format_func=lambda station: stop_names.get(station, station)
+)
+if st.checkbox('Account for live delays'):
+    journey_planner = get_delayed_journey_planner(get_feed_poller().store.published_at('nyct'))
+journey_legs = journey.legs_to_dataframe(
+    journey_planner.plan(origin, destination, departures_after),
+    schedule_index.timezone
 )
+if journey_legs.empty:
+    st.text('No journey found')
+else:
+    for column in ('from_stop_id', 'to_stop_id'):
+        journey_legs[column] = stop_names.reindex(journey_legs[column]).to_numpy()
+    journey_legs['trip_id'] = journey_legs['trip_id'].fillna('transfer')
+    st.dataframe(
+        journey_legs.rename(columns={'from_stop_id': 'from', 'to_stop_id': 'to', 'trip_id': 'trip'}),
+        hide_index=True
+    )
+
+####################################
+# Debug panel (with TRANSIT_METRICS set)
+####################################
 
-# Add cone of light indicating train direction
\ No newline at end of file
+if metrics.ENABLED:
+    metrics.record('render:subway', time.perf_counter() - render_start)
+    with st.expander('Debug: metrics'):
+        st.dataframe(metrics.summary(), hide_index=True)
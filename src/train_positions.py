@@ -0,0 +1,103 @@
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+import geometry
+import metrics
+
+# Vehicle positions older than this (relative to the latest one) are ignored
+MAX_POSITION_AGE = timedelta(minutes=1)
+
+
+# Keeps the latest position of each trip, dropping positions that are stale
+# compared with the most recent update in the feed. Sorts only the int64
+# timestamps, then takes the rows it needs, instead of sorting the whole frame.
+def latest_positions(entities: pd.DataFrame) -> pd.DataFrame:
+    timestamps = entities['timestamp'].to_numpy(dtype=np.int64)
+    newest_first = np.argsort(-timestamps, kind='stable')
+    newest_first = newest_first[~pd.Index(entities['trip_id'].to_numpy()[newest_first]).duplicated(keep='first')]
+    # Filter out old vehicle position updates
+    if len(newest_first):
+        age = timestamps[newest_first[0]] - timestamps[newest_first]
+        newest_first = newest_first[age < MAX_POSITION_AGE.total_seconds()]
+    return entities.iloc[newest_first]
+
+
+# Same as latest_positions, but staleness is judged against the most recent
+# update of each train's own route, so that the trains of a feed lagging
+# behind the others are kept (as when positions are taken line by line)
+def latest_positions_by_route(entities: pd.DataFrame) -> pd.DataFrame:
+    timestamps = entities['timestamp'].to_numpy(dtype=np.int64)
+    newest_first = np.argsort(-timestamps, kind='stable')
+    newest_first = newest_first[~pd.Index(entities['trip_id'].to_numpy()[newest_first]).duplicated(keep='first')]
+    if len(newest_first):
+        route_codes, _ = pd.factorize(entities['route_id'].to_numpy(dtype=object)[newest_first], use_na_sentinel=False)
+        # Rows are newest first, so a route's first row holds its newest timestamp
+        _, first_rows = np.unique(route_codes, return_index=True)
+        route_newest = timestamps[newest_first[first_rows]]
+        age = route_newest[route_codes] - timestamps[newest_first]
+        newest_first = newest_first[age < MAX_POSITION_AGE.total_seconds()]
+    return entities.iloc[newest_first]
+
+
+# Returns the number of trains at each (parent_station, current_status, direction)
+# of the route. stops maps platform stop_ids to their parent_station.
+# Rows are reduced to integer codes (station, status, direction) and counted
+# with one bincount over the combined code, rather than merged and grouped on strings.
+@metrics.instrumented('count_trains_by_station')
+def count_trains_by_station(entities: pd.DataFrame,
+                            stops: pd.DataFrame,
+                            route: geometry.RouteGeometry) -> pd.DataFrame:
+    stations = route.stations.index.astype(str).sort_values()
+    station_of_stop = stations.get_indexer(stops['parent_station'].to_numpy(dtype=object))
+    stop_rows = pd.Index(stops['stop_id'].to_numpy(dtype=object)).get_indexer(entities['stop_id'].to_numpy(dtype=object))
+    station_codes = np.where(stop_rows >= 0, station_of_stop[stop_rows], -1)
+
+    current_status = entities['current_status'].astype('category')
+    direction = entities['direction'].astype('category')
+    status_codes = current_status.cat.codes.to_numpy()
+    direction_codes = direction.cat.codes.to_numpy()
+    num_statuses = len(current_status.cat.categories)
+    num_directions = len(direction.cat.categories)
+
+    # Trains at stations off the route, or with no status/direction, aren't counted
+    counted = (station_codes >= 0) & (status_codes >= 0) & (direction_codes >= 0)
+    keys = (station_codes[counted] * num_statuses + status_codes[counted]) * num_directions + direction_codes[counted]
+    num_trains = np.bincount(keys, minlength=len(stations) * num_statuses * num_directions)
+    keys = np.flatnonzero(num_trains)
+    station_codes, rest = np.divmod(keys, num_statuses * num_directions)
+    status_codes, direction_codes = np.divmod(rest, num_directions)
+
+    return pd.DataFrame(
+        {'num_trains': num_trains[keys]},
+        index=pd.MultiIndex.from_arrays([
+            stations[station_codes],
+            pd.Categorical.from_codes(status_codes, dtype=current_status.dtype),
+            pd.Categorical.from_codes(direction_codes, dtype=direction.dtype),
+        ], names=['parent_station', 'current_status', 'direction'])
+    )
+
+
+# Dataframe for plotting active trains on map: train counts with the
+# coordinates they are drawn at, station names and display text
+def display_positions(train_counts: pd.DataFrame, route: geometry.RouteGeometry) -> pd.DataFrame:
+    train_positions_display = train_counts.reset_index()
+    # Use customized coordinates to represent in-progress and incoming trains
+    train_positions_display['lat'], train_positions_display['lon'] = route.place_trains(
+        train_positions_display['parent_station'].to_numpy(),
+        train_positions_display['current_status'].to_numpy(),
+        train_positions_display['direction'].to_numpy()
+    )
+
+    # Get English station names
+    train_positions_display['stop_name'] = route.stations['stop_name'].reindex(
+        train_positions_display['parent_station'].astype(str)
+    ).to_numpy()
+    # Format columns to contain the text that will be displayed rather than raw data.
+    # Labels are formatted once per distinct value, not once per row.
+    num_trains = train_positions_display['num_trains']
+    train_positions_display['num_trains'] = num_trains.astype(str) + np.where(num_trains > 1, ' trains', ' train')
+    current_status = train_positions_display['current_status'].astype('category')
+    train_positions_display['current_status'] = current_status.cat.rename_categories(
+        current_status.cat.categories.str.lower().str.replace('_', ' ')
+    )
+    return train_positions_display
@@ -0,0 +1,52 @@
+import os
+import shutil
+import pandas as pd
+import pytest
+import archive_decode
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks', 'fixtures')
+
+
+@pytest.fixture
+def archive(tmp_path):
+    # The same dump name in two daily directories
+    for day in ('2025-09-03', '2025-09-04'):
+        os.makedirs(tmp_path / 'archive' / day)
+        shutil.copy(os.path.join(FIXTURES_DIR, 'nyct_1234567.pb'), tmp_path / 'archive' / day / 'nyct_1234567.pb')
+    shutil.copy(os.path.join(FIXTURES_DIR, 'mbta_vehicle_positions.json'), tmp_path / 'archive' / 'vehicles.json')
+    return str(tmp_path / 'archive')
+
+
+def test_sources_are_paths_within_the_archive(archive, tmp_path):
+    out_dir = str(tmp_path / 'decoded')
+    report = archive_decode.decode_archive([archive], out_dir, workers=1)
+    assert report.files == 3 and not report.failed
+
+    positions = pd.read_parquet(os.path.join(out_dir, 'nyct_vehicle_positions'))
+    assert sorted(positions['source'].astype(str).unique()) == [
+        os.path.join('2025-09-03', 'nyct_1234567.pb'),
+        os.path.join('2025-09-04', 'nyct_1234567.pb'),
+    ]
+
+
+def test_nyct_trains_are_decoded(archive, tmp_path):
+    out_dir = str(tmp_path / 'decoded')
+    archive_decode.decode_archive([archive], out_dir, workers=1)
+    positions = pd.read_parquet(os.path.join(out_dir, 'nyct_vehicle_positions'))
+
+    assert positions['train_id'].notna().all()
+    assert positions['is_assigned'].dtype == 'boolean'
+    first = positions.iloc[0]
+    assert first['train_id'].endswith(f"{first['origin']}/{first['destination']}")
+
+
+def test_mbta_vehicles_and_carriages_are_written(archive, tmp_path):
+    out_dir = str(tmp_path / 'decoded')
+    report = archive_decode.decode_archive([archive], out_dir, workers=1)
+
+    vehicles = pd.read_parquet(os.path.join(out_dir, 'mbta_vehicles'))
+    carriages = pd.read_parquet(os.path.join(out_dir, 'mbta_carriages'))
+    assert len(vehicles) == report.rows['mbta_vehicles'] > 0
+    assert len(carriages) == report.rows['mbta_carriages'] > 0
+    assert set(carriages['vehicle_id']) <= set(vehicles['vehicle_id'])
+    assert (vehicles['source'].astype(str) == 'vehicles.json').all()
@@ -0,0 +1,32 @@
+import importlib.util
+import pandas as pd
+import pytest
+import cli
+
+
+@pytest.fixture
+def tables():
+    return {
+        'alerts': pd.DataFrame({'severity': [3, 7], 'short_header': ['Delays', 'Shuttle buses']}),
+        'alert_summary': pd.DataFrame([{'active_alerts': 2}]),
+    }
+
+
+@pytest.mark.parametrize('format, read', [('json', pd.read_json), ('parquet', pd.read_parquet)])
+def test_tables_are_written(tables, tmp_path, format, read):
+    paths = cli.write_tables(tables, str(tmp_path), format, timestamped=False)
+    assert paths == [str(tmp_path / f"alerts.{format}"), str(tmp_path / f"alert_summary.{format}")]
+    assert read(paths[0])['short_header'].tolist() == ['Delays', 'Shuttle buses']
+    assert sorted(path.name for path in tmp_path.iterdir()) == [f"alert_summary.{format}", f"alerts.{format}"]
+
+
+def test_parquet_is_refused_up_front_without_pyarrow(monkeypatch):
+    find_spec = importlib.util.find_spec
+    monkeypatch.setattr(importlib.util, 'find_spec', lambda name, *args: None if name == 'pyarrow' else find_spec(name, *args))
+    set_up = []
+    monkeypatch.setitem(cli.PIPELINES, 'alerts', lambda *args, **kwargs: set_up.append(args))
+
+    assert cli.available_formats() == ('json',)
+    with pytest.raises(SystemExit):
+        cli.main(['alerts', '--format', 'parquet'])
+    assert set_up == []
@@ -0,0 +1,217 @@
+import re
+import threading
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip('cv2')
+from google.protobuf import descriptor_pb2, descriptor_pool, message_factory
+import crowding
+from crowding import CrowdingPipeline, PersonCounter
+
+NUM_FRAMES = 20
+
+# Classes of each prior's confidences (VOC, with background)
+NUM_CLASSES = 21
+
+# Added to the person logit of every prior, so that the random network finds
+# people (how many depends on the frame) instead of none at all
+PERSON_BIAS = 2.0
+
+
+# The few messages of caffe.proto a .caffemodel of convolution weights needs
+def _net_parameter_class():
+    file = descriptor_pb2.FileDescriptorProto(name='caffe_weights.proto', package='caffe', syntax='proto2')
+    field = descriptor_pb2.FieldDescriptorProto
+    def message(name, fields):
+        descriptor = file.message_type.add(name=name)
+        for field_name, number, field_type, label, type_name in fields:
+            added = descriptor.field.add(name=field_name, number=number, type=field_type, label=label)
+            if type_name:
+                added.type_name = type_name
+            if field_type in (field.TYPE_FLOAT, field.TYPE_INT64) and label == field.LABEL_REPEATED:
+                added.options.packed = True
+    message('BlobShape', [('dim', 1, field.TYPE_INT64, field.LABEL_REPEATED, None)])
+    message('BlobProto', [
+        ('data', 5, field.TYPE_FLOAT, field.LABEL_REPEATED, None),
+        ('shape', 7, field.TYPE_MESSAGE, field.LABEL_OPTIONAL, '.caffe.BlobShape'),
+    ])
+    message('LayerParameter', [
+        ('name', 1, field.TYPE_STRING, field.LABEL_OPTIONAL, None),
+        ('type', 2, field.TYPE_STRING, field.LABEL_OPTIONAL, None),
+        ('blobs', 7, field.TYPE_MESSAGE, field.LABEL_REPEATED, '.caffe.BlobProto'),
+    ])
+    message('NetParameter', [
+        ('name', 1, field.TYPE_STRING, field.LABEL_OPTIONAL, None),
+        ('layer', 100, field.TYPE_MESSAGE, field.LABEL_REPEATED, '.caffe.LayerParameter'),
+    ])
+    pool = descriptor_pool.DescriptorPool()
+    pool.Add(file)
+    return message_factory.GetMessageClass(pool.FindMessageTypeByName('caffe.NetParameter'))
+
+
+# Random convolution weights of the shapes deploy.prototxt declares (the
+# trained weights are not in the repo), biased towards finding people
+@pytest.fixture(scope='module')
+def weights_path(tmp_path_factory):
+    with open(crowding.PROTOTXT_PATH) as f:
+        prototxt = f.read()
+    net = _net_parameter_class()(name='MobileNet-SSD')
+    rng = np.random.default_rng(0)
+    channels = {'data': 3}
+    for block in prototxt.split('\nlayer {')[1:]:
+        name = re.search(r'name: "([^"]+)"', block).group(1)
+        layer_type = re.search(r'type: "([^"]+)"', block).group(1)
+        bottom = re.search(r'bottom: "([^"]+)"', block)
+        top = re.search(r'top: "([^"]+)"', block)
+        if layer_type != 'Convolution':
+            if bottom and top and bottom.group(1) in channels:
+                channels.setdefault(top.group(1), channels[bottom.group(1)])
+            continue
+        outputs = int(re.search(r'num_output: (\d+)', block).group(1))
+        kernel = int(re.search(r'kernel_size: (\d+)', block).group(1))
+        group = re.search(r'group: (\d+)', block)
+        inputs = channels[bottom.group(1)] // (int(group.group(1)) if group else 1)
+        channels[top.group(1)] = outputs
+        layer = net.layer.add(name=name, type='Convolution')
+        weights = layer.blobs.add()
+        weights.shape.dim.extend([outputs, inputs, kernel, kernel])
+        weights.data.extend(
+            rng.standard_normal(outputs * inputs * kernel * kernel).astype(np.float32) * np.sqrt(2 / (inputs * kernel * kernel))
+        )
+        bias = layer.blobs.add()
+        bias.shape.dim.extend([outputs])
+        bias.data.extend(np.where(
+            ('mbox_conf' in name) & (np.arange(outputs) % NUM_CLASSES == crowding.PERSON_CLASS_ID),
+            PERSON_BIAS, 0.0,
+        ).astype(np.float32))
+    path = tmp_path_factory.mktemp('weights') / 'synthetic.caffemodel'
+    path.write_bytes(net.SerializeToString())
+    return str(path)
+
+
+def _frames() -> list[np.ndarray]:
+    rng = np.random.default_rng(1)
+    return [rng.integers(0, 256, (120, 160, 3), dtype=np.uint8) for _ in range(NUM_FRAMES)]
+
+
+@pytest.fixture(scope='module')
+def image_dir(tmp_path_factory):
+    path = tmp_path_factory.mktemp('images')
+    for i, frame in enumerate(_frames()):
+        cv2.imwrite(str(path / f"frame{i:03d}.png"), frame)
+    return str(path)
+
+
+@pytest.fixture(scope='module')
+def video_path(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('video') / 'platform.avi')
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 30, (160, 120))
+    for frame in _frames():
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+def _live_threads() -> int:
+    return sum(thread.is_alive() for thread in threading.enumerate())
+
+
+def test_frames_are_counted_in_batches(weights_path, image_dir, monkeypatch):
+    batch_sizes = []
+    count = PersonCounter.count
+    def record_batch(self, frames):
+        batch_sizes.append(len(frames))
+        return count(self, frames)
+    monkeypatch.setattr(PersonCounter, 'count', record_batch)
+
+    pipeline = CrowdingPipeline(weights_path, batch_size=8, adaptive=False)
+    counts = list(pipeline.run(image_dir))
+    assert batch_sizes == [8, 8, 4]
+    assert [frame_count.frame for frame_count in counts] == list(range(NUM_FRAMES))
+    assert pipeline.frames_counted == NUM_FRAMES
+
+
+def test_batched_counts_match_single_frames(weights_path, image_dir):
+    batched = [frame_count.people for frame_count in CrowdingPipeline(weights_path, batch_size=8, adaptive=False).run(image_dir)]
+    single = [frame_count.people for frame_count in CrowdingPipeline(weights_path, batch_size=1, adaptive=False).run(image_dir)]
+    assert batched == single
+    assert min(batched) > 0 and len(set(batched)) > 1
+
+
+def test_video_frames_and_times(weights_path, video_path):
+    counts = list(CrowdingPipeline(weights_path, batch_size=8, adaptive=False).run(video_path))
+    assert [frame_count.frame for frame_count in counts] == list(range(NUM_FRAMES))
+    assert counts[3].seconds == pytest.approx(3 / 30)
+
+
+def test_adaptive_stride_skips_frames(weights_path, image_dir):
+    pipeline = CrowdingPipeline(weights_path, batch_size=4, max_stride=3)
+    # A source far faster than the network can count
+    indices = [frame_count.frame for frame_count in pipeline.run(image_dir, source_fps=1e6)]
+    assert pipeline.stride == 3
+    assert len(indices) < NUM_FRAMES
+    steps = np.diff(indices)
+    assert (steps >= 1).all() and (steps <= 3).all()
+    assert steps[-1] == 3
+
+
+def test_people_are_counted_per_frame_above_confidence():
+    class Network:
+        def setInput(self, blob):
+            self.num_frames = blob.shape[0]
+        def forward(self):
+            # image, class, confidence, box
+            return np.array([
+                [0, crowding.PERSON_CLASS_ID, 0.9, 0, 0, 1, 1],
+                [0, crowding.PERSON_CLASS_ID, 0.6, 0, 0, 1, 1],
+                [0, 7, 0.9, 0, 0, 1, 1],
+                [2, crowding.PERSON_CLASS_ID, 0.8, 0, 0, 1, 1],
+                [2, crowding.PERSON_CLASS_ID, 0.3, 0, 0, 1, 1],
+            ], dtype=np.float32).reshape(1, 1, -1, 7)
+
+    counter = PersonCounter.__new__(PersonCounter)
+    counter.net = Network()
+    counter.confidence = 0.5
+    frames = [np.zeros((*crowding.INPUT_SIZE, 3), dtype=np.uint8)] * 4
+    assert counter.count(frames).tolist() == [2, 0, 1, 0]
+
+
+def test_stopping_early_stops_the_video_reader(weights_path, video_path):
+    pipeline = CrowdingPipeline(weights_path, batch_size=2, adaptive=False)
+    threads_before = _live_threads()
+    for _ in range(10):
+        for _ in pipeline.run(video_path):
+            break
+    assert _live_threads() == threads_before
+
+
+@pytest.mark.parametrize('source', ['image_dir', 'video_path'])
+def test_missing_weights_release_the_source(source, request, tmp_path, monkeypatch):
+    captures = []
+    class Capture(cv2.VideoCapture):
+        def release(self):
+            captures.remove(self)
+            super().release()
+    def open_capture(path):
+        captures.append(Capture(path))
+        return captures[-1]
+    monkeypatch.setattr(crowding.cv2, 'VideoCapture', open_capture)
+    pools, pools_started = [], []
+    class Pool(crowding.ThreadPoolExecutor):
+        def shutdown(self, *args, **kwargs):
+            pools.remove(self)
+            super().shutdown(*args, **kwargs)
+    def start_pool(*args):
+        pools.append(Pool(*args))
+        pools_started.append(pools[-1])
+        return pools[-1]
+    monkeypatch.setattr(crowding, 'ThreadPoolExecutor', start_pool)
+
+    threads_before = _live_threads()
+    pipeline = CrowdingPipeline(str(tmp_path / 'missing.caffemodel'), adaptive=False)
+    with pytest.raises(cv2.error):
+        next(pipeline.run(request.getfixturevalue(source)))
+    assert captures == [] and pools == []
+    # Only images are decoded on a thread pool
+    assert len(pools_started) == (source == 'image_dir')
+    assert _live_threads() == threads_before
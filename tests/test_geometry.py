@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+import pytest
+import geometry
+
+# Stations of a straight north-south line, south to north
+STATION_LATS = {'101': 40.70, '102': 40.71, '103': 40.72}
+POINTS_PER_STATION = 10
+
+
+def route_tables(shape_id: str, direction_id: int | None = None) -> dict[str, pd.DataFrame]:
+    trips = pd.DataFrame({'route_id': ['T'], 'trip_id': ['t1'], 'shape_id': [shape_id]})
+    if direction_id is not None:
+        trips['direction_id'] = [direction_id]
+    lats = np.linspace(40.70, 40.72, 2 * POINTS_PER_STATION + 1)
+    if geometry.shape_directions(np.array([shape_id]), trips).get(shape_id) == 'SOUTH':
+        lats = lats[::-1]
+    return {
+        'shape_points': geometry.sorted_shape_points(pd.DataFrame({
+            'shape_id': shape_id,
+            'shape_pt_lat': lats,
+            'shape_pt_lon': -73.9,
+            'shape_pt_sequence': np.arange(len(lats)),
+        })),
+        'trips': trips,
+        'stop_times': pd.DataFrame({'trip_id': 't1', 'stop_id': [f"{station}N" for station in STATION_LATS]}),
+        'stops': pd.DataFrame({
+            'stop_id': [f"{station}N" for station in STATION_LATS] + list(STATION_LATS),
+            'stop_name': [f"Station {station}" for station in STATION_LATS] * 2,
+            'stop_lat': list(STATION_LATS.values()) * 2,
+            'stop_lon': -73.9,
+            'parent_station': list(STATION_LATS) + [None] * len(STATION_LATS),
+        }),
+        'routes': pd.DataFrame({
+            'route_id': ['T', 'Z'], 'route_short_name': ['T', 'Z'], 'route_long_name': ['Test', 'Unused'],
+            'route_color': ['00933C', ''],
+        }),
+    }
+
+
+def build(shape_id: str, direction_id: int | None = None) -> dict[str, geometry.RouteGeometry]:
+    return geometry.build_route_geometries(**route_tables(shape_id, direction_id))
+
+
+@pytest.mark.parametrize('shape_id, direction_id', [
+    ('T..N01R', None),
+    ('T..S01R', None),
+    ('T.S01R', None),
+    # direction_id of the trips wins over the shape ID
+    ('T-shape-1', 1),
+])
+def test_trains_approach_their_stop_from_behind(shape_id, direction_id):
+    route = build(shape_id, direction_id)['T']
+    stations = np.array(['102', '102', '102'])
+    statuses = np.array(['IN_TRANSIT_TO', 'INCOMING_AT', 'STOPPED_AT'])
+    north_lat, _ = route.place_trains(stations, statuses, np.array(['NORTH'] * 3))
+    south_lat, _ = route.place_trains(stations, statuses, np.array(['SOUTH'] * 3))
+    # Northbound trains come from the south (lower latitudes), southbound from the north
+    assert north_lat[0] < north_lat[1] < STATION_LATS['102'] < south_lat[1] < south_lat[0]
+    assert north_lat[2] == south_lat[2] == STATION_LATS['102']
+
+
+def test_trains_approaching_the_first_station_stay_on_the_shape():
+    route = build('T..S01R')['T']
+    # A southbound shape starts at the northern terminal, 103
+    lat, _ = route.place_trains(np.array(['103']), np.array(['IN_TRANSIT_TO']), np.array(['SOUTH']))
+    assert STATION_LATS['102'] < lat[0] < STATION_LATS['103']
+
+
+def test_shape_directions():
+    shape_ids = np.array(['7..N95R', '7..S95R', 'GS.S01R', 'FS.N01R', 'custom'])
+    assert geometry.shape_directions(shape_ids, pd.DataFrame({'shape_id': [], 'route_id': []})) == {
+        '7..N95R': 'NORTH', '7..S95R': 'SOUTH', 'GS.S01R': 'SOUTH', 'FS.N01R': 'NORTH',
+    }
+    # direction_id of the trips wins over the shape ID
+    trips = pd.DataFrame({'shape_id': ['custom', '7..N95R'], 'direction_id': [1, 1]})
+    assert geometry.shape_directions(shape_ids, trips) == {
+        '7..N95R': 'SOUTH', '7..S95R': 'SOUTH', 'GS.S01R': 'SOUTH', 'FS.N01R': 'NORTH', 'custom': 'SOUTH',
+    }
+
+
+def test_route_without_stations_has_no_geometry_to_draw():
+    routes = build('T..N01R')
+    assert len(routes['T'].stations) == 3
+    assert len(routes['Z'].stations) == 0
+    assert routes['Z'].shape_ids == ()
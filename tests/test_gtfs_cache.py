@@ -0,0 +1,46 @@
+import os
+import numpy as np
+import gtfs_cache
+
+
+def write_stops(gtfs_dir, num_stops: int, mtime_ns: int) -> None:
+    path = os.path.join(gtfs_dir, 'stops.txt')
+    with open(path, 'w') as f:
+        f.write('stop_id,stop_name,stop_lat,stop_lon\n')
+        for i in range(num_stops):
+            f.write(f"S{i:05d},Stop {i},40.{i:05d},-73.{i:05d}\n")
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_recompile_keeps_frames_of_previous_version_readable(tmp_path):
+    gtfs_dir = str(tmp_path)
+    write_stops(gtfs_dir, 5000, 1_000_000_000)
+    old = gtfs_cache.load_table('stops', gtfs_dir=gtfs_dir)
+    assert not gtfs_cache.is_stale('stops', gtfs_dir)
+
+    # A smaller table, as when a GTFS update drops stops
+    write_stops(gtfs_dir, 10, 2_000_000_000)
+    assert gtfs_cache.is_stale('stops', gtfs_dir)
+    new = gtfs_cache.load_table('stops', gtfs_dir=gtfs_dir)
+    assert len(new) == 10
+    assert not gtfs_cache.is_stale('stops', gtfs_dir)
+
+    # The old frame's mapped columns still read to their end
+    assert len(old) == 5000
+    assert float(np.asarray(old['stop_lat'])[-1]) == 40.04999
+    assert str(old['stop_id'].iloc[-1]) == 'S04999'
+
+
+def test_recompile_replaces_the_version_directory(tmp_path):
+    gtfs_dir = str(tmp_path)
+    write_stops(gtfs_dir, 3, 1_000_000_000)
+    gtfs_cache.load_table('stops', gtfs_dir=gtfs_dir)
+    first = gtfs_cache._current_version_dir('stops', gtfs_dir)
+
+    write_stops(gtfs_dir, 4, 2_000_000_000)
+    gtfs_cache.load_table('stops', gtfs_dir=gtfs_dir)
+    second = gtfs_cache._current_version_dir('stops', gtfs_dir)
+
+    assert first != second
+    assert not os.path.exists(first)
+    assert set(os.listdir(os.path.dirname(second))) == {gtfs_cache.CURRENT_FILE_NAME, os.path.basename(second)}
@@ -0,0 +1,116 @@
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import requests
+import http_client
+
+# Seconds the /slow endpoint takes to answer
+SLOW_RESPONSE_DELAY = 1.0
+
+
+# Local stand-in for an API. Paths are /<behaviour>/<key>; every request's
+# client port is recorded so connection reuse can be checked.
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.hits[self.path] += 1
+            server.ports.append(self.client_address[1])
+            hits = server.hits[self.path]
+        behaviour, _, key = self.path.strip('/').partition('/')
+        if behaviour == 'flaky' and hits <= 2:
+            self.respond(503)
+        elif behaviour == 'slow':
+            time.sleep(SLOW_RESPONSE_DELAY)
+            # The client has timed out and closed the connection by now
+            try:
+                self.respond(200, key)
+            except (BrokenPipeError, ConnectionResetError):
+                self.close_connection = True
+        elif behaviour == 'delay':
+            time.sleep(float(key))
+            self.respond(200, key)
+        elif behaviour == 'status':
+            self.respond(int(key))
+        else:
+            self.respond(200, key)
+
+    def respond(self, status: int, body: str = ''):
+        content = body.encode()
+        self.send_response(status)
+        if status != 304:
+            self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        if status != 304:
+            self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.hits = Counter()
+    server.ports = []
+    thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+    thread.start()
+    # A fresh session per test, without waiting between retries
+    monkeypatch.setattr(http_client, '_session', None)
+    monkeypatch.setattr(http_client, 'BACKOFF_FACTOR', 0)
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    yield server
+    http_client.get_session().close()
+    server.shutdown()
+    server.server_close()
+
+
+def test_connections_are_kept_alive(server):
+    for key in ('a', 'b', 'c'):
+        assert http_client.get(f"{server.url}/ok/{key}").text == key
+    assert len(server.ports) == 3
+    assert len(set(server.ports)) == 1
+
+
+def test_unavailable_responses_are_retried(server):
+    resp = http_client.get(f"{server.url}/flaky/a")
+    assert resp.status_code == 200
+    assert server.hits['/flaky/a'] == 3
+
+
+def test_error_statuses_raise_but_not_modified_is_returned(server):
+    assert http_client.get(f"{server.url}/status/304").status_code == 304
+    with pytest.raises(requests.HTTPError):
+        http_client.get(f"{server.url}/status/404")
+    assert server.hits['/status/404'] == 1
+
+
+def test_timeouts_are_per_host(server, monkeypatch):
+    monkeypatch.setitem(http_client.ENDPOINT_TIMEOUTS, '127.0.0.1', (1, 0.1))
+    start = time.perf_counter()
+    with pytest.raises(requests.ConnectionError):
+        http_client.get(f"{server.url}/slow/a")
+    assert time.perf_counter() - start < SLOW_RESPONSE_DELAY
+    assert server.hits['/slow/a'] == http_client.MAX_RETRIES + 1
+    # Other hosts keep the default
+    assert http_client.timeout_for('http://localhost/slow/a') == http_client.DEFAULT_TIMEOUT
+
+
+def test_fetch_many_returns_results_in_order(server):
+    # The first URL finishes last
+    delays = ['0.3', '0.1', '0']
+    responses = http_client.fetch_many([f"{server.url}/delay/{delay}" for delay in delays])
+    assert [resp.text for resp in responses] == delays
+
+
+def test_fetch_many_raises_the_failed_urls_error(server):
+    urls = [f"{server.url}/ok/a", f"{server.url}/status/404", f"{server.url}/ok/c"]
+    with pytest.raises(requests.HTTPError) as error:
+        http_client.fetch_many(urls)
+    assert error.value.response.url == urls[1]
@@ -0,0 +1,92 @@
+from urllib.parse import urlsplit, parse_qs
+import pytest
+import http_client
+from mbta_metadata import MetadataCache, DestinationResolver
+
+ROUTES = {
+    'Red': {'direction_destinations': ['Ashmont/Braintree', 'Alewife']},
+}
+TRIPS = {
+    'trip-1': ('Red', 0),
+    'trip-2': ('Red', 1),
+}
+
+
+# Stands in for the /routes and /trips endpoints, recording the IDs each request asked for
+@pytest.fixture
+def api_requests(monkeypatch):
+    requests = []
+    def get_json(url: str) -> dict:
+        parts = urlsplit(url)
+        ids = parse_qs(parts.query)['filter[id]'][0].split(',')
+        requests.append((parts.path, ids))
+        if parts.path == '/trips':
+            return {
+                'data': [{
+                    'id': id,
+                    'attributes': {'direction_id': TRIPS[id][1]},
+                    'relationships': {'route': {'data': {'id': TRIPS[id][0]}}},
+                } for id in ids if id in TRIPS],
+                'included': [{'type': 'route', 'id': 'Red', 'attributes': ROUTES['Red']}],
+            }
+        return {'data': [{'id': id, 'attributes': ROUTES[id]} for id in ids if id in ROUTES]}
+    monkeypatch.setattr(http_client, 'get_json', get_json)
+    return requests
+
+
+def test_destinations_are_fetched_once(api_requests, tmp_path):
+    resolver = DestinationResolver('https://api.test/trips', MetadataCache('routes', 'https://api.test/routes', str(tmp_path)))
+    assert resolver.resolve(['trip-1', 'trip-2']) == {'trip-1': 'Ashmont/Braintree', 'trip-2': 'Alewife'}
+    assert resolver.resolve(['trip-2']) == {'trip-2': 'Alewife'}
+    assert api_requests == [('/trips', ['trip-1', 'trip-2'])]
+
+
+def test_unknown_trips_are_not_refetched_until_their_ttl(api_requests, tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('mbta_metadata.time.monotonic', lambda: now[0])
+    resolver = DestinationResolver('https://api.test/trips', MetadataCache('routes', 'https://api.test/routes', str(tmp_path)),
+                                   unknown_ttl_seconds=60)
+    assert resolver.resolve(['trip-1', 'added-1']) == {'trip-1': 'Ashmont/Braintree'}
+    now[0] += 30
+    assert resolver.resolve(['trip-1', 'added-1']) == {'trip-1': 'Ashmont/Braintree'}
+    assert api_requests == [('/trips', ['trip-1', 'added-1'])]
+
+    # Once the TTL has passed, the trip is looked up again (e.g. it has been published since)
+    now[0] += 31
+    monkeypatch.setitem(TRIPS, 'added-1', ('Red', 1))
+    assert resolver.resolve(['trip-1', 'added-1']) == {'trip-1': 'Ashmont/Braintree', 'added-1': 'Alewife'}
+    assert api_requests[1:] == [('/trips', ['added-1'])]
+
+
+def test_metadata_is_cached(api_requests, tmp_path):
+    cache = MetadataCache('routes', 'https://api.test/routes', str(tmp_path))
+    assert cache.get('Red') == ROUTES['Red']
+    assert cache.get_many(['Red', 'Red']) == {'Red': ROUTES['Red']}
+    assert api_requests == [('/routes', ['Red'])]
+
+    # Written through to disk, for the next process
+    reloaded = MetadataCache('routes', 'https://api.test/routes', str(tmp_path))
+    assert reloaded.get('Red') == ROUTES['Red']
+    assert len(api_requests) == 1
+
+
+def test_missing_ids_are_not_refetched_until_their_ttl(api_requests, tmp_path, monkeypatch):
+    now = [1_700_000_000.0]
+    monkeypatch.setattr('mbta_metadata.time.time', lambda: now[0])
+    cache = MetadataCache('routes', 'https://api.test/routes', str(tmp_path), missing_ttl_seconds=60)
+    assert cache.get_many(['Red', 'Shuttle-1']) == {'Red': ROUTES['Red']}
+    now[0] += 30
+    assert cache.get_many(['Red', 'Shuttle-1']) == {'Red': ROUTES['Red']}
+    with pytest.raises(KeyError):
+        cache.get('Shuttle-1')
+    assert api_requests == [('/routes', ['Red', 'Shuttle-1'])]
+
+    # Misses are kept on disk too
+    reloaded = MetadataCache('routes', 'https://api.test/routes', str(tmp_path), missing_ttl_seconds=60)
+    assert reloaded.get_many(['Shuttle-1']) == {}
+    assert len(api_requests) == 1
+
+    now[0] += 31
+    monkeypatch.setitem(ROUTES, 'Shuttle-1', {'direction_destinations': ['Harvard', 'Alewife']})
+    assert cache.get('Shuttle-1') == ROUTES['Shuttle-1']
+    assert api_requests[1:] == [('/routes', ['Shuttle-1'])]
@@ -0,0 +1,69 @@
+import numpy as np
+import mbta_occupancy
+from mbta_vehicles import flatten_feed
+
+
+def vehicle(trip_id: str | None, route_id: str | None, percentages: list[float]) -> dict:
+    trip = {key: value for key, value in (('trip_id', trip_id), ('route_id', route_id)) if value is not None}
+    return {
+        'id': f"{route_id}-{trip_id}",
+        'vehicle': {
+            'trip': trip,
+            'vehicle': {'label': f"{trip_id}-train"},
+            'multi_carriage_details': [
+                {'label': f"{trip_id}-{sequence}", 'carriage_sequence': sequence,
+                 'occupancy_status': 'MANY_SEATS_AVAILABLE', 'occupancy_percentage': percentage}
+                for sequence, percentage in enumerate(percentages, start=1)
+            ],
+        },
+    }
+
+
+def feed(vehicles: list[dict]) -> dict:
+    return {'header': {'timestamp': 1_757_000_000}, 'entity': vehicles}
+
+
+def test_vehicles_without_a_route_are_left_out():
+    carriages = mbta_occupancy.fleet_carriages(flatten_feed(feed([
+        vehicle('o1', 'Orange', [10, 20]),
+        # Not on any line, crowded enough to become the highest of any route it leaked into
+        vehicle('x1', None, [99, 99, 99]),
+        vehicle('r1', 'Red', [30, 40]),
+        vehicle('NONREV-1', 'Red', [50]),
+    ])))
+    assert list(carriages['trip_id'].unique()) == ['o1', 'r1']
+    assert (carriages['route_id'].cat.codes >= 0).all()
+
+    by_line = mbta_occupancy.occupancy_by_line(carriages)
+    assert list(by_line.index) == ['Orange', 'Red']
+    assert list(by_line['trips']) == [1, 1]
+    assert list(by_line['carriages']) == [2, 2]
+    assert list(by_line['mean_occupancy_percentage']) == [15.0, 35.0]
+    assert list(by_line['max_occupancy_percentage']) == [20.0, 40.0]
+
+    by_position = mbta_occupancy.occupancy_by_position(carriages)
+    assert list(by_position.index) == [('Orange', 1), ('Orange', 2), ('Red', 1), ('Red', 2)]
+    assert list(by_position['max_occupancy_percentage']) == [10.0, 20.0, 30.0, 40.0]
+
+
+def test_unreported_percentages_are_not_averaged():
+    carriages = mbta_occupancy.fleet_carriages(flatten_feed(feed([
+        vehicle('o1', 'Orange', [np.nan, 20]),
+        vehicle('o2', 'Orange', [np.nan, np.nan]),
+    ])))
+    by_line = mbta_occupancy.occupancy_by_line(carriages)
+    assert by_line.loc['Orange', 'trips'] == 2
+    assert by_line.loc['Orange', 'carriages'] == 4
+    assert by_line.loc['Orange', 'mean_occupancy_percentage'] == 20.0
+    assert by_line.loc['Orange', 'MANY_SEATS_AVAILABLE'] == 4
+
+    by_position = mbta_occupancy.occupancy_by_position(carriages)
+    assert np.isnan(by_position.loc[('Orange', 1), 'mean_occupancy_percentage'])
+
+
+def test_no_carriages():
+    carriages = mbta_occupancy.fleet_carriages(flatten_feed(feed([vehicle('x1', None, [50])])))
+    assert carriages.empty
+    assert mbta_occupancy.occupancy_by_line(carriages).empty
+    assert mbta_occupancy.occupancy_by_position(carriages).empty
+    assert mbta_occupancy.carriages_by_trip(carriages) == []
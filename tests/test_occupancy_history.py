@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+from occupancy_history import OccupancyHistory
+
+# The start of an hour
+HOUR = 1_700_006_400
+
+
+def record(history: OccupancyHistory, timestamp: int, values: dict[str, float]) -> None:
+    history.record(timestamp, np.array(list(values), dtype=object), np.array(list(values.values()), dtype=np.float32))
+
+
+def values(history: OccupancyHistory, label: str) -> list[float]:
+    return history.history(label)['value'].tolist()
+
+
+def test_full_store_evicts_least_recently_seen_carriage():
+    history = OccupancyHistory(max_carriages=3, path=None)
+    record(history, HOUR + 100, {'a': 11, 'b': 12, 'c': 13})
+    record(history, HOUR + 110, {'b': 22, 'c': 23})
+    # a was seen least recently, but is back in the same poll as the new d:
+    # b (seen at 110) makes room instead
+    record(history, HOUR + 120, {'a': 31, 'd': 44})
+
+    assert set(history.rows_by_label) == {'a', 'c', 'd'}
+    assert len(set(history.rows_by_label.values())) == 3
+    assert values(history, 'a') == [11, 31]
+    assert values(history, 'c') == [13, 23]
+    assert values(history, 'd') == [44]
+    assert values(history, 'b') == []
+
+
+def test_evicted_carriage_history_is_cleared():
+    history = OccupancyHistory(max_carriages=2, path=None)
+    record(history, HOUR + 100, {'a': 10, 'b': 20})
+    record(history, HOUR + 110, {'b': 21, 'c': 30})
+    assert set(history.rows_by_label) == {'b', 'c'}
+    assert values(history, 'b') == [20, 21]
+    assert values(history, 'c') == [30]
+
+
+def test_poll_larger_than_store_keeps_carriages_apart():
+    history = OccupancyHistory(max_carriages=2, path=None)
+    record(history, HOUR + 100, {'a': 10, 'b': 20, 'c': 30})
+    assert set(history.rows_by_label) == {'a', 'b'}
+    assert values(history, 'a') == [10]
+    assert values(history, 'b') == [20]
+
+
+def test_minute_rollup():
+    history = OccupancyHistory(path=None)
+    for i, value in enumerate([10, 20, 30, 40, 50, 60]):
+        record(history, HOUR + i * 10, {'a': value, 'b': 100 - value})
+    # The first poll of the next minute closes the previous one
+    assert history.history('a', 'minute').empty
+    record(history, HOUR + 60, {'a': 0})
+
+    minute = history.history('a', 'minute')
+    assert len(minute) == 1
+    assert minute.index[0].timestamp() == HOUR
+    row = minute.iloc[0]
+    assert (row['min'], row['mean'], row['max']) == (10, 35, 60)
+    assert row['p95'] == pytest.approx(np.percentile([10, 20, 30, 40, 50, 60], 95))
+    assert history.history('b', 'minute').iloc[0]['max'] == 90
+
+
+def test_hour_rollup_from_minutes():
+    history = OccupancyHistory(path=None)
+    # One sample per minute: minute m has occupancy m
+    for minute in range(60):
+        record(history, HOUR + minute * 60, {'a': minute})
+    record(history, HOUR + 3600, {'a': 0})
+
+    assert len(history.history('a', 'minute')) == 60
+    hour = history.history('a', 'hour')
+    assert len(hour) == 1
+    assert hour.index[0].timestamp() == HOUR
+    row = hour.iloc[0]
+    assert (row['min'], row['max']) == (0, 59)
+    assert row['mean'] == pytest.approx(29.5)
+    assert row['p95'] == pytest.approx(np.percentile(np.arange(60), 95))
+
+
+def test_saved_history_loads(tmp_path):
+    path = str(tmp_path / 'history.npz')
+    history = OccupancyHistory(max_carriages=4, path=path)
+    record(history, HOUR, {'a': 10})
+    record(history, HOUR + 60, {'a': 20})
+    history.save()
+
+    loaded = OccupancyHistory.load(path, max_carriages=4)
+    assert values(loaded, 'a') == [10, 20]
+    assert loaded.history('a', 'minute')['mean'].tolist() == [10]
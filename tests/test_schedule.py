@@ -0,0 +1,55 @@
+import datetime
+import numpy as np
+import pandas as pd
+import pytest
+from schedule import ScheduleIndex
+
+TRIP_ID = 'SUB-Weekday-00_060000_1..N01R'
+REALTIME_TRIP_ID = '060000_1..N01R'
+
+
+@pytest.fixture
+def schedule_index():
+    return ScheduleIndex(
+        pd.DataFrame({
+            'trip_id': [TRIP_ID] * 3,
+            'stop_id': ['101N', '102N', '103N'],
+            'arrival_time': ['10:00:00', '10:02:00', '10:05:00'],
+        }),
+        pd.DataFrame({'trip_id': [TRIP_ID], 'service_id': ['Weekday']}),
+        pd.DataFrame({
+            'service_id': ['Weekday'],
+            'monday': [1], 'tuesday': [1], 'wednesday': [1], 'thursday': [1], 'friday': [1],
+            'saturday': [0], 'sunday': [0],
+            'start_date': [20250101], 'end_date': [20251231],
+        }),
+        pd.DataFrame({'service_id': [], 'date': [], 'exception_type': []}),
+    )
+
+
+def at(schedule_index, hour: int, minute: int) -> int:
+    # A Monday
+    return int(datetime.datetime(2025, 6, 2, hour, minute, tzinfo=schedule_index.timezone).timestamp())
+
+
+def test_delays_of_stopped_trains(schedule_index):
+    positions = pd.DataFrame({
+        'trip_id': [REALTIME_TRIP_ID, REALTIME_TRIP_ID, 'unknown'],
+        'current_status': ['STOPPED_AT', 'STOPPED_AT', 'STOPPED_AT'],
+        'stop_id': ['101N', '102N', '101N'],
+        'timestamp': [at(schedule_index, 10, 3), at(schedule_index, 10, 1), at(schedule_index, 10, 3)],
+    })
+    delays = schedule_index.delays(positions)
+    assert delays[:2].tolist() == [180, -60]
+    assert np.isnan(delays[2])
+
+
+def test_trains_between_stops_have_no_delay(schedule_index):
+    # On time, between 10:00 at 101N and 10:02 at 102N
+    positions = pd.DataFrame({
+        'trip_id': [REALTIME_TRIP_ID] * 2,
+        'current_status': ['IN_TRANSIT_TO', 'INCOMING_AT'],
+        'stop_id': ['102N', '102N'],
+        'timestamp': [at(schedule_index, 10, 1)] * 2,
+    })
+    assert np.isnan(schedule_index.delays(positions)).all()
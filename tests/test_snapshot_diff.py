@@ -0,0 +1,52 @@
+import pandas as pd
+import train_positions
+from snapshot_diff import SnapshotTracker
+
+NOW = 1_700_000_000
+
+
+def positions(rows: list[tuple[str, str, str, int]]) -> pd.DataFrame:
+    return pd.DataFrame([
+        {'trip_id': trip_id, 'route_id': route_id, 'direction': 'North',
+         'current_status': 'STOPPED_AT', 'stop_id': stop_id, 'timestamp': timestamp}
+        for trip_id, route_id, stop_id, timestamp in rows
+    ])
+
+
+def test_moved_train_bumps_its_route_only():
+    tracker = SnapshotTracker()
+    tracker.update(positions([('a1', 'A', 'A01', NOW), ('c1', 'C', 'C01', NOW)]))
+    diff = tracker.update(positions([('a1', 'A', 'A02', NOW + 30), ('c1', 'C', 'C01', NOW + 30)]))
+    assert list(diff.moved) == ['a1']
+    assert diff.changed_routes == {'A'}
+    assert tracker.route_versions == {'A': 2, 'C': 1}
+
+
+def test_train_of_a_lagging_feed_is_tracked():
+    tracker = SnapshotTracker()
+    # The SIR feed lags 90 s behind the A train's feed
+    first = tracker.update(positions([('a1', 'A', 'A01', NOW), ('s1', 'SI', 'S01', NOW - 90)]))
+    assert set(first.appeared) == {'a1', 's1'}
+    assert tracker.route_versions == {'A': 1, 'SI': 1}
+
+    diff = tracker.update(positions([('a1', 'A', 'A01', NOW + 30), ('s1', 'SI', 'S02', NOW - 60)]))
+    assert list(diff.moved) == ['s1']
+    assert list(diff.disappeared) == []
+    assert tracker.route_versions == {'A': 1, 'SI': 2}
+
+
+def test_stale_train_disappears():
+    tracker = SnapshotTracker()
+    tracker.update(positions([('a1', 'A', 'A01', NOW), ('a2', 'A', 'A05', NOW)]))
+    # a2 stops reporting while the rest of its route carries on
+    diff = tracker.update(positions([('a1', 'A', 'A02', NOW + 120), ('a2', 'A', 'A05', NOW)]))
+    assert list(diff.disappeared) == ['a2']
+    assert list(diff.moved) == ['a1']
+
+
+def test_latest_positions_by_route_keeps_newest_row_per_trip():
+    latest = train_positions.latest_positions_by_route(positions([
+        ('a1', 'A', 'A01', NOW - 10), ('a1', 'A', 'A02', NOW),
+        ('s1', 'SI', 'S01', NOW - 300), ('s1', 'SI', 'S02', NOW - 200), ('s2', 'SI', 'S09', NOW - 290),
+    ]))
+    assert latest.set_index('trip_id')['stop_id'].to_dict() == {'a1': 'A02', 's1': 'S02'}
@@ -0,0 +1,126 @@
+import numpy as np
+import pandas as pd
+import pytest
+import geometry
+import nyct_decoder
+import train_positions
+import gtfs_realtime_NYCT_pb2 as nyct
+from gtfs_realtime_NYCT_pb2 import gtfs__realtime__pb2 as gtfs
+
+NOW = 1_700_000_000
+
+# Stations of the route, south to north
+STATIONS = {'101': 40.70, '102': 40.71, '103': 40.72}
+
+# (trip_id, stop_id, current_status, direction) of each train in the feed:
+# 101 has trains in both directions and 102 has none
+TRAINS = [
+    ('t1', '101N', 'STOPPED_AT', 'NORTH'),
+    ('t2', '101N', 'STOPPED_AT', 'NORTH'),
+    ('t3', '101S', 'IN_TRANSIT_TO', 'SOUTH'),
+    ('t4', '103N', 'INCOMING_AT', 'NORTH'),
+    ('t5', '103S', 'STOPPED_AT', 'SOUTH'),
+    # At a station off the route, at a stop missing from stops.txt, and without a direction
+    ('t6', '201N', 'STOPPED_AT', 'NORTH'),
+    ('t7', 'X99N', 'STOPPED_AT', 'NORTH'),
+    ('t8', '103N', 'STOPPED_AT', None),
+]
+
+
+def feed_message(trains: list[tuple[str, str, str, str | None]]) -> bytes:
+    message = gtfs.FeedMessage()
+    message.header.gtfs_realtime_version = '1.0'
+    for trip_id, stop_id, status, direction in trains:
+        vehicle = message.entity.add(id=trip_id).vehicle
+        vehicle.trip.trip_id = trip_id
+        vehicle.trip.route_id = 'T'
+        if direction is not None:
+            vehicle.trip.Extensions[nyct.nyct_trip_descriptor].direction = nyct.NyctTripDescriptor.Direction.Value(direction)
+        vehicle.current_status = gtfs.VehiclePosition.VehicleStopStatus.Value(status)
+        vehicle.stop_id = stop_id
+        vehicle.timestamp = NOW
+    return message.SerializeToString()
+
+
+@pytest.fixture
+def stops() -> pd.DataFrame:
+    platforms = [f"{station}{direction}" for station in list(STATIONS) + ['201'] for direction in 'NS']
+    return pd.DataFrame({
+        'stop_id': list(STATIONS) + ['201'] + platforms,
+        'stop_name': [f"Station {stop_id[:3]}" for stop_id in list(STATIONS) + ['201'] + platforms],
+        'stop_lat': [STATIONS.get(stop_id[:3], 40.8) for stop_id in list(STATIONS) + ['201'] + platforms],
+        'stop_lon': -73.9,
+        'parent_station': [None] * (len(STATIONS) + 1) + [stop_id[:3] for stop_id in platforms],
+    })
+
+
+@pytest.fixture
+def route(stops) -> geometry.RouteGeometry:
+    lats = np.linspace(40.70, 40.72, 21)
+    return geometry.build_route_geometries(
+        shape_points=geometry.sorted_shape_points(pd.DataFrame({
+            'shape_id': 'T..N01R', 'shape_pt_lat': lats, 'shape_pt_lon': -73.9, 'shape_pt_sequence': np.arange(len(lats)),
+        })),
+        trips=pd.DataFrame({'route_id': ['T'], 'trip_id': ['t'], 'shape_id': ['T..N01R']}),
+        stop_times=pd.DataFrame({'trip_id': 't', 'stop_id': [f"{station}N" for station in STATIONS]}),
+        stops=stops,
+        routes=pd.DataFrame({'route_id': ['T'], 'route_short_name': ['T'], 'route_long_name': ['Test'], 'route_color': ['00933C']}),
+    )['T']
+
+
+# The counts as they were computed before the integer-code version: a merge
+# with stops.txt and a groupby on the strings
+def reference_counts(entities: pd.DataFrame, stops: pd.DataFrame, route: geometry.RouteGeometry) -> pd.DataFrame:
+    positions = entities.merge(stops[['stop_id', 'parent_station']], on='stop_id')
+    return positions.loc[
+        positions['parent_station'].isin(route.stations.index)
+    ][['trip_id', 'current_status', 'direction', 'parent_station']].sort_values(
+        by='parent_station'
+    ).groupby(
+        by=['parent_station', 'current_status', 'direction'],
+        observed=True
+    ).agg(
+        num_trains=('trip_id', 'count'),
+    )
+
+
+def as_rows(train_counts: pd.DataFrame) -> list[tuple]:
+    return [
+        (str(station), str(status), str(direction), int(num_trains))
+        for (station, status, direction), num_trains in train_counts['num_trains'].items()
+    ]
+
+
+def test_counts_match_merge_and_groupby(stops, route):
+    entities = nyct_decoder.to_dataframe(nyct_decoder.decode_vehicle_positions(feed_message(TRAINS)))
+    train_counts = train_positions.count_trains_by_station(entities, stops[['stop_id', 'parent_station']], route)
+
+    assert as_rows(train_counts) == as_rows(reference_counts(entities, stops, route))
+    assert as_rows(train_counts) == [
+        ('101', 'IN_TRANSIT_TO', 'SOUTH', 1),
+        ('101', 'STOPPED_AT', 'NORTH', 2),
+        ('103', 'INCOMING_AT', 'NORTH', 1),
+        ('103', 'STOPPED_AT', 'SOUTH', 1),
+    ]
+    assert train_counts.index.names == ['parent_station', 'current_status', 'direction']
+
+
+def test_no_trains(stops, route):
+    entities = nyct_decoder.to_dataframe(nyct_decoder.decode_vehicle_positions(feed_message([])))
+    train_counts = train_positions.count_trains_by_station(entities, stops, route)
+    assert train_counts.empty
+    assert train_positions.display_positions(train_counts, route).empty
+
+
+def test_display_labels(stops, route):
+    entities = nyct_decoder.to_dataframe(nyct_decoder.decode_vehicle_positions(feed_message(TRAINS)))
+    display = train_positions.display_positions(train_positions.count_trains_by_station(entities, stops, route), route)
+    reference = reference_counts(entities, stops, route).reset_index()
+
+    assert list(display['num_trains']) == [
+        f"{num} train" + ("s" if num > 1 else "") for num in reference['num_trains']
+    ]
+    assert list(display['current_status'].astype(str)) == [
+        status.lower().replace('_', ' ') for status in reference['current_status']
+    ]
+    assert list(display['stop_name']) == ['Station 101', 'Station 101', 'Station 103', 'Station 103']